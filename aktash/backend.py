@@ -0,0 +1,66 @@
+from threading import Thread
+import multiprocessing
+import pickle
+import queue
+import time
+
+
+class StageThread(Thread):
+	"""Thread with the parts of `multiprocessing.Process` interface that DfStream uses."""
+	def __init__(self, group=None, target=None, args=(), kwargs=None):
+		super().__init__(group, target, args=args, kwargs=kwargs, daemon=True)
+		self.exitcode = None
+
+	def run(self):
+		try:
+			super().run()
+		except BaseException:
+			self.exitcode = 1
+			raise
+		self.exitcode = 0
+
+	def terminate(self):
+		pass  # threads can't be killed, they stop by the error signal in err_q
+
+
+# backend name => (queue class, process class)
+BACKENDS = {
+	'process': (multiprocessing.Queue, multiprocessing.Process),
+	'thread': (queue.Queue, StageThread),
+}
+
+
+def calibrate(df, run, threshold=1.5):
+	"""
+	Decides whether a chain of map functions is faster in threads or in processes, by running it
+	on a sample chunk `df`: `run(df)` should return the list of output chunks.
+
+	Runs the chain once to warm up on a few rows, once on the whole chunk, and twice at once in 2 threads.
+	If 2 threads are at least `threshold` times faster than serial runs, the functions release the GIL
+	(like vectorized shapely 2 and pyproj calls), and threads win. They also win if pickling
+	the input and output (what processes pay for) takes longer than the functions themselves.
+	Returns the backend name and a dict of the measurements.
+	"""
+	run(df.iloc[:10].copy())
+
+	start = time.perf_counter()
+	output = run(df.copy())
+	serial = time.perf_counter() - start
+
+	start = time.perf_counter()
+	pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)
+	for out in output:
+		pickle.dumps(out, protocol=pickle.HIGHEST_PROTOCOL)
+	pickling = time.perf_counter() - start
+
+	threads = [Thread(target=run, args=(df.copy(),)) for i in range(2)]
+	start = time.perf_counter()
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	parallel = time.perf_counter() - start
+
+	speedup = 2 * serial / parallel if parallel > 0 else 1.0
+	backend = 'thread' if speedup >= threshold or pickling >= serial else 'process'
+	return backend, {'serial': serial, 'parallel': parallel, 'speedup': speedup, 'pickling': pickling}
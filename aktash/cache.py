@@ -0,0 +1,166 @@
+from threading import Lock
+import hashlib
+import pickle
+import sqlite3
+import time
+
+
+SIMPLE_TYPES = (int, float, complex, str, bytes, bool, type(None))
+
+
+def _value_id(value, seen):
+	"""Stable text of a constant, default or closure value: functions by their identity, immutable plain values by repr."""
+	if hasattr(value, '__code__'):
+		return _function_text(value, seen)
+	if isinstance(value, (tuple, frozenset)):
+		items = [_value_id(v, seen) for v in value]
+		if isinstance(value, frozenset):
+			items.sort()
+		return f'{type(value).__name__}({",".join(items)})'
+	if isinstance(value, SIMPLE_TYPES):
+		return repr(value)
+	return type(value).__qualname__  # mutable and other objects: repr may change or contain their addresses
+
+
+def _code_text(code, seen):
+	"""Bytecode, constants (nested functions' code too) and used names of a code object."""
+	parts = [code.co_code.hex(), ','.join(code.co_names)]
+	for const in code.co_consts:
+		parts.append(_code_text(const, seen) if hasattr(const, 'co_code') else _value_id(const, seen))
+	return '|'.join(parts)
+
+
+def _cell_value(cell):
+	try:
+		return cell.cell_contents
+	except ValueError:  # not assigned yet
+		return None
+
+
+def _function_text(func, seen):
+	func = getattr(func, '__wrapped__', func)
+	name = f'{getattr(func, "__module__", "")}.{getattr(func, "__qualname__", repr(func))}'
+	code = getattr(func, '__code__', None)
+	if code is None or id(func) in seen:
+		return name
+	seen.add(id(func))
+	defaults = _value_id(getattr(func, '__defaults__', None) or (), seen)
+	closure = _value_id(tuple(_cell_value(c) for c in func.__closure__ or ()), seen)
+	return f'{name}:{_code_text(code, seen)}:{defaults}:{closure}'
+
+
+def function_id(func):
+	"""
+	Stable identity of a function: its module, name and code (bytecode, constants, used names),
+	defaults and closure values, so that a changed function misses the cache. Changes in the globals
+	or modules it calls are not seen, use `version` of the cache for them.
+	"""
+	func = getattr(func, '__wrapped__', func)
+	digest = hashlib.sha256(_function_text(func, set()).encode()).hexdigest()[:16] if hasattr(func, '__code__') else ''
+	return f'{getattr(func, "__module__", "")}.{getattr(func, "__qualname__", repr(func))}:{digest}'
+
+
+class ResultCache:
+	"""
+	On-disk cache of worker function results in SQLite, for `pooler` and `threader` (`cache` argument),
+	so that a rerun of a job calls the function only for new inputs.
+
+	Keys are SHA-256 of the function identity (`function_id`, or `version` if given) and the pickled input item.
+	Entries older than `ttl` seconds are not used. When the cache is larger than `max_size` bytes,
+	least recently used entries are deleted. Thread-safe.
+	"""
+	def __init__(self, path, max_size=None, ttl=None, version=None):
+		self.path = path
+		self.max_size = max_size
+		self.ttl = ttl
+		self.version = version
+		self.hits = self.misses = 0
+		self._lock = Lock()
+		self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+		self._db.execute('PRAGMA journal_mode=WAL')
+		self._db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value BLOB, size INTEGER, created REAL, accessed REAL)')
+		self._db.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+		self._size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+
+	def key(self, func, item):
+		"""Returns the key, or None if the item can't be pickled (then it's not cached)."""
+		try:
+			data = pickle.dumps(item, protocol=4)
+		except Exception:
+			return None
+		return hashlib.sha256((self.version or function_id(func)).encode() + b'\0' + data).hexdigest()
+
+	def get(self, key):
+		"""Returns `(True, value)` for a hit, `(False, None)` for a miss."""
+		if key is None:
+			return False, None
+
+		now = time.time()
+		with self._lock:
+			row = self._db.execute('SELECT value, created, size FROM results WHERE key = ?', (key,)).fetchone()
+			if row is not None and self.ttl is not None and row[1] < now - self.ttl:
+				self._db.execute('DELETE FROM results WHERE key = ?', (key,))
+				self._size -= row[2]
+				row = None
+
+			if row is None:
+				self.misses += 1
+				return False, None
+
+			self._db.execute('UPDATE results SET accessed = ? WHERE key = ?', (now, key))
+			self.hits += 1
+		return True, pickle.loads(row[0])
+
+	def set(self, key, value):
+		if key is None:
+			return
+
+		data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+		now = time.time()
+		with self._lock:
+			old = self._db.execute('SELECT size FROM results WHERE key = ?', (key,)).fetchone()
+			self._db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)', (key, data, len(data), now, now))
+			self._size += len(data) - (old[0] if old else 0)
+			if self.max_size is not None and self._size > self.max_size:
+				self._evict()
+
+	def _evict(self):
+		# delete the least recently used entries, down to 90% of max_size, to not evict on every set
+		target = self.max_size * 0.9
+		for key, size in self._db.execute('SELECT key, size FROM results ORDER BY accessed').fetchall():
+			if self._size <= target:
+				break
+			self._db.execute('DELETE FROM results WHERE key = ?', (key,))
+			self._size -= size
+
+	def expire(self):
+		"""Deletes the entries older than `ttl`."""
+		if self.ttl is None:
+			return
+		with self._lock:
+			self._db.execute('DELETE FROM results WHERE created < ?', (time.time() - self.ttl,))
+			self._size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+
+	@property
+	def size(self):
+		return self._size
+
+	def __len__(self):
+		with self._lock:
+			return self._db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+	def close(self):
+		self._db.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+def make_cache(cache):
+	"""`cache` argument of pooler/threader: a ResultCache, a path to the SQLite file, or None."""
+	if cache is None or isinstance(cache, ResultCache):
+		return cache
+	return ResultCache(cache)
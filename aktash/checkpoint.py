@@ -0,0 +1,69 @@
+import json
+import os
+
+
+class Checkpoint:
+	"""
+	Records which input chunks of a DfStream have been processed and written to the target,
+	so that a restarted job skips them and appends to the existing target.
+
+	The directory contains `meta.json` (parameters of the job, to avoid resuming a different one)
+	and `chunks.txt`, one line per committed chunk: `<chunk number> <rows>`.
+	Chunks are identified by their number in the source, so the source must be read
+	with the same chunk size when resuming.
+	"""
+	def __init__(self, path, **meta):
+		os.makedirs(path, exist_ok=True)
+		self.path = path
+		self.chunks_path = os.path.join(path, 'chunks.txt')
+		self.meta_path = os.path.join(path, 'meta.json')
+		self.done = self._load()
+		self._check_meta(meta)
+
+	def _load(self):
+		done = set()
+		if not os.path.exists(self.chunks_path):
+			return done
+
+		with open(self.chunks_path) as f:
+			for line in f:
+				try:
+					done.add(int(line.split()[0]))
+				except (IndexError, ValueError):  # the last line may be broken if the job crashed while writing it
+					continue
+		return done
+
+	def _check_meta(self, meta):
+		meta = {k: v for k, v in meta.items() if isinstance(v, (str, int, float, bool, type(None)))}
+		if os.path.exists(self.meta_path) and self.done:
+			with open(self.meta_path) as f:
+				saved = json.load(f)
+
+			different = {k for k in meta if k in saved and saved[k] != meta[k]}
+			if different:
+				raise ValueError(f'checkpoint in {self.path} was made for another job, parameters differ: {", ".join(sorted(different))}')
+
+		with open(self.meta_path, 'w') as f:
+			json.dump(meta, f)
+
+	@property
+	def resuming(self):
+		return len(self.done) > 0
+
+	def commit(self, chunk, rows=0):
+		"""Marks the chunk as written. Call it only after the writer has flushed the chunk's output."""
+		with open(self.chunks_path, 'a') as f:
+			f.write(f'{chunk} {rows}\n')
+			f.flush()
+			os.fsync(f.fileno())
+		self.done.add(chunk)
+
+	def ranges(self):
+		"""Committed chunks as a list of (first, last) ranges."""
+		result = []
+		for chunk in sorted(self.done):
+			if result and result[-1][1] == chunk - 1:
+				result[-1][1] = chunk
+			else:
+				result.append([chunk, chunk])
+		return [tuple(r) for r in result]
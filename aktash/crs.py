@@ -1,4 +1,8 @@
+import json
+import numpy as np
 import pyproj
+import shapely
+import threading
 from shapely.ops import transform as _transform
 from shapely import geometry
 from functools import partial
@@ -14,6 +18,43 @@ crs_dict = {4326: CRS4326, 3857: CRS3857, 3395: CRS3395, 7514: SIB, '4326': WGS,
 def transform(obj, crs_from, crs_to):
 	return _transform(partial(pyproj.transform, pyproj.Proj(crs_from), pyproj.Proj(crs_to)), obj)
 
+_transformers = threading.local()  # pyproj transformers must not be shared between threads
+
+
+def _crs_key(crs):
+	if isinstance(crs, pyproj.CRS):
+		return crs.to_wkt()
+	return json.dumps(crs, sort_keys=True) if isinstance(crs, dict) else str(crs)
+
+
+def _to_crs(crs):
+	if isinstance(crs, dict) and 'init' in crs:
+		return pyproj.CRS(crs['init'])
+	return pyproj.CRS(crs)
+
+
+def transformer(crs_from, crs_to):
+	"""Cached (per thread) `pyproj.Transformer` with x, y (lon, lat) axis order."""
+	cache = _transformers.__dict__.setdefault('cache', {})
+	key = _crs_key(crs_from), _crs_key(crs_to)
+	if key not in cache:
+		cache[key] = pyproj.Transformer.from_crs(_to_crs(crs_from), _to_crs(crs_to), always_xy=True)
+	return cache[key]
+
+
+def transform_geometries(geoms, crs_from, crs_to):
+	"""Reprojects an array of geometries at once, with one call of the transformer for all their coordinates."""
+	t = transformer(crs_from, crs_to)
+	def func(coords):
+		return np.column_stack(t.transform(coords[:, 0], coords[:, 1]))
+	return shapely.transform(np.asarray(geoms, dtype=object), func)
+
+
+def transform_crs(geom, crs_from, crs_to):
+	"""Reprojects one geometry, with a cached transformer."""
+	return transform_geometries([geom], crs_from, crs_to)[0]
+
+
 merc2wgs = partial(transform, MERC, WGS)
 merc2google = partial(transform, MERC, GOOGLE)
 google2wgs = partial(transform, GOOGLE, WGS)
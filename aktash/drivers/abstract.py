@@ -113,8 +113,9 @@ class DfReader:
 
 
 class DfWriter:
-	def __init__(self, target, **kwargs):
+	def __init__(self, target, append=False, **kwargs):
 		self.target = target
+		self.append = append  # add to existing target instead of overwriting it
 		self.fieldnames = None
 		self._handler = None
 		self.cleaned_up = False
@@ -146,6 +147,10 @@ class DfWriter:
 			self.init_handler()
 		self._handler.flush()
 		self._handler.close()
+
+	def flush(self):
+		if self._handler is not None:
+			self._handler.flush()
 		
 	def writedf(self, df):
 		raise NotImplementedError
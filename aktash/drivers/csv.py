@@ -37,7 +37,7 @@ class CsvReader(DfReader):
 			self.schema['geometry'] = loads(df[geom_col][0]).geom_type
 
 		with open(self.source) as f:
-			self.total = sum(1 for i in f)
+			self.total = sum(1 for i in f) - 1  # header
 
 	def __iter__(self):
 		self.handler = self.source	
@@ -84,22 +84,28 @@ class CsvReader(DfReader):
 
 
 class CsvWriter(DfWriter):
-	def __init__(self, target):
-		super().__init__(target)
+	def __init__(self, target, append=False):
+		super().__init__(target, append)
 		field_size_limit(10000000)
 
 	def init_handler(self, df=None):
 		if df is None:
 			df = pd.DataFrame()
-		from csv import DictWriter
+		from csv import DictWriter, reader
 		self.fieldnames = list(df)
-		if isinstance(self.target, str):
+		appending = self.append and isinstance(self.target, str) and os.path.exists(self.target)
+		if appending:
+			with open(self.target) as f:
+				self.fieldnames = next(reader(f), self.fieldnames)  # keep the columns order of the existing file
+			self._handler = open(self.target, 'a')
+		elif isinstance(self.target, str):
 			self._cleanup_target()
 			self._handler = open(self.target, 'w')
 		elif isinstance(self.target, io.TextIOWrapper):
 			self._handler = self.target
 		self.writer = DictWriter(self.handler, fieldnames=self.fieldnames, extrasaction='ignore')
-		self.writer.writeheader()
+		if not appending:
+			self.writer.writeheader()
 
 	def writedf(self, df):
 		if self._handler is None:
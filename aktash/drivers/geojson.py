@@ -4,6 +4,7 @@ from .abstract import DfDriver, DfReader, DfWriter
 from gistalt import dicts_to_json
 import geopandas as gpd
 from shapely.geometry import shape
+import os
 
 
 class GeoJsonReader(DfReader):
@@ -38,12 +39,9 @@ class GeoJsonReader(DfReader):
 			else:
 				self.row_iterator = iter(self.handler)
 
-			from tqdm import tqdm
-			with tqdm(total=self.total, desc=self.source) as pbar:
-				while not self._stopped_iteration:
-					df = self._next_df()
-					yield df
-					pbar.update(len(df))
+			# progress is shown by DfStream in the main process (aktash.progress)
+			while not self._stopped_iteration:
+				yield self._next_df()
 
 	def __iter__(self):
 		import fiona
@@ -60,6 +58,10 @@ class GeoJsonWriter(DfWriter):
 
 	def init_handler(self, df=None):
 		import fiona
+		if self.append and os.path.exists(self.target):
+			self._handler = fiona.open(self.target, 'a', driver=self.fiona_driver)
+			return
+
 		schema = self._get_schema(df)
 		# instead of self._cleanup_target(), delete fiona layer
 		crs = df.crs if df is not None else None
@@ -67,8 +67,13 @@ class GpkgWriter(GeoJsonWriter):
 			self.filename = self.target
 			layername = os.path.splitext(os.path.basename(self.target))[0]
 
+		layer_exists = os.path.exists(self.filename) and layername in fiona.listlayers(self.filename)
+		if self.append and layer_exists:
+			self._handler = fiona.open(self.filename, 'a', driver=self.fiona_driver, layer=layername)
+			return
+
 		# instead of self._cleanup_target(), delete fiona layer
-		if os.path.exists(self.filename) and layername in fiona.listlayers(self.filename):
+		if layer_exists:
 			fiona.remove(self.filename, self.fiona_driver, layername)
 
 		crs = df.crs if df is not None else None
@@ -0,0 +1,245 @@
+from .threader import pooler
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from queue import Empty, LifoQueue
+from threading import Condition, Lock
+from urllib.parse import urlencode, urlsplit
+import json as jsonlib
+import time
+
+
+THROTTLE_STATUSES = (429, 503)
+
+
+class HttpError(Exception):
+	def __init__(self, response):
+		super().__init__(f'HTTP {response.status}: {response.body[:200]!r}')
+		self.response = response
+		self.status = response.status
+
+
+class HttpResponse:
+	def __init__(self, status, headers, body):
+		self.status = status
+		self.headers = headers
+		self.body = body
+
+	def json(self):
+		return jsonlib.loads(self.body)
+
+	def raise_for_status(self):
+		if self.status >= 400:
+			raise HttpError(self)
+		return self
+
+
+class HttpSession:
+	"""
+	Thread-safe HTTP client that keeps up to `maxsize` idle keep-alive connections per host
+	and reuses them, instead of opening a connection per request.
+	"""
+	def __init__(self, maxsize=10, timeout=30, headers=None):
+		self.maxsize = maxsize
+		self.timeout = timeout
+		self.headers = headers or {}
+		self._pools = {}  # (scheme, host) => LifoQueue of idle connections
+		self._lock = Lock()
+		self.connections_opened = 0
+
+	def _pool(self, key):
+		with self._lock:
+			if key not in self._pools:
+				self._pools[key] = LifoQueue()
+			return self._pools[key]
+
+	def _connect(self, scheme, host):
+		with self._lock:
+			self.connections_opened += 1
+		cls = HTTPSConnection if scheme == 'https' else HTTPConnection
+		return cls(host, timeout=self.timeout)
+
+	def _send(self, conn, method, path, data, headers):
+		# a connection that failed (timeout, reset, bad response...) is closed, never pooled
+		try:
+			conn.request(method, path, body=data, headers=headers)
+			response = conn.getresponse()
+			return response, response.read()
+		except BaseException:
+			conn.close()
+			raise
+
+	def request(self, method, url, params=None, json=None, data=None, headers=None):
+		parts = urlsplit(url)
+		path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+		if params:
+			path += ('&' if parts.query else '?') + urlencode(params)
+
+		headers = {**self.headers, **(headers or {})}
+		if json is not None:
+			data = jsonlib.dumps(json).encode()
+			headers.setdefault('Content-Type', 'application/json')
+
+		pool = self._pool((parts.scheme, parts.netloc))
+		try:
+			conn, reused = pool.get_nowait(), True
+		except Empty:
+			conn, reused = self._connect(parts.scheme, parts.netloc), False
+
+		try:
+			response, body = self._send(conn, method, path, data, headers)
+		except (HTTPException, ConnectionError):
+			if not reused:
+				raise
+			# the server has closed an idle connection, try once more with a new one
+			conn = self._connect(parts.scheme, parts.netloc)
+			response, body = self._send(conn, method, path, data, headers)
+
+		if response.will_close or pool.qsize() >= self.maxsize:
+			conn.close()
+		else:
+			pool.put(conn)
+		return HttpResponse(response.status, dict(response.getheaders()), body)
+
+	def get(self, url, **kwargs):
+		return self.request('GET', url, **kwargs)
+
+	def post(self, url, **kwargs):
+		return self.request('POST', url, **kwargs)
+
+	def close(self):
+		for pool in self._pools.values():
+			while True:
+				try:
+					pool.get_nowait().close()
+				except Empty:
+					break
+
+
+class TokenBucket:
+	"""Rate limit of `rate` calls per second on average, with bursts up to `burst` calls."""
+	def __init__(self, rate, burst=None):
+		self.rate = rate
+		self.burst = burst or max(rate, 1)
+		self.tokens = self.burst
+		self._last = time.monotonic()
+		self._lock = Lock()
+
+	def acquire(self, n=1):
+		while True:
+			with self._lock:
+				now = time.monotonic()
+				self.tokens = min(self.burst, self.tokens + (now - self._last) * self.rate)
+				self._last = now
+				if self.tokens >= n:
+					self.tokens -= n
+					return
+				wait = (n - self.tokens) / self.rate
+			time.sleep(wait)
+
+
+class AdaptiveLimit:
+	"""
+	Concurrency limit that adapts to the backend (additive increase, multiplicative decrease):
+	it halves when the server throttles, and grows by one after `limit` successful calls in a row,
+	up to `maximum`.
+	"""
+	def __init__(self, maximum, minimum=1):
+		self.maximum = maximum
+		self.minimum = minimum
+		self.limit = maximum
+		self.active = 0
+		self._successes = 0
+		self._cond = Condition()
+
+	def __enter__(self):
+		with self._cond:
+			while self.active >= self.limit:
+				self._cond.wait()
+			self.active += 1
+
+	def __exit__(self, *exc):
+		with self._cond:
+			self.active -= 1
+			self._cond.notify()
+
+	def success(self):
+		with self._cond:
+			self._successes += 1
+			if self._successes >= self.limit and self.limit < self.maximum:
+				self.limit += 1
+				self._successes = 0
+				self._cond.notify()
+
+	def throttle(self):
+		with self._cond:
+			self.limit = max(self.minimum, self.limit // 2)
+			self._successes = 0
+
+
+def _is_throttled(error):
+	status = getattr(error, 'status', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+	return status in THROTTLE_STATUSES
+
+
+def _batches(items, size):
+	batch = []
+	for item in items:
+		batch.append(item)
+		if len(batch) == size:
+			yield batch
+			batch = []
+	if batch:
+		yield batch
+
+
+def http_pooler(worker_function, input_array, threads=10, batch_size=None, rate=None, burst=None,
+		adaptive=True, retries=3, backoff=0.5, session=None, tqdm_=None, errors=None, ordered=False):
+	"""
+	`pooler` for HTTP-backed worker functions, like routing: calls `worker_function(data, session)`
+	in `threads` threads and yields `(result, data)` for each item of `input_array`.
+
+	* `session`: shared `HttpSession` (created with `threads` keep-alive connections by default).
+	* `batch_size`: if set, the function gets a list of up to `batch_size` items (for backends with
+		batch requests, like routing matrices) and returns a list of results in the same order.
+	* `rate`, `burst`: token bucket limit of calls (batches) per second.
+	* `adaptive`: lowers concurrency when the server throttles (HTTP 429 or 503, from
+		`response.raise_for_status()`), and slowly raises it back. Throttled calls are retried `retries`
+		times with exponential `backoff` seconds.
+	* `errors='ignore'`: failed items yield `(None, data)`, as in `pooler`.
+	"""
+	own_session = session is None
+	session = session or HttpSession(maxsize=threads)
+	bucket = TokenBucket(rate, burst) if rate else None
+	limit = AdaptiveLimit(threads)
+
+	def call(data):
+		for attempt in range(retries + 1):
+			if bucket is not None:
+				bucket.acquire()
+			try:
+				with limit:
+					result = worker_function(data, session)
+				if adaptive:
+					limit.success()
+				return result
+			except Exception as e:
+				if not _is_throttled(e) or attempt == retries:
+					raise
+				if adaptive:
+					limit.throttle()
+				time.sleep(backoff * 2 ** attempt)
+
+	items = _batches(input_array, batch_size) if batch_size else input_array
+	try:
+		for result, data in pooler(call, items, threads, tqdm_, errors, ordered=ordered):
+			if not batch_size:
+				yield result, data
+				continue
+
+			if result is None:  # failed batch with errors='ignore'
+				result = [None] * len(data)
+			elif len(result) != len(data):
+				raise ValueError(f'{worker_function.__name__} returned {len(result)} results for a batch of {len(data)}')
+			yield from zip(result, data)
+	finally:
+		if own_session:
+			session.close()
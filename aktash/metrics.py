@@ -0,0 +1,251 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from queue import Empty
+import json
+import os
+import threading
+import time
+
+
+COUNTERS = ('rows_in', 'chunks_in', 'rows_out', 'chunks_out', 'rows_done', 'rows_failed', 'retries', 'busy')
+
+
+def _rows(df):
+	try:
+		return len(df)
+	except TypeError:
+		return 1
+
+
+class StageMeter:
+	"""
+	Counts rows, chunks and time spent in one process of a DfStream (reader, worker or writer).
+	Deltas are sent to the main process through `queue` every `flush_interval` seconds and on `close()`.
+	If `queue` is None, the meter does nothing, so the stream routines can call it unconditionally.
+	In the main process, `queue` may be the StreamMetrics object itself.
+	"""
+	def __init__(self, stage, queue=None, flush_interval=1.0):
+		self.stage = stage
+		self.queue = queue
+		self.flush_interval = flush_interval
+		self.started = self._last_flush = time.monotonic()
+		self._reset()
+
+	def _reset(self):
+		self.counters = defaultdict(float)
+		self.blocked = defaultdict(float)
+
+	def count_in(self, df):
+		if self.queue is not None:
+			self.counters['rows_in'] += _rows(df)
+			self.counters['chunks_in'] += 1
+
+	def count_out(self, df):
+		if self.queue is not None:
+			self.counters['rows_out'] += _rows(df)
+			self.counters['chunks_out'] += 1
+			self._maybe_flush()
+
+	def count_done(self, df):
+		"""Input rows that have been completely processed (for progress, unlike `count_in` at the start)."""
+		if self.queue is not None:
+			self.counters['rows_done'] += _rows(df)
+			self._maybe_flush()
+
+	def count_failed(self, df):
+		"""Rows that failed after all retries (see `DfStream.on_error`)."""
+		if self.queue is not None:
+			self.counters['rows_failed'] += _rows(df)
+
+	def count_retry(self):
+		if self.queue is not None:
+			self.counters['retries'] += 1
+
+	@contextmanager
+	def blocked_on(self, queue_name):
+		"""Measures time spent waiting in `get` or `put` of a queue."""
+		start = time.monotonic()
+		try:
+			yield
+		finally:
+			if self.queue is not None:
+				self.blocked[queue_name] += time.monotonic() - start
+
+	@contextmanager
+	def busy(self):
+		"""Measures time spent doing the actual work (reading, mapping, writing)."""
+		start = time.monotonic()
+		try:
+			yield
+		finally:
+			if self.queue is not None:
+				self.counters['busy'] += time.monotonic() - start
+
+	def _maybe_flush(self):
+		if time.monotonic() - self._last_flush >= self.flush_interval:
+			self.flush()
+
+	def flush(self, final=False):
+		if self.queue is None:
+			return
+
+		now = time.monotonic()
+		self.queue.put({
+			'stage': self.stage,
+			'pid': (os.getpid(), threading.get_ident()),  # thread backend runs stages in threads of one process
+			'counters': dict(self.counters),
+			'blocked': dict(self.blocked),
+			'wall': now - self._last_flush,
+			'final': final,
+		})
+		self._last_flush = now
+		self._reset()
+
+	def close(self):
+		self.flush(final=True)
+
+
+class StreamMetrics:
+	"""
+	Aggregates StageMeter messages from all the processes of a stream, and samples queue depths.
+	Lives in the main process. Call `collect()` periodically, then `report()`, `summary()`,
+	`write_json(path)` or `write_prometheus(path)`.
+	"""
+	def __init__(self, queue, watched_queues=None, max_samples=10_000):
+		self.queue = queue
+		self.watched_queues = watched_queues or {}
+		self.max_samples = max_samples
+		self.started = time.monotonic()
+		self.stages = defaultdict(lambda: {
+			'counters': defaultdict(float),
+			'blocked': defaultdict(float),
+			'wall': 0.0,
+			'pids': set(),
+			'finished': 0,
+		})
+		self.depths = defaultdict(list)
+
+	def collect(self):
+		"""Drains the metrics queue without blocking and takes a sample of queue depths."""
+		while True:
+			try:
+				msg = self.queue.get_nowait()
+			except Empty:
+				break
+			self._add(msg)
+
+		self.sample_depths()
+
+	def put(self, msg):
+		"""Adds a StageMeter message. Lets StageMeter in the main process report directly, bypassing the queue."""
+		self._add(msg)
+
+	def _add(self, msg):
+		stage = self.stages[msg['stage']]
+		for k, v in msg['counters'].items():
+			stage['counters'][k] += v
+		for k, v in msg['blocked'].items():
+			stage['blocked'][k] += v
+		stage['wall'] += msg['wall']
+		stage['pids'].add(msg['pid'])
+		if msg['final']:
+			stage['finished'] += 1
+
+	def sample_depths(self):
+		t = time.monotonic() - self.started
+		for name, q in self.watched_queues.items():
+			try:
+				depth = q.qsize()
+			except (NotImplementedError, OSError, ValueError):  # macOS has no qsize, closed queues raise
+				continue
+
+			samples = self.depths[name]
+			samples.append((round(t, 3), depth))
+			if len(samples) > self.max_samples:
+				del samples[::2]  # thin out old samples, keep the time span
+
+	def report(self):
+		stages = {}
+		for name, stage in self.stages.items():
+			data = {k: stage['counters'].get(k, 0) for k in COUNTERS}
+			for k in ('rows_in', 'chunks_in', 'rows_out', 'chunks_out', 'rows_done', 'rows_failed', 'retries'):
+				data[k] = int(data[k])
+			data['blocked'] = dict(stage['blocked'])
+			data['processes'] = len(stage['pids'])
+			data['finished'] = stage['finished']
+			data['wall'] = stage['wall']
+			data['idle'] = max(stage['wall'] - data['busy'], 0.0)
+			data['busy_ratio'] = data['busy'] / stage['wall'] if stage['wall'] else None
+			stages[name] = data
+
+		queues = {}
+		for name, samples in self.depths.items():
+			values = [d for t, d in samples]
+			queues[name] = {
+				'last': values[-1] if values else None,
+				'max': max(values) if values else None,
+				'mean': sum(values) / len(values) if values else None,
+				'samples': samples,
+			}
+
+		return {'elapsed': time.monotonic() - self.started, 'stages': stages, 'queues': queues}
+
+	def summary(self):
+		"""One-line human-readable summary, to print while the stream is running."""
+		report = self.report()
+		parts = [f'{report["elapsed"]:.0f}s']
+		for name, s in report['stages'].items():
+			blocked = ', '.join(f'{q} {v:.1f}s' for q, v in s['blocked'].items())
+			busy = f'{s["busy_ratio"]:.0%}' if s['busy_ratio'] is not None else '-'
+			failed = f', {s["rows_failed"]:,d} rows failed' if s['rows_failed'] else ''
+			parts.append(f'{name} x{s["processes"]}: {s["rows_in"]:,d} rows in, {s["rows_out"]:,d} rows out{failed}, busy {busy}' + (f', blocked {blocked}' if blocked else ''))
+
+		for name, q in report['queues'].items():
+			parts.append(f'{name} depth {q["last"]} (max {q["max"]})')
+
+		return ' | '.join(parts)
+
+	def write_json(self, path):
+		with open(path, 'w') as f:
+			json.dump(self.report(), f, indent=2)
+
+	def prometheus(self, prefix='aktash_stream'):
+		"""Returns the report in Prometheus text exposition format."""
+		report = self.report()
+		lines = []
+
+		def metric(name, kind, help_, values):
+			lines.append(f'# HELP {prefix}_{name} {help_}')
+			lines.append(f'# TYPE {prefix}_{name} {kind}')
+			for labels, value in values:
+				if value is None:
+					continue
+				label_str = ','.join(f'{k}="{v}"' for k, v in labels.items())
+				lines.append(f'{prefix}_{name}' + (f'{{{label_str}}}' if label_str else '') + f' {value}')
+
+		stages = report['stages']
+		for key, help_ in (
+				('rows_in', 'Rows received by the stage'),
+				('chunks_in', 'Chunks received by the stage'),
+				('rows_out', 'Rows emitted by the stage'),
+				('chunks_out', 'Chunks emitted by the stage'),
+				('rows_done', 'Input rows completely processed by the stage'),
+				('rows_failed', 'Rows that failed after all retries'),
+				('retries', 'Retries of failed chunks or their parts')):
+			metric(f'{key}_total', 'counter', help_, [({'stage': n}, s[key]) for n, s in stages.items()])
+
+		metric('busy_seconds_total', 'counter', 'Time spent working', [({'stage': n}, s['busy']) for n, s in stages.items()])
+		metric('idle_seconds_total', 'counter', 'Time spent not working', [({'stage': n}, s['idle']) for n, s in stages.items()])
+		metric('blocked_seconds_total', 'counter', 'Time spent waiting on a queue',
+			[({'stage': n, 'queue': q}, v) for n, s in stages.items() for q, v in s['blocked'].items()])
+		metric('processes', 'gauge', 'Processes that reported metrics', [({'stage': n}, s['processes']) for n, s in stages.items()])
+
+		queues = report['queues']
+		metric('queue_depth', 'gauge', 'Last sampled queue depth', [({'queue': n}, q['last']) for n, q in queues.items()])
+		metric('queue_depth_max', 'gauge', 'Maximum sampled queue depth', [({'queue': n}, q['max']) for n, q in queues.items()])
+		metric('elapsed_seconds', 'gauge', 'Time since the stream started', [({}, report['elapsed'])])
+		return '\n'.join(lines) + '\n'
+
+	def write_prometheus(self, path):
+		with open(path, 'w') as f:
+			f.write(self.prometheus())
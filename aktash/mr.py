@@ -1,60 +1,224 @@
 #!/usr/bin/python3
 
 # mr (map/reduce)
-from functools import wraps
-from multiprocessing import cpu_count, Queue, Process
+from functools import partial
+from collections import defaultdict
+from contextlib import ExitStack
+from multiprocessing import cpu_count
+from queue import Empty
+from .backend import BACKENDS, calibrate
+from .checkpoint import Checkpoint
+from .metrics import StageMeter, StreamMetrics
+from .progress import Progress
+from .partition import make_partition, partition_name, route, ShardPartition, TileGrid
+from .shuffle import apply_groups, key_hashes, SpillBuffer
+import asyncio
+import copy
 import inspect
 from . import io, AKDEBUG
+import json
+import os
+import pandas as pd
 import sys
+import threading
+import time
+import traceback
 
 
-def _map_dec(func):
-	@wraps(func)
-	def decorated(*args, **kwargs):
-		gen = func(*args, **kwargs)
-		if not inspect.isgenerator(gen):
-			gen = [gen]
-		for val in gen:
-			if val is not None:
-				yield val
+# decorators return partials of module-level functions instead of closures,
+# so that the stages can be pickled and sent to WorkerPool processes
 
-	return decorated
+def _map_step(func, *args, **kwargs):
+	gen = func(*args, **kwargs)
+	if not inspect.isgenerator(gen):
+		gen = [gen]
+	for val in gen:
+		if val is not None:
+			yield val
 
-def _reduce_dec(func):
-	gen_func = func
-	if not inspect.isgeneratorfunction(func):
-		@wraps(func)
+def _map_dec(func):
+	return partial(_map_step, func)
+
+def _reduce_step(func, source):
+	if inspect.isgeneratorfunction(func):
+		gen_func = func
+	else:
 		def gen_func(prev_df, next_df):
 			yield func(prev_df, next_df)
 
-	@wraps(gen_func)
-	def decorated(source):
-		store = [None]
-		for next_df in source:
-			if next_df is None:
-				continue
+	store = [None]
+	for next_df in source:
+		if next_df is None:
+			continue
 
-			prev_df = store[0]
-			for data in gen_func(prev_df, next_df):
-				if not isinstance(data, (tuple, list)):
-					data = (data,)
+		prev_df = store[0]
+		for data in gen_func(prev_df, next_df):
+			if not isinstance(data, (tuple, list)):
+				data = (data,)
 
-				if len(data) == 0:
-					raise ValueError(f'{func.__name__} outputs a 0-length list')
+			if len(data) == 0:
+				raise ValueError(f'{func.__name__} outputs a 0-length list')
 
-				if len(data) > 2:
-					raise ValueError(f'{func.__name__} outputs move than 2 items, can\'t unpack')
+			if len(data) > 2:
+				raise ValueError(f'{func.__name__} outputs move than 2 items, can\'t unpack')
 
-				if len(data) == 1:
-					store[0] = data[0]
+			if len(data) == 1:
+				store[0] = data[0]
 
-				else:
-					store[0], emit = data
-					yield emit
+			else:
+				store[0], emit = data
+				yield emit
+
+	yield store[0]
+
+def _reduce_dec(func):
+	return partial(_reduce_step, func)
+
+
+class _AsyncStage:
+	"""
+	Runs `async def func(df, session)` map function in a worker process. Each worker has its own
+	event loop and one HTTP session that is reused for all the chunks, so connections are kept alive.
+	`concurrency` limits the number of simultaneous connections (requests) of the session per worker.
+
+	`session_factory` is a function that takes `concurrency` and returns an async session object.
+	By default, it's `aiohttp.ClientSession` with a connector limited to `concurrency` connections.
+	"""
+	def __init__(self, func, concurrency=10, session_factory=None):
+		if not inspect.iscoroutinefunction(func):
+			raise TypeError(f'{func.__name__} is not an `async def` function')
+
+		self.func = func
+		self.__name__ = func.__name__
+		self.concurrency = concurrency
+		self.session_factory = session_factory or _aiohttp_session
+		self._loops = {}  # (pid, thread) => [loop, session], since with thread backend workers share the stage
+
+	def _state(self):
+		# created lazily, in the worker process or thread
+		key = (os.getpid(), threading.get_ident())
+		if key not in self._loops:
+			self._loops[key] = [asyncio.new_event_loop(), None]
+		return self._loops[key]
+
+	def __call__(self, df):
+		state = self._state()
+		result = state[0].run_until_complete(self._call(state, df))
+		if result is not None:
+			yield result
+
+	async def _call(self, state, df):
+		if state[1] is None:
+			state[1] = self.session_factory(self.concurrency)
+		return await self.func(df, state[1])
+
+	def close(self):
+		state = self._loops.pop((os.getpid(), threading.get_ident()), None)
+		if state is None:
+			return
+
+		loop, session = state
+		if session is not None and hasattr(session, 'close'):
+			loop.run_until_complete(session.close())
+		loop.close()
+
+
+def _aiohttp_session(concurrency):
+	try:
+		import aiohttp
+	except ImportError:
+		raise ImportError('DfStream.amap needs aiohttp (pip install aiohttp), or provide your own `session_factory`')
+
+	return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency))
+
+
+def _identity(df):
+	return df
+
+
+class _GroupBy:
+	"""Returned by `DfStream.group_by`, its `reduce` adds the shuffle stage and returns the stream."""
+	def __init__(self, stream, key, reducers, spill_rows, spill_dir):
+		self.stream = stream
+		self.key = key
+		self.reducers = reducers
+		self.spill_rows = spill_rows
+		self.spill_dir = spill_dir
+
+	def reduce(self, *funcs):
+		stream = self.stream
+		if stream._shuffle is not None:
+			raise ValueError('the stream already has group_by stage')
+
+		if stream.pool is not None:
+			raise ValueError('group_by can\'t run in a WorkerPool')
+
+		if len(stream.worker_functions) == 0:
+			stream.map(_identity)  # rows are routed to reducers by the workers
 
-		yield store[0]
+		self.funcs = funcs
+		self.reducers = self.reducers or stream.workers
+		stream._shuffle = self
+		stream._has_reduce = True
+		return stream
+
+	def prepare(self, df):
+		"""Called in the workers before routing the rows to reducers."""
+		return df
+
+
+def _drop_tile_columns(df):
+	if isinstance(df, pd.DataFrame):
+		return df.drop(['__tile__', '__halo__'], axis=1, errors='ignore')
+	return df
+
+
+class _TileBy(_GroupBy):
+	"""Returned by `DfStream.tile`, its `map` adds the re-chunking stage and returns the stream."""
+	def __init__(self, stream, grid, halo, reducers, spill_rows, spill_dir):
+		super().__init__(stream, '__tile__', reducers, spill_rows, spill_dir)
+		self.grid = grid
+		self.halo = halo
+
+	def prepare(self, df):
+		return self.grid.assign(df, self.halo)
+
+	def map(self, *funcs):
+		return self.reduce(*funcs, _drop_tile_columns)
+
+
+# chunks travel through queues as (chunk number, data) tuples,
+# and workers send (chunk number, CHUNK_DONE) when they finished a chunk
+CHUNK_DONE = '__chunk_done__'
+METRICS_INTERVAL = 0.5  # seconds between metrics samples, if report_interval is not set
+
+def _is_done(data):
+	return isinstance(data, str) and data == CHUNK_DONE
+
+class _Prepended:
+	"""
+	The reader's iterator that starts with an already read chunk again. Not itertools.chain:
+	it calls iter() on the reader, and DfReader restarts then. Other attributes (total, chunk_size, source)
+	are the reader's.
+	"""
+	def __init__(self, first, reader, iterator):
+		self._first = [first]
+		self._reader = reader
+		self._iterator = iterator
+
+	def __iter__(self):
+		return self
+
+	def __next__(self):
+		if self._first:
+			return self._first.pop()
+		return next(self._iterator)
+
+	def __getattr__(self, name):
+		if name.startswith('__') or name in ('_first', '_reader', '_iterator'):
+			raise AttributeError(name)  # not set yet, while unpickling
+		return getattr(self._reader, name)
 
-	return decorated
 
 def debug_print(*args, **kwargs):
 	if AKDEBUG:
@@ -63,29 +227,116 @@ def debug_print(*args, **kwargs):
 		sys.stdout.flush()
 
 class DfStream:
-	def __init__(self, source, qlength=None, workers=None):
+	"""
+	Reads `source` in chunks in a separate process, runs the chunks through `map`/`reduce` functions
+	in `workers` processes, and either yields the results (iteration) or writes them to a target (`write`).
+
+	* `qlength`: maximum number of chunks waiting in each queue (default is `workers`).
+	* `metrics`: if True, collects per-stage metrics (rows and chunks in/out, busy time, time blocked
+		on queues, queue depths sampled every `report_interval` or 0.5 seconds) into `self.metrics` (`aktash.metrics.StreamMetrics`). If it's a string,
+		also writes `<metrics>.json` and `<metrics>.prom` (Prometheus text format) reports at the end.
+	* `report_interval`: if set with `metrics`, prints a live summary to stderr every N seconds.
+	* `progress`: if True, shows a progress bar with rows done, rows written, speed and ETA
+		(from the reader's `total`). With `metrics` or `progress`, `self.progress` (`aktash.progress.Progress`)
+		has these numbers, e.g. `stream.progress.rate` is rows per second.
+	* `pool`: `aktash.pool.WorkerPool` to run the stream in, instead of starting new processes.
+		`workers` and `qlength` of the pool are used.
+	* `backend`: `'process'` (default), `'thread'` or `'auto'`. Threads share chunks in memory without
+		pickling them, which is faster when the map functions release the GIL (vectorized shapely 2
+		and pyproj calls) or are cheap compared to pickling. `'auto'` runs the functions on the first chunk
+		to choose (see `aktash.backend.calibrate`), and saves the measurements in `self.calibration`.
+	"""
+	def __init__(self, source, qlength=None, workers=None, metrics=None, report_interval=None, pool=None, backend='process', progress=None):
+		if backend not in BACKENDS and backend != 'auto':
+			raise ValueError(f'backend should be one of: {", ".join(BACKENDS)}, auto')
+
+		if pool is not None and backend != 'process':
+			raise ValueError('WorkerPool runs only process backend')
+
+		self.backend = backend
+		self._Queue, self._Process = BACKENDS.get(backend, (None, None))  # 'auto' is resolved in __iter__
+		self.calibration = None
+		self.pool = pool
+		if pool is not None:
+			workers = pool.workers
 		self.output_none_limit = self.workers = workers or (cpu_count() - 2)
-		qlength = qlength or self.workers
+		self.qlength = qlength = qlength or self.workers
 		self._read_process = None
 		self._work_processes = []
 		self.worker_functions = []
+		self._has_reduce = False
+		self._skip_chunks = set()
+		self._partition = None
+		self._write_qs = None
+		self._shuffle = None
+		self._shuffle_qs = None
+		self._shuffle_processes = []
+		self.metrics_path = metrics if isinstance(metrics, str) else None
+		self._metrics_on = bool(metrics or progress)  # progress is computed from the metrics
+		self._progress_bar = bool(progress)
+		self.progress = None
+		self._retries = 0
+		self._bisect = False
+		self._dead_letter = None
+		self._on_error = False
+		self.dead_q = None
+		self._dead_thread = None
+		self.metrics_q = pool.metrics_q if pool is not None and self._metrics_on else None
+		self.metrics = None
+		self._error = None
+		self.report_interval = report_interval
+		self._last_report = time.monotonic()
 
 		# gen is a generator or a gen func
+		self.input_q = self.output_q = self.err_q = None
 		if hasattr(source, 'output_q') and hasattr(source, 'err_q'):
 			self.gen = source
 			self.input_q = source.output_q
 			self.err_q = source.err_q
+		elif pool is not None:
+			self.gen = io.stream_reader(source)
+			self.input_q, self.output_q, self.err_q = pool.input_q, pool.output_q, pool.err_q
 		else:
 			self.gen = io.stream_reader(source)
-			self.input_q = Queue(maxsize=qlength) # reader will put here
-			self.output_q = Queue(maxsize=qlength) # processors will put here  # make this work if no processors are here
-			self.err_q = Queue(maxsize=qlength)
+		# the other queues are created in __iter__, when backend is known
+
+	def _resolve_backend(self):
+		"""Chooses the backend for 'auto' by a calibration run on the first chunk, then creates the queues."""
+		if self.backend == 'auto':
+			self.backend = 'process'
+			if len(self.worker_functions) == 0:
+				self.backend = 'thread'  # nothing to compute, only pickling to avoid
+			elif not self._has_reduce and not any(isinstance(f, _AsyncStage) for f in self.worker_functions):
+				gen = self.gen() if inspect.isgeneratorfunction(self.gen) else self.gen
+				iterator = iter(gen)
+				first = next(iterator, None)
+				if first is not None:
+					self.backend, self.calibration = calibrate(first, lambda df: list(self._work_step(df, self.worker_functions)))
+					self.gen = _Prepended(first, gen, iterator)  # the reader starts with the first chunk again
+
+			debug_print('backend chosen:', self.backend, self.calibration)
+			self._Queue, self._Process = BACKENDS[self.backend]
+
+		if self.input_q is None:
+			self.input_q = self._Queue(maxsize=self.qlength) # reader will put here
+		if self.output_q is None:
+			self.output_q = self._Queue(maxsize=self.qlength) # processors will put here
+		if self.err_q is None:
+			self.err_q = self._Queue(maxsize=self.qlength)
+		if self._metrics_on and self.metrics_q is None:
+			self.metrics_q = self._Queue()
+		if self._shuffle is not None and self._shuffle_qs is None:
+			self._shuffle_qs = [self._Queue(maxsize=self.qlength) for i in range(self._shuffle.reducers)]
+		if self._dead_letter is not None and self.dead_q is None:
+			self.dead_q = self._Queue()
 
 	def _read_routine(self):
 		debug_print('!!! reading routine started')
 		
 		self._gen = self.gen() if inspect.isgeneratorfunction(self.gen) else self.gen
 		iterator = iter(self._gen)
+		meter = StageMeter('reader', self.metrics_q)
+		chunk = -1
 		while True:
 			debug_print('!!! waiting input')
 			# if there's an error, and we're not in debug mode, stop everything
@@ -93,7 +344,8 @@ class DfStream:
 				break
 
 			try:
-				df = next(iterator)
+				with meter.busy():
+					df = next(iterator)
 			except StopIteration:
 				debug_print('reader ended')
 				break
@@ -102,10 +354,19 @@ class DfStream:
 				self.err_q.put(e)
 				break
 			else:
+				chunk += 1
+				if chunk in self._skip_chunks:
+					debug_print('reader: skipping committed chunk', chunk)
+					continue
+
 				debug_print('reader ok', len(df))
-				self.input_q.put(df)
+				meter.count_out(df)
+				meter.count_done(df)
+				with meter.blocked_on('input_q'):
+					self.input_q.put((chunk, df))
 
 		debug_print('end reading')
+		meter.close()
 		self.input_q.put(None)
 
 	def _work_step(self, item, funcs):
@@ -119,94 +380,616 @@ class DfStream:
 		if len(funcs) > 1:
 			for item2 in gen:
 				for item3 in self._work_step(item2, funcs[1:]):
-					yield item2
+					yield item3
 		else:
 			for item2 in gen:
 				yield item2
 
 	def _work_routine(self):
-		while True:
-			if not self.err_q.empty():
-				break # error, quit
-
-			df = self.input_q.get()
-			if df is None: # stop signal
-				self.output_q.put(None)
-				self.input_q.put(None)
-				debug_print('ending worker process')
-				break
+		meter = StageMeter('worker', self.metrics_q)
+		try:
+			while True:
+				if not self.err_q.empty():
+					break # error, quit
+
+				with meter.blocked_on('input_q'):
+					msg = self.input_q.get()
+
+				if msg is None: # stop signal
+					self._close_stages()
+					self.input_q.put(None)
+					debug_print('ending worker process')
+					break
+
+				chunk, df = msg
+				meter.count_in(df)
+				try:
+					if self._on_error:
+						with meter.busy():
+							gen = iter(self._work_chunk(chunk, df, meter))
+					else:
+						gen = self._work_step(df, self.worker_functions)
+					while True:
+						with meter.busy():
+							item = next(gen, None) # _process_step already removes None items, so None means the end
+						if item is None:
+							break
+
+						meter.count_out(item)
+						if self._shuffle is not None:
+							self._emit_shuffled(chunk, item, meter)
+							continue
+
+						if self._partition is not None:
+							self._emit_partitioned(chunk, item, meter)
+							continue
+
+						with meter.blocked_on('output_q'):
+							self.output_q.put((chunk, item))
+
+					meter.count_done(df)
+					if self._partition is None and self._shuffle is None:
+						self.output_q.put((chunk, CHUNK_DONE))
+				except Exception as e:
+					if AKDEBUG:
+						print(e)
+
+					self.err_q.put(e)
+					self.input_q.put(None)
+					raise e
+		finally:
+			# the end signal is sent on any exit, or the consumer waits for it forever
+			meter.close()
+			self._end_output()
 
-			try:
-				for item in self._work_step(df, self.worker_functions):
-					self.output_q.put(item) # _process_step already removes None items, no need to check
-			except Exception as e:
-				if AKDEBUG:
-					print(e)
+	def _work_chunk(self, chunk, df, meter):
+		"""
+		Runs the map functions on a chunk with the error policy of `on_error`: retries the failing part,
+		then splits it in halves until the failing rows are found, and sends them to the dead letter queue.
+		Returns the list of outputs, in the order of the input rows.
+		"""
+		output = []
+		parts = [df]
+		while parts:
+			part = parts.pop()
+			for attempt in range(self._retries + 1):
+				if attempt > 0:
+					meter.count_retry()
+				try:
+					# functions may change the dataframe in place, so each attempt gets a fresh copy
+					result = list(self._work_step(part.copy() if hasattr(part, 'copy') else part, self.worker_functions))
+				except Exception as e:
+					error, tb = e, traceback.format_exc()
+				else:
+					output.extend(result)
+					break
+			else:
+				if self._bisect and hasattr(part, 'iloc') and len(part) > 1:
+					half = len(part) // 2
+					parts.extend([part.iloc[half:], part.iloc[:half]])  # stack, so the first half goes first
+					continue
+
+				meter.count_failed(part)
+				self._dead(chunk, part, error, tb)
+		return output
+
+	def _dead(self, chunk, part, error, tb):
+		if self.dead_q is None:
+			print(f'chunk {chunk}: skipping {len(part) if hasattr(part, "__len__") else 1} failed rows: {error!r}', file=sys.stderr)
+			return
+
+		if isinstance(part, pd.DataFrame):
+			part = part.copy()
+			part['__error__'] = repr(error)
+			part['__traceback__'] = tb
+			part['__chunk__'] = chunk
+		else:
+			part = pd.DataFrame({'__data__': [repr(part)], '__error__': [repr(error)], '__traceback__': [tb], '__chunk__': [chunk]})
+		self.dead_q.put(part)
+
+	def _dead_letter_routine(self):
+		"""Thread in the main process that writes failed rows to the dead letter target."""
+		with io.stream_writer(self._dead_letter) as write:
+			while True:
+				df = self.dead_q.get()
+				if df is None:
+					break
+				write(df)
 
-				self.err_q.put(e)	
-				self.input_q.put(None)
-				self.output_q.put(None)
-				raise e
+	def _emit_partitioned(self, chunk, item, meter):
+		with meter.busy():
+			parts = list(self._partition.split(item, chunk))
+
+		for key, part in parts:
+			with meter.blocked_on('write_q'):
+				self._write_qs[route(partition_name(key), len(self._write_qs))].put((chunk, (key, part)))
+
+	def _emit_shuffled(self, chunk, item, meter):
+		reducers = len(self._shuffle_qs)
+		with meter.busy():
+			item = self._shuffle.prepare(item)
+			buckets = key_hashes(item, self._shuffle.key) % reducers
+			parts = list(item.groupby(buckets, sort=False))
+
+		for bucket, part in parts:
+			with meter.blocked_on('shuffle_q'):
+				self._shuffle_qs[bucket].put((chunk, part))
+
+	def _end_output(self):
+		for q in (self._shuffle_qs or self._write_qs or [self.output_q]):
+			q.put(None)
+
+	def _shuffle_routine(self, index):
+		"""Reducer process: collects rows routed to it by key hash, then reduces each key's group."""
+		shuffle = self._shuffle
+		meter = StageMeter('reducer', self.metrics_q)
+		q = self._shuffle_qs[index]
+		buffer = SpillBuffer(shuffle.key, shuffle.spill_rows, spill_dir=shuffle.spill_dir, reducers=len(self._shuffle_qs))
+		ends = 0
+		try:
+			while ends < self.workers:
+				if not self.err_q.empty():
+					return
+
+				with meter.blocked_on('shuffle_q'):
+					msg = q.get()
+
+				if msg is None:
+					ends += 1
+					continue
+
+				chunk, df = msg
+				meter.count_in(df)
+				with meter.busy():
+					buffer.add(df)
+
+			for df in buffer.groups():
+				with meter.busy():
+					result = apply_groups(df, shuffle.key, shuffle.funcs)
+				if result is not None:
+					meter.count_out(result)
+					with meter.blocked_on('output_q'):
+						self.output_q.put((index, result))
+		except Exception as e:
+			self.err_q.put(e)
+			raise e
+		finally:
+			buffer.cleanup()
+			meter.close()
+			self.output_q.put(None)
+
+	def _close_stages(self):
+		for func in self.worker_functions:
+			if hasattr(func, 'close'):
+				func.close()
+
+	def _job_copy(self):
+		"""Copy of the stream to send to a WorkerPool process, without queues and process handles."""
+		job = copy.copy(self)
+		job._metrics_enabled = self.metrics_q is not None
+		for attr in ('pool', 'input_q', 'output_q', 'err_q', 'metrics_q', 'metrics', '_consumer_meter', '_read_process', '_write_process'):
+			setattr(job, attr, None)
+		job._work_processes = []
+		return job
+
+	def _attach(self, input_q, output_q, err_q, metrics_q):
+		"""Called in a WorkerPool process to connect the job copy to the pool's queues."""
+		self.input_q, self.err_q = input_q, err_q
+		self.output_q = output_q if len(self.worker_functions) > 0 else input_q
+		self.metrics_q = metrics_q if self._metrics_enabled else None
 
 	def __iter__(self):
 		debug_print('iterating')
-		self._read_process = Process(None, self._read_routine, args=())
-		debug_print('starting reader')
-		self._read_process.start()
-		
+		if self._on_error and any(getattr(f, 'func', None) is _reduce_step for f in self.worker_functions):
+			raise ValueError('on_error can\'t be used with reduce functions, they can\'t be rerun on a part of a chunk')
+
+		self._resolve_backend()
+		if self.pool is not None:
+			self.pool.start(self)
+			# the pool may have been restarted with new queues
+			self.input_q, self.output_q, self.err_q = self.pool.input_q, self.pool.output_q, self.pool.err_q
+			if self.metrics_q is not None:
+				self.metrics_q = self.pool.metrics_q
+
 		if len(self.worker_functions) == 0: # input_q is forwarded directly to output_q
 			debug_print('no processors')
 			self.output_q = self.input_q
 			self.output_none_limit = 1
-		else:
-			self._work_processes = [Process(None, self._work_routine) for i in range(self.workers)]
-			for pr in self._work_processes:
-				pr.start()
+
+		if self.pool is None:
+			self._read_process = self._Process(None, self._read_routine, args=())
+			debug_print('starting reader')
+			self._read_process.start()
+
+			if len(self.worker_functions) > 0:
+				self._work_processes = [self._Process(None, self._work_routine) for i in range(self.workers)]
+				for pr in self._work_processes:
+					pr.start()
+
+			if self._shuffle is not None:
+				self.output_none_limit = len(self._shuffle_qs)
+				self._shuffle_processes = [self._Process(None, self._shuffle_routine, args=(i,)) for i in range(len(self._shuffle_qs))]
+				for pr in self._shuffle_processes:
+					pr.start()
+
+		if self.dead_q is not None:
+			self._dead_thread = threading.Thread(target=self._dead_letter_routine, daemon=True)
+			self._dead_thread.start()
+
+		if self.metrics_q is not None:
+			self.metrics = StreamMetrics(self.metrics_q, {'input_q': self.input_q, 'output_q': self.output_q})
+			self.progress = Progress(self._total(), 'worker' if len(self.worker_functions) > 0 else 'reader',
+				bar=self._progress_bar, desc=getattr(self.gen, 'source', None))
+		# main process meter reports directly to self.metrics, not through the queue
+		self._consumer_meter = StageMeter('consumer', self.metrics)
 
 		return self
 
 	def __next__(self):
-		print('waiting for output')
+		debug_print('waiting for output')
+
+		while True:
+			with self._consumer_meter.blocked_on('output_q'):
+				msg = self._get_output()
 
-		data = self.output_q.get()
-		if data is None: # end of pipeline
-			raise StopIteration
+			if msg is not None:
+				chunk, data = msg
+				if _is_done(data):
+					continue
+				break
+
+			self.output_none_limit -= 1 # one more process ended
+			self._raise_error()
+			if self.output_none_limit == 0: # end of pipeline
+				self._consumer_meter.close()
+				self._finish()
+				self._raise_error(finished=True)  # the error may come after the end signals from another process
+				raise StopIteration
+
+		self._consumer_meter.count_in(data)
+		self._report()
 		return data
 
+	def _get_output(self):
+		"""Gets a message from output_q. With metrics, keeps sampling them while waiting."""
+		if self.metrics is None:
+			return self.output_q.get()
+
+		while True:
+			try:
+				return self.output_q.get(timeout=self.report_interval or METRICS_INTERVAL)
+			except Empty:
+				self._report()
+
+	def _raise_error(self, finished=False):
+		"""Re-raises the error of a worker in the consumer, after stopping the other stages."""
+		if self.err_q.empty():
+			return
+
+		e = self.err_q.get()
+		self._error = e
+		[i.terminate() for i in self._work_processes + self._shuffle_processes]
+		if self._read_process is not None:
+			self._read_process.terminate()
+		if not finished:
+			self._consumer_meter.close()
+			self._finish()
+		raise e
+
+	def _total(self):
+		"""Rows to process: reader's total, without the chunks skipped by checkpoint."""
+		total = getattr(self.gen, 'total', None)
+		if total is None:
+			return None
+
+		return max(total - len(self._skip_chunks) * (getattr(self.gen, 'chunk_size', None) or 0), 0)
+
+	def _report(self, force=False):
+		"""Collects metrics from the processes, updates progress and prints live summary, if it's time to."""
+		if self.metrics is None:
+			return
+
+		now = time.monotonic()
+		if force or now - self._last_report >= (self.report_interval or METRICS_INTERVAL):
+			self.metrics.collect()
+			self.progress.update(self.metrics.report())
+			if self.report_interval:
+				print(self.metrics.summary() + ' | ' + self.progress.summary(), file=sys.stderr)
+			self._last_report = now
+
+	def _finish(self):
+		"""Waits for the processes to end while draining metrics, then writes the reports."""
+		if self.pool is not None:
+			self.pool.wait(self.metrics.collect if self.metrics is not None else None)
+
+		for pr in [self._read_process] + self._work_processes + self._shuffle_processes:
+			while pr is not None and pr.is_alive() and self._error is None:  # threads can't be terminated after an error
+				pr.join(0.1)
+				if self.metrics is not None:
+					self.metrics.collect()
+
+		if self._dead_thread is not None:
+			self.dead_q.put(None)  # workers have ended, nothing else will come
+			self._dead_thread.join()
+
+		if self.metrics is None:
+			return
+
+		self.metrics.collect()
+		self.progress.update(self.metrics.report())
+		self.progress.close()
+		if self.metrics_path:
+			self.metrics.write_json(self.metrics_path + '.json')
+			self.metrics.write_prometheus(self.metrics_path + '.prom')
+
 	def map(self, *funcs):
 		self.worker_functions.extend([_map_dec(f) for f in funcs])
 		return self
 
+	def on_error(self, retries=0, bisect=True, dead_letter=None):
+		"""
+		Keeps the stream running when map functions fail on a chunk. The chunk is retried `retries` times,
+		then, with `bisect`, split in halves that are retried separately, down to single rows, so that only
+		the rows that really fail are dropped. They are written to `dead_letter` target (like in `write`)
+		with `__error__`, `__traceback__` and `__chunk__` columns, or skipped with a message in stderr
+		if `dead_letter` is None. With `metrics`, failed rows and retries are counted.
+
+		Each attempt runs on a copy of the chunk, and the outputs of a chunk are sent only when
+		the whole chunk is done. Can't be used with `reduce`.
+		"""
+		if dead_letter is not None and self.pool is not None:
+			raise ValueError('dead_letter can\'t be used with WorkerPool')
+
+		self._on_error = True
+		self._retries = retries
+		self._bisect = bisect
+		self._dead_letter = dead_letter
+		return self
+
+	def amap(self, *funcs, concurrency=10, session_factory=None):
+		"""
+		Adds `async def func(df, session)` map functions, for I/O-bound work like HTTP requests.
+		Each worker process runs an event loop, so one worker makes up to `concurrency` requests at once
+		(e.g. with `asyncio.gather` over the rows of the chunk), reusing one session and its connections.
+		The function returns a dataframe or None (nothing is passed on).
+		"""
+		self.worker_functions.extend([_AsyncStage(f, concurrency, session_factory) for f in funcs])
+		return self
+
+	def group_by(self, key, reducers=None, spill_rows=1_000_000, spill_dir=None):
+		"""
+		Shuffle stage: `stream.group_by('segment_id').reduce(func)` sends rows to `reducers` processes
+		(default is the number of workers) by hash of `key` (column name or list of columns), so that
+		all the rows with the same key go to the same reducer. After the map stage has ended,
+		each reducer calls `func(df)` for the dataframe of each key, and `func` returns a dataframe,
+		a Series or a dict (one row), or None. Reducers spill rows to disk (in `spill_dir`, default
+		is the system temp dir) when they have more than `spill_rows`, and then reduce
+		one part of their keys at a time, so the data may be larger than RAM.
+		"""
+		return _GroupBy(self, key, reducers, spill_rows, spill_dir)
+
+	def tile(self, size=None, zoom=None, halo=0, origin=(0, 0), reducers=None, spill_rows=1_000_000, spill_dir=None):
+		"""
+		Re-chunks the stream by spatial tiles: `stream.tile(1000, halo=50).map(func)` collects all the rows
+		of each tile (grid cell of `size` CRS units, or web mercator tile of `zoom` level) into one dataframe
+		and calls `func(df)` for it, in parallel reducer processes (see `group_by`). A row belongs to the tile
+		of its representative point. With `halo`, rows within `halo` distance from a tile are added to it too,
+		with `__halo__` column True, so that `func` sees all the neighbours of the tile's own rows
+		(and should usually return only the rows where `__halo__` is False).
+		`__tile__` and `__halo__` columns are dropped from the output.
+		"""
+		return _TileBy(self, TileGrid(size, zoom, origin), halo, reducers, spill_rows, spill_dir)
+
 	def reduce(self, *funcs):
 		self.worker_functions.extend([_reduce_dec(f) for f in funcs])
+		self._has_reduce = True
 		return self
 
-	def _write_routine(self, target):
+	def _write_routine(self, target, checkpoint=None):
 		debug_print('started _write_routine')
-		self.writer = io.stream_writer(target)
+		kwargs = {'append': True} if checkpoint is not None and checkpoint.resuming else {}
+		self.writer = io.stream_writer(target, **kwargs)
+		meter = StageMeter('writer', self.metrics_q)
+		pending = defaultdict(list)  # chunk number => output dataframes, not committed yet
 		with self.writer as write:
 			while True:
 				if not self.err_q.empty():
 					debug_print('writer: error')
 					e = self.err_q.get()
-					[i.terminate() for i in self._work_processes]
-					self._read_process.terminate()
+					[i.terminate() for i in self._work_processes + self._shuffle_processes]
+					if self._read_process is not None:
+						self._read_process.terminate()
 					print(e)
+					self._error = e
+					self.err_q.put(e)  # for the main process, to raise it from write()
 					raise e
 						
 				debug_print('writer: reading from q')
-				df = self.output_q.get()
-				if df is None:
+				with meter.blocked_on('output_q'):
+					msg = self.output_q.get()
+
+				if msg is None:
 					debug_print('writer: got NONE')
 					self.output_none_limit -= 1 # one more process ended
 					if self.output_none_limit == 0:
 						break
+					continue
+
+				chunk, df = msg
+				if checkpoint is None:
+					if not _is_done(df):
+						meter.count_in(df)
+						with meter.busy():
+							write(df)
+						meter.count_done(df)  # rows on disk, unlike count_in
+					continue
+
+				# with checkpoint, a chunk's output is written at once, when it's complete
+				if not _is_done(df):
+					pending[chunk].append(df)
+					if len(self.worker_functions) > 0:
+						continue  # wait for CHUNK_DONE
+					# no workers: reader's chunks come directly, each one is complete
+
+				rows = 0
+				with meter.busy():
+					for df in pending.pop(chunk, []):
+						meter.count_in(df)
+						rows += len(df)
+						write(df)
+						meter.count_done(df)
+					self.writer.flush()
+				checkpoint.commit(chunk, rows)
+
+		meter.close()
+
+	def _partition_write_routine(self, index, target, manifest_q):
+		"""Writer of the partitions that are routed to `self._write_qs[index]`, each to its own target."""
+		debug_print('started _partition_write_routine', index)
+		meter = StageMeter('writer', self.metrics_q)
+		q = self._write_qs[index]
+		ends = 0
+		files = {}  # partition name => [target, write function, rows]
+		with ExitStack() as stack:
+			while True:
+				if not self.err_q.empty():
+					debug_print('writer: error')
+					e = self.err_q.get()
+					[i.terminate() for i in self._work_processes]
+					self._read_process.terminate()
+					self._error = e
+					raise e
 
-				write(df)
+				with meter.blocked_on('write_q'):
+					msg = q.get()
+
+				if msg is None:
+					ends += 1 # one more worker ended
+					if ends == self.workers:
+						break
+					continue
+
+				chunk, (key, df) = msg
+				name = partition_name(key)
+				meter.count_in(df)
+				with meter.busy():
+					if name not in files:
+						path = target.format(partition=name)
+						directory = os.path.dirname(path.split(':')[0])
+						if directory:
+							os.makedirs(directory, exist_ok=True)
+						files[name] = [path, stack.enter_context(io.stream_writer(path)), 0]
+
+					files[name][1](df)
+					files[name][2] += len(df)
+				meter.count_done(df)
+
+		meter.close()
+		manifest_q.put([{'partition': name, 'target': path, 'rows': rows} for name, (path, w, rows) in files.items()])
+
+	def _write_partitioned(self, target, partition, writers, manifest):
+		if self.pool is not None:
+			raise ValueError('partitioned write can\'t run in a WorkerPool')
+
+		if '{partition}' not in target:
+			raise ValueError('target should have {partition} placeholder, like \'output/{partition}.gpkg\'')
+
+		self._partition = make_partition(partition)
+		if isinstance(self._partition, ShardPartition) and self._partition.chunk_size is None:
+			self._partition.chunk_size = getattr(self.gen, 'chunk_size', None)
+
+		if len(self.worker_functions) == 0:
+			self.map(_identity)  # partitions are split in the workers
+
+		self._resolve_backend()
+		writers = writers or self.workers
+		self._write_qs = [self._Queue(maxsize=self.qlength) for i in range(writers)]
+		manifest_q = self._Queue()
+		iter(self)
+		if self.metrics is not None:
+			self.metrics.watched_queues.update({f'write_q{i}': q for i, q in enumerate(self._write_qs)})
+
+		processes = [self._Process(None, self._partition_write_routine, args=(i, target, manifest_q)) for i in range(writers)]
+		for pr in processes:
+			pr.start()
+
+		files = []
+		reported = 0
+		running = processes
+		while running:
+			running[0].join(self.report_interval or 0.1)
+			self._report(force=True)
+			while not manifest_q.empty():  # drain it while writers run, so that they don't block on exit
+				files.extend(manifest_q.get())
+				reported += 1
+
+			if any(pr.exitcode not in (None, 0) for pr in processes):
+				for pr in processes + self._work_processes + [self._read_process]:
+					pr.terminate()
+				raise self._error or RuntimeError('partition writer failed')
+
+			running = [pr for pr in running if pr.exitcode is None]
+
+		while reported < writers:
+			files.extend(manifest_q.get(timeout=10))
+			reported += 1
+		self._finish()
+
+		if manifest:
+			with open(manifest, 'w') as f:
+				json.dump(files, f, indent=2)
+		return files
+
+	def write(self, target, checkpoint=None, partition=None, writers=None, manifest=None):
+		"""
+		Runs the stream and writes the output to `target` in a separate process.
+
+		If `checkpoint` (a directory path) is given, chunks that have been written are recorded there.
+		When the job is restarted with the same checkpoint, committed chunks are not processed again,
+		and the output is appended to the existing target. A chunk's output is written at once
+		when the chunk is complete, so a crash may at most duplicate one chunk. Not supported
+		with `reduce`, because reducers carry data over from previous chunks.
+
+		If `partition` is given, the output is split into partitions written to separate targets,
+		by `writers` processes in parallel (default is the number of workers). `target` is a template
+		with `{partition}` placeholder, e.g. `'regions/{partition}.gpkg'`. `partition` is a column name
+		or an `aktash.partition` object (`ColumnPartition`, `TilePartition`, `ShardPartition`).
+		Each partition is always written by the same process. If `manifest` (path) is given,
+		the list of written partitions, targets and rows is saved there as JSON. Returns that list.
+		"""
+		if partition is not None:
+			if checkpoint is not None:
+				raise ValueError('checkpoint can\'t be used with partitioned write')
+			if self._shuffle is not None:
+				raise ValueError('group_by can\'t be used with partitioned write')
+			return self._write_partitioned(target, partition, writers, manifest)
+
+		if checkpoint is not None:
+			if self._has_reduce:
+				raise ValueError('checkpoint can\'t be used with reduce functions')
+
+			if isinstance(checkpoint, str):
+				checkpoint = Checkpoint(checkpoint, source=getattr(self.gen, 'source', None), target=target,
+					chunk_size=getattr(self.gen, 'chunk_size', None))
+
+			if checkpoint.resuming:
+				print(f'resuming from checkpoint, skipping chunks {checkpoint.ranges()}', file=sys.stderr)
+			self._skip_chunks = checkpoint.done
 
-	def write(self, target):
 		iter(self)
-		self._write_process = Process(None, self._write_routine, args=(target,))
+		if self.pool is not None:
+			self.pool.start_writer(self, target, checkpoint)
+			self._finish()
+			return
+
+		self._write_process = self._Process(None, self._write_routine, args=(target, checkpoint))
 		self._write_process.start()
 		debug_print('writer working')
-		self._write_process.join()
+		while self._write_process.is_alive():
+			self._write_process.join(self.report_interval or 1)
+			self._report(force=True)
+		self._finish()
+		if self._error is None and self._write_process.exitcode != 0:  # process backend: error is in err_q
+			self._error = RuntimeError('writer failed') if self.err_q.empty() else self.err_q.get()
+		if self._error is not None:
+			raise self._error
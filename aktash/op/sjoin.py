@@ -1,8 +1,12 @@
-from functools import wraps
-from aktash import autoargs_once, crs
+from functools import partial, wraps
+from aktash import autoargs_once, crs, io
 from tqdm import tqdm
 import geopandas as gpd
 import json
+import numpy as np
+import pandas as pd
+import pyproj
+import shapely
 
 def row_crash_wrapper(func):
 	@wraps(func)
@@ -27,9 +31,569 @@ def df_crash_wrapper(func):
 	return decorated
 
 
+class BatchError(Exception):
+	"""Raised when a batch processor fails: `index` is the label of the row it fails on, `row` is the row."""
+	def __init__(self, message, index=None, row=None):
+		super().__init__(message)
+		self.index = index
+		self.row = row
+
+	def __reduce__(self):
+		return BatchError, (self.args[0], self.index, self.row)
+
+
+def _run_batch(func, chunk):
+	"""Calls a batch processor on a chunk. If it fails, finds the row it fails on by bisecting the chunk."""
+	try:
+		result = np.asarray(func(chunk), dtype=object)
+	except Exception as e:
+		bad = chunk
+		while len(bad) > 1:
+			half = len(bad) // 2
+			for part in (bad.iloc[:half], bad.iloc[half:]):
+				try:
+					func(part)
+				except Exception:
+					bad = part
+					break
+			else:
+				break  # fails only with other rows of the chunk
+
+		if len(bad) == 1:
+			row = bad.iloc[0]
+			geometry = getattr(row.get('geometry'), 'wkt', None)
+			raise BatchError(f'{func.__name__} failed on row {bad.index[0]!r} ({e!r}), geometry: {geometry}', bad.index[0], row) from e
+		raise BatchError(f'{func.__name__} failed on rows {bad.index[0]!r}..{bad.index[-1]!r} ({e!r})') from e
+
+	if result.shape != (len(chunk),):
+		raise ValueError(f'{func.__name__} returned {result.shape} array for a chunk of {len(chunk)} rows')
+	return result
+
+
+def apply_batches(func, df, batch_size=10_000, workers=None, executor='thread', desc=None):
+	"""
+	Vectorized counterpart of `df.apply(row_function, axis=1)` for geometry processors: calls
+	`func(chunk)` for chunks of `batch_size` rows of `df` (dataframes), which should return an array
+	(or a GeoSeries, list) of geometries of the same length. Chunks run in `workers` threads
+	(shapely 2 functions release the GIL) or processes with `executor='process'`.
+	Returns an object array of the geometries. If `func` fails, raises `BatchError` with the failing row.
+	"""
+	from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+	chunks = [df.iloc[i:i + batch_size] for i in range(0, len(df), batch_size)]
+	if workers is None or workers < 2 or len(chunks) < 2:
+		parts = [_run_batch(func, chunk) for chunk in tqdm(chunks, desc=desc, disable=desc is None)]
+	else:
+		pool_class = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+		with pool_class(workers) as pool:
+			futures = [pool.submit(_run_batch, func, chunk) for chunk in chunks]
+			parts = [f.result() for f in tqdm(futures, desc=desc, disable=desc is None)]
+
+	return np.concatenate(parts) if parts else np.empty(0, dtype=object)
+
+
 def _sj(left_df, right_df, how='inner', op='intersects'):
 	"""Sjoins two dataframes, returning a DF of index_left and index_right columns."""
-	pass
+	pairs = sjoin_pairs(left_df, right_df, op)
+	joined = pd.DataFrame({'index_left': left_df.index.values[pairs.main], 'index_right': right_df.index.values[pairs.other]})
+	if how == 'left':
+		joined = pd.concat([joined, pd.DataFrame({'index_left': left_df.index.values[pairs.unmatched_main()], 'index_right': np.nan})], ignore_index=True)
+	elif how == 'right':
+		joined = pd.concat([joined, pd.DataFrame({'index_left': np.nan, 'index_right': right_df.index.values[pairs.unmatched_other()]})], ignore_index=True)
+	return joined
+
+
+class JoinPairs:
+	"""
+	Result of `sjoin_pairs`: positions (not index labels) of matching rows, `main` and `other`
+	integer arrays sorted by main position, and `distance` between the geometries of each pair,
+	if it was asked for. Materializes only what's needed with `counts`, `values` and `frame`.
+	"""
+	def __init__(self, main, other, main_len, other_len, distance=None, op=None):
+		self.main = main
+		self.other = other
+		self.main_len = main_len
+		self.other_len = other_len
+		self.distance = distance
+		self.op = op
+
+	def __len__(self):
+		return len(self.main)
+
+	def counts(self):
+		"""Number of matches of each main row, as an array of `main_len`."""
+		return np.bincount(self.main, minlength=self.main_len)
+
+	def unmatched_main(self):
+		return np.flatnonzero(self.counts() == 0)
+
+	def unmatched_other(self):
+		return np.flatnonzero(np.bincount(self.other, minlength=self.other_len) == 0)
+
+	def values(self, other_df, column, agg=None):
+		"""
+		Values of `column` of the matching other rows. Without `agg`, an array aligned with the pairs.
+		With `agg` (anything `groupby().agg` takes, e.g. 'first', 'sum', list), a Series indexed
+		by main positions that have matches.
+		"""
+		values = other_df[column].values[self.other]
+		if agg is None:
+			return values
+		return pd.Series(values).groupby(self.main).agg(agg)
+
+	def frame(self, main_df, other_df, main_columns=None, other_columns=(), suffix='_other'):
+		"""
+		DataFrame of the pairs with only the given columns of both sides (all the main ones by default),
+		plus `index_main`, `index_other` and `distance` if it was computed.
+		Other columns that exist in main get `suffix`.
+		"""
+		main_columns = list(main_df) if main_columns is None else list(main_columns)
+		data = {c: main_df[c].values[self.main] for c in main_columns}
+		data['index_main'] = main_df.index.values[self.main]
+		data['index_other'] = other_df.index.values[self.other]
+		for c in other_columns:
+			data[c + suffix if c in data else c] = other_df[c].values[self.other]
+		if self.distance is not None:
+			data['distance'] = self.distance
+
+		result = pd.DataFrame(data)
+		if 'geometry' in main_columns:
+			result = gpd.GeoDataFrame(result, crs=getattr(main_df, 'crs', None))
+		return result
+
+
+def sjoin_pairs(main_df, other_df, op='intersects', distance=False, workers=None, index=None):
+	"""
+	Low-level spatial join: returns `JoinPairs` with positions of the matching rows, `op(main, other)`,
+	without building a merged dataframe. With `distance`, also computes the distance between
+	the geometries of each pair. `workers` runs the query in parallel (see `parallel_pairs`),
+	`index` is a prebuilt `JoinIndex` or `DiskIndex` over `other_df`.
+	"""
+	main_geometries = np.asarray(main_df['geometry'].values, dtype=object)
+	if index is not None:
+		pairs = index.query(main_geometries, op)
+		pairs = pairs[:, np.lexsort((pairs[1], pairs[0]))]
+		other_geometries = index.geometries if isinstance(index, JoinIndex) else None
+	elif workers is not None and workers > 1:
+		other_geometries = np.asarray(other_df['geometry'].values, dtype=object)
+		pairs = parallel_pairs(main_geometries, other_geometries, op, workers)
+	else:
+		other_geometries = np.asarray(other_df['geometry'].values, dtype=object)
+		pairs = shapely.STRtree(other_geometries).query(main_geometries, predicate=op)
+		pairs = pairs[:, np.lexsort((pairs[1], pairs[0]))]
+
+	dist = None
+	if distance:
+		if other_geometries is None:
+			other_geometries = np.asarray(other_df['geometry'].values, dtype=object)
+		dist = shapely.distance(main_geometries[pairs[0]], other_geometries[pairs[1]])
+
+	return JoinPairs(pairs[0], pairs[1], len(main_df), len(index.labels) if index is not None else len(other_df), dist, op)
+
+
+def _preprocess(df, df_preprocessor=None, row_preprocessor=None, desc='Preprocessing rows',
+		batch_preprocessor=None, workers=None, executor='thread', batch_size=10_000):
+	"""
+	Returns the geometries to join by: from the preprocessed df, or made by the batch or row preprocessor,
+	or the original ones.
+	"""
+	# df preprocessor has priority over batch and row preprocessors if several are provided
+	if df_preprocessor:
+		return df_crash_wrapper(df_preprocessor)(df.copy())['geometry']
+	elif batch_preprocessor:
+		geometries = apply_batches(batch_preprocessor, df, batch_size, workers, executor, desc)
+		return gpd.GeoSeries(geometries, index=df.index, crs=df.crs)
+	elif row_preprocessor:
+		tqdm.pandas(desc=desc)
+		return df.apply(row_crash_wrapper(row_preprocessor), axis=1)
+	return df['geometry']
+
+
+class JoinIndex:
+	"""
+	Spatial index (shapely STRtree) over the geometries of `other_df`, after the preprocessors, to join
+	chunks of a main dataframe against it one by one (see `stream_join`). Keeps a reference
+	to `other_df`, not a copy. `labels` are `other_df` index labels of the positions that `query` returns
+	(the preprocessor may drop or reorder rows).
+	"""
+	def __init__(self, other_df, other_df_preprocessor=None, other_row_preprocessor=None, other_batch_preprocessor=None):
+		self.other_df = other_df
+		geometries = _preprocess(other_df, other_df_preprocessor, other_row_preprocessor, 'Preprocessing other rows', other_batch_preprocessor)
+		self.geometries = np.asarray(geometries, dtype=object)
+		self.labels = geometries.index.values
+		self.tree = shapely.STRtree(self.geometries)
+
+	def __len__(self):
+		return len(self.geometries)
+
+	def query(self, geometries, op='intersects'):
+		"""Returns arrays of positions of the matching pairs: (in `geometries`, in `other_df`), for `op(geometry, other)`."""
+		return self.tree.query(np.asarray(geometries, dtype=object), predicate=op)
+
+
+def subdivide(geometries, max_vertices=256, max_depth=24):
+	"""
+	Cuts geometries with more than `max_vertices` coordinates in halves of their bounding box
+	(across the longer side), recursively, like PostGIS ST_Subdivide. Returns arrays of the pieces
+	and of the positions of the geometries they were cut from. Empty pieces are dropped.
+	"""
+	if max_vertices < 8:
+		raise ValueError('max_vertices should be at least 8, pieces cut by boxes may have more vertices than that')
+	pieces = np.asarray(geometries, dtype=object)
+	rows = np.arange(len(pieces))
+	done_pieces, done_rows = [], []
+	for depth in range(max_depth + 1):
+		big = shapely.get_num_coordinates(pieces) > max_vertices
+		if depth == max_depth:
+			big[:] = False
+		done_pieces.append(pieces[~big])
+		done_rows.append(rows[~big])
+		pieces, rows = pieces[big], rows[big]
+		if not len(pieces):
+			break
+
+		xmin, ymin, xmax, ymax = shapely.bounds(pieces).T
+		vertical = (xmax - xmin) >= (ymax - ymin)
+		xmid, ymid = (xmin + xmax) / 2, (ymin + ymax) / 2
+		first = shapely.box(xmin, ymin, np.where(vertical, xmid, xmax), np.where(vertical, ymax, ymid))
+		second = shapely.box(np.where(vertical, xmid, xmin), np.where(vertical, ymin, ymid), xmax, ymax)
+		pieces = np.concatenate([shapely.intersection(pieces, first), shapely.intersection(pieces, second)])
+		rows = np.concatenate([rows, rows])
+		keep = ~shapely.is_empty(pieces)
+		pieces, rows = pieces[keep], rows[keep]
+
+	pieces, rows = np.concatenate(done_pieces), np.concatenate(done_rows)
+	keep = ~(shapely.is_missing(pieces) | shapely.is_empty(pieces))
+	return pieces[keep], rows[keep]
+
+
+class SubdividedIndex(JoinIndex):
+	"""
+	`JoinIndex` for huge polygons (countries, large admin areas): the geometries of `other_df`
+	are cut into pieces of up to `max_vertices` coordinates (see `subdivide`, None keeps them whole),
+	and the pieces and the original geometries are prepared once. A query then tests only the small
+	pieces whose boxes match, and maps them back to the rows of `other_df`.
+
+	`intersects` is exact on pieces. For `within` and `covered_by`, a geometry in the interior
+	of a piece is accepted at once, and only those touching a cut are checked against the original
+	geometry; other predicates check the originals of the pieces that intersect.
+	"""
+	def __init__(self, other_df, other_df_preprocessor=None, other_row_preprocessor=None, max_vertices=256, other_batch_preprocessor=None):
+		self.other_df = other_df
+		geometries = _preprocess(other_df, other_df_preprocessor, other_row_preprocessor, 'Preprocessing other rows', other_batch_preprocessor)
+		self.geometries = np.asarray(geometries, dtype=object)
+		self.labels = geometries.index.values
+		if max_vertices is None:
+			self.pieces, self.piece_rows = self.geometries, np.arange(len(self.geometries))
+		else:
+			self.pieces, self.piece_rows = subdivide(self.geometries, max_vertices)
+		shapely.prepare(self.geometries)
+		shapely.prepare(self.pieces)
+		self.tree = shapely.STRtree(self.pieces)
+
+	def query(self, geometries, op='intersects'):
+		if op not in CONVERSE or op == 'disjoint':
+			raise ValueError(f'SubdividedIndex does not support {op!r}')
+
+		geometries = np.asarray(geometries, dtype=object)
+		positions, pieces = self.tree.query(geometries)  # by boxes only
+		# prepared geometry goes first in predicates
+		hit = shapely.intersects(self.pieces[pieces], geometries[positions])
+		positions, pieces = positions[hit], pieces[hit]
+		rows = self.piece_rows[pieces]
+
+		if op != 'intersects':
+			if op in ('within', 'covered_by'):
+				check = ~shapely.contains_properly(self.pieces[pieces], geometries[positions])
+			else:
+				check = np.ones(len(rows), dtype=bool)
+			# a geometry may touch several pieces of the same row, check each pair once
+			pairs = np.unique(np.vstack([positions[check], rows[check]]), axis=1)
+			ok = getattr(shapely, CONVERSE[op])(self.geometries[pairs[1]], geometries[pairs[0]])
+			positions = np.concatenate([positions[~check], pairs[0][ok]])
+			rows = np.concatenate([rows[~check], pairs[1][ok]])
+
+		pairs = np.unique(np.vstack([positions, rows]).reshape(2, -1), axis=1)
+		return pairs.astype(np.intp)
+
+
+# converse predicates, to query a tree built over the main side: op(main, other) == CONVERSE[op](other, main)
+CONVERSE = {
+	'intersects': 'intersects', 'disjoint': 'disjoint', 'touches': 'touches', 'overlaps': 'overlaps',
+	'crosses': 'crosses', 'equals': 'equals',
+	'within': 'contains', 'contains': 'within', 'covered_by': 'covers', 'covers': 'covered_by',
+}
+
+_worker_tree = None  # tree of a worker process, see `_init_tree`
+
+
+def _init_tree(geometries):
+	global _worker_tree
+	_worker_tree = shapely.STRtree(geometries)
+
+
+def _query_chunk(op, positions, geometries, tree=None):
+	"""Queries the tree (the process' one, if not given) with a chunk of geometries, returns pairs of (positions, tree items)."""
+	pairs = (tree or _worker_tree).query(geometries, predicate=op)
+	return np.vstack([positions[pairs[0]], pairs[1]])
+
+
+def parallel_pairs(main_geometries, other_geometries, op='intersects', workers=None, executor='thread', chunk_size=50_000):
+	"""
+	Finds the pairs of positions (main, other) where `op(main geometry, other geometry)` is true,
+	in `workers` threads (shapely 2 releases the GIL in queries) or processes (`executor='process'`).
+	The tree is built over the smaller side, the larger one is sorted spatially and split into chunks
+	of `chunk_size`, that are queried in parallel. Returns a 2-row array, sorted by main position.
+	"""
+	from aktash.spatial_index import _str_order
+	from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+	from multiprocessing import cpu_count
+
+	main_geometries = np.asarray(main_geometries, dtype=object)
+	other_geometries = np.asarray(other_geometries, dtype=object)
+	workers = workers or cpu_count()
+	swap = len(main_geometries) > len(other_geometries) and op in CONVERSE
+	tree_side, query_side = (main_geometries, other_geometries) if swap else (other_geometries, main_geometries)
+	query_op = CONVERSE[op] if swap else op
+
+	# spatially close geometries in the same chunk visit the same tree nodes
+	bounds = shapely.bounds(query_side)
+	bounds[np.isnan(bounds)] = 0
+	order = _str_order(bounds)
+	chunks = [order[i:i + chunk_size] for i in range(0, len(order), chunk_size)]
+
+	if executor == 'process':
+		pool = ProcessPoolExecutor(workers, initializer=_init_tree, initargs=(tree_side,))
+		tree = None
+	else:
+		pool = ThreadPoolExecutor(workers)
+		tree = shapely.STRtree(tree_side)
+
+	with pool:
+		futures = [pool.submit(_query_chunk, query_op, chunk, query_side[chunk], tree) for chunk in chunks]
+		parts = [f.result() for f in futures]
+
+	pairs = np.hstack(parts) if parts else np.empty((2, 0), dtype=np.int64)
+	if swap:
+		pairs = pairs[::-1]
+	return pairs[:, np.lexsort((pairs[1], pairs[0]))]
+
+
+def nearest_pairs(main_df, other_df, k=1, max_distance=None):
+	"""
+	Nearest neighbour join: `JoinPairs` of each main row with its `k` nearest other rows (fewer if
+	there are not enough within `max_distance`), with `distance` in CRS units, sorted by main position
+	and distance. Uses the STRtree nearest query, and for `k` > 1, `dwithin` queries with a radius
+	that grows until every row has `k` candidates.
+	"""
+	main_geometries = np.asarray(main_df['geometry'].values, dtype=object)
+	other_geometries = np.asarray(other_df['geometry'].values, dtype=object)
+	tree = shapely.STRtree(other_geometries)
+	(main, other), dist = tree.query_nearest(main_geometries, max_distance, return_distance=True, all_matches=False)
+	if k > 1 and len(main):
+		limit = max_distance if max_distance is not None else np.inf
+		radius = np.full(len(main_geometries), np.nan)
+		bounds = shapely.total_bounds(other_geometries)
+		step = np.hypot(bounds[2] - bounds[0], bounds[3] - bounds[1]) / max(np.sqrt(len(other_geometries)), 1) or 1.0
+		radius[main] = np.maximum(dist * 2, step)
+		todo = np.flatnonzero(~np.isnan(radius))  # rows without any neighbour within max_distance are skipped
+		found = []
+		while len(todo):
+			r = np.minimum(radius[todo], limit)
+			pairs = tree.query(main_geometries[todo], predicate='dwithin', distance=r)
+			counts = np.bincount(pairs[0], minlength=len(todo))
+			done = (counts >= k) | (r >= limit) | (counts >= len(other_geometries))
+			keep = done[pairs[0]]
+			found.append(np.vstack([todo[pairs[0][keep]], pairs[1][keep]]))
+			todo = todo[~done]
+			radius[todo] *= 2
+
+		pairs = np.hstack(found)
+		dist = shapely.distance(main_geometries[pairs[0]], other_geometries[pairs[1]])
+		order = np.lexsort((dist, pairs[0]))
+		main, other, dist = pairs[0][order], pairs[1][order], dist[order]
+		# rank of each pair among the pairs of its main row
+		starts = np.r_[0, np.flatnonzero(np.diff(main)) + 1]
+		rank = np.arange(len(main)) - np.repeat(starts, np.diff(np.r_[starts, len(main)]))
+		keep = rank < k
+		if max_distance is not None:
+			keep &= dist <= max_distance
+		main, other, dist = main[keep], other[keep], dist[keep]
+
+	return JoinPairs(main, other, len(main_df), len(other_df), dist, 'nearest')
+
+
+def _morton_order(bounds):
+	"""Z-order of the box centers: consecutive runs of it are compact areas, unlike STR order slices."""
+	centers = np.column_stack([(bounds[:, 0] + bounds[:, 2]) / 2, (bounds[:, 1] + bounds[:, 3]) / 2])
+	centers = np.nan_to_num(centers, posinf=0, neginf=0)
+	low, high = centers.min(axis=0), centers.max(axis=0)
+	cells = ((centers - low) / np.where(high > low, high - low, 1) * 0xFFFF).astype(np.uint64)
+	code = np.zeros(len(bounds), dtype=np.uint64)
+	for bit in range(16):
+		for axis in (0, 1):
+			code |= ((cells[:, axis] >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit + axis)
+	return np.argsort(code, kind='stable')
+
+
+def _box_gap(bounds, box):
+	"""Distances between boxes (rows of `bounds`) and one box, NaN for missing ones."""
+	with np.errstate(invalid='ignore'):
+		gap_x = np.maximum(np.maximum(bounds[:, 0] - box[2], box[0] - bounds[:, 2]), 0)
+		gap_y = np.maximum(np.maximum(bounds[:, 1] - box[3], box[1] - bounds[:, 3]), 0)
+	return np.hypot(gap_x, gap_y)
+
+
+def cross_pairs(main_geometries, other_geometries, predicate=None, distance=None, max_distance=None, tile_size=1024):
+	"""
+	Blocked cross join: walks the product of the two arrays in tiles of `tile_size` x `tile_size`
+	and yields `JoinPairs` of the pairs that survive in each tile (positions are in the whole arrays),
+	so that the product is never in memory at once.
+
+	* `predicate`: shapely predicate name (`'intersects'`, `'dwithin'` needs `max_distance`...) or function
+		of two arrays broadcast to a tile (`f(main[:, None], other[None, :])`) that returns a boolean array.
+		None keeps all the pairs.
+	* `distance`: function like `shapely.distance` (True means it), called for the pairs that pass
+		`predicate`, elementwise. Pairs farther than `max_distance` are dropped, and the distances are
+		in `JoinPairs.distance`. If `max_distance` is given without `distance`, `shapely.distance` is used.
+
+	With shapely predicates (except `disjoint`) and with `max_distance`, the arrays are sorted spatially,
+	the tiles whose bounding boxes are farther apart than `max_distance` (or don't intersect)
+	are skipped, and inside a tile, the predicate is evaluated only for pairs of boxes within that distance.
+	"""
+	main_geometries = np.asarray(main_geometries, dtype=object)
+	other_geometries = np.asarray(other_geometries, dtype=object)
+	if distance is True or (distance is None and max_distance is not None):
+		distance = shapely.distance
+
+	reach = None  # max distance between boxes of tiles that may have pairs, None for no pruning
+	if isinstance(predicate, str):
+		if predicate == 'dwithin':
+			if max_distance is None:
+				raise ValueError('dwithin needs max_distance')
+			predicate_func = partial(shapely.dwithin, distance=max_distance)
+		else:
+			predicate_func = getattr(shapely, predicate)
+		if predicate != 'disjoint':
+			reach = 0 if max_distance is None else max_distance
+	else:
+		predicate_func = predicate
+	if distance is shapely.distance and max_distance is not None:
+		reach = max_distance if reach is None else min(reach, max_distance)
+
+	main_order, other_order = np.arange(len(main_geometries)), np.arange(len(other_geometries))
+	if reach is not None:
+		main_bounds, other_bounds = shapely.bounds(main_geometries), shapely.bounds(other_geometries)
+		for bounds in (main_bounds, other_bounds):
+			bounds[np.isnan(bounds).any(axis=1)] = [np.inf, np.inf, -np.inf, -np.inf]  # missing and empty match nothing
+		main_order, other_order = _morton_order(main_bounds), _morton_order(other_bounds)
+		tile_boxes = lambda bounds, order: np.array([[b[:, 0].min(), b[:, 1].min(), b[:, 2].max(), b[:, 3].max()]
+			for b in (bounds[order[i:i + tile_size]] for i in range(0, len(order), tile_size))]).reshape(-1, 4)
+		main_boxes, other_boxes = tile_boxes(main_bounds, main_order), tile_boxes(other_bounds, other_order)
+
+	for i, main_start in enumerate(range(0, len(main_geometries), tile_size)):
+		main_pos = main_order[main_start:main_start + tile_size]
+		main_tile = main_geometries[main_pos]
+		for j, other_start in enumerate(range(0, len(other_geometries), tile_size)):
+			if reach is not None:
+				if not _box_gap(main_boxes[i:i + 1], other_boxes[j])[0] <= reach:
+					continue
+
+			other_pos = other_order[other_start:other_start + tile_size]
+			other_tile = other_geometries[other_pos]
+			if reach is not None:
+				# rows within reach of the other tile's box, pairs of their boxes within reach, then the predicate only for them
+				near_main = np.flatnonzero(_box_gap(main_bounds[main_pos], other_boxes[j]) <= reach)
+				near_other = np.flatnonzero(_box_gap(other_bounds[other_pos], main_boxes[i]) <= reach)
+				mb, ob = main_bounds[main_pos[near_main]], other_bounds[other_pos[near_other]]
+				with np.errstate(invalid='ignore'):
+					gap_x = np.maximum(np.maximum(mb[:, None, 0] - ob[None, :, 2], ob[None, :, 0] - mb[:, None, 2]), 0)
+					gap_y = np.maximum(np.maximum(mb[:, None, 1] - ob[None, :, 3], ob[None, :, 1] - mb[:, None, 3]), 0)
+					mains, others = np.nonzero(gap_x ** 2 + gap_y ** 2 <= reach ** 2)
+				mains, others = near_main[mains], near_other[others]
+				if predicate_func is not None:
+					keep = np.asarray(predicate_func(main_tile[mains], other_tile[others]), dtype=bool)
+					mains, others = mains[keep], others[keep]
+			elif predicate_func is None:
+				mains, others = np.divmod(np.arange(len(main_pos) * len(other_pos)), len(other_pos))
+			else:
+				mains, others = np.nonzero(np.asarray(predicate_func(main_tile[:, None], other_tile[None, :]), dtype=bool))
+
+			dist = None
+			if distance is not None:
+				dist = np.asarray(distance(main_tile[mains], other_tile[others]), dtype=float)
+				if max_distance is not None:
+					keep = dist <= max_distance
+					mains, others, dist = mains[keep], others[keep], dist[keep]
+
+			if len(mains):
+				mains, others = main_pos[mains], other_pos[others]
+				order = np.lexsort((others, mains))
+				yield JoinPairs(mains[order], others[order], len(main_geometries), len(other_geometries),
+					dist[order] if dist is not None else None, predicate)
+
+
+def stream_join(main_source, other_df, how='inner', op='intersects', other_columns=None, final_columns=None,
+	main_df_preprocessor=None, main_row_preprocessor=None,
+	other_df_preprocessor=None, other_row_preprocessor=None,
+	df_postprocessor=None, row_postprocessor=None,
+	agg=None, index=None, chunk_size=10_000,
+	main_batch_preprocessor=None, other_batch_preprocessor=None, batch_postprocessor=None, workers=None, executor='thread'):
+	"""
+	Streaming version of `main`: builds a spatial index over `other_df` once (or takes a prebuilt `JoinIndex`
+	or `aktash.spatial_index.DiskIndex` as `index`; a file name as `index` opens its DiskIndex, built
+	with `other_df_preprocessor` on first use and saved next to the file), then reads `main_source` (file name, dataframe, DfReader, DfStream or any iterable
+	of dataframes) chunk by chunk, and yields the joined chunks. Memory use depends on the size
+	of `other_df` and `chunk_size`, not on the main source.
+
+	The parameters are the same as in `main`, `workers` and `executor` are used only by the batch processors. `agg` works per chunk, which gives the same result,
+	since all the matches of a main row are in its chunk. With `how='right'`, `other_df` rows that
+	didn't match any main row are yielded in the last chunk. `how='nearest'` and `'cross'` are not
+	supported, they don't use the index: run `main` on the chunks for them.
+	"""
+	from gistalt import subset
+
+	if how not in ('inner', 'left', 'right'):
+		raise ValueError('stream_join supports how=inner, left or right')
+
+	if isinstance(index, str):
+		from aktash.spatial_index import DiskIndex
+		if other_row_preprocessor or other_batch_preprocessor:
+			raise ValueError('a DiskIndex is built only with other_df_preprocessor, use it instead of the row or batch preprocessor')
+		index = DiskIndex.open(index, preprocessor=other_df_preprocessor, other_df=other_df)
+	elif index is None:
+		index = JoinIndex(other_df, other_df_preprocessor, other_row_preprocessor, other_batch_preprocessor)
+	other_df = index.other_df
+	if other_columns is None:
+		other_columns = ';'.join(set(other_df) - {'geometry'})
+
+	matched = np.zeros(len(index.labels), dtype=bool) if how == 'right' else None
+	if isinstance(main_source, pd.DataFrame):
+		chunks = (main_source.iloc[i:i + chunk_size] for i in range(0, len(main_source), chunk_size))
+	else:
+		chunks = io.stream_reader(main_source, chunk_size=chunk_size) if isinstance(main_source, str) else main_source
+	crs_, main_columns = None, set()
+	for main_df in chunks:
+		crs_, main_columns = main_df.crs, set(main_df)
+		geometries = _preprocess(main_df, main_df_preprocessor, main_row_preprocessor, 'Preprocessing main rows', main_batch_preprocessor, workers, executor)
+		main_pos, other_pos = index.query(geometries.values, op)
+		# positions are in the preprocessed chunk and layer, which may have dropped or reordered rows
+		joined_dfs = pd.DataFrame({'index_main': geometries.index.values[main_pos], 'index_other': index.labels[other_pos]})
+		if how == 'left':
+			unmatched = np.setdiff1d(np.arange(len(geometries)), main_pos)
+			joined_dfs = pd.concat([joined_dfs, pd.DataFrame({'index_main': geometries.index.values[unmatched], 'index_other': np.nan})])
+		elif how == 'right':
+			matched[other_pos] = True
+
+		yield _join_result(main_df, other_df, joined_dfs, other_columns, final_columns, df_postprocessor, row_postprocessor, agg,
+			batch_postprocessor, workers, executor)
+
+	if how == 'right':
+		rest = other_df[~other_df.index.isin(index.labels[matched])]
+		if len(rest):
+			rest = subset(rest, other_columns + ';geometry').rename(columns=lambda c: c if c == 'geometry' else c + '_other' if c in main_columns else c)
+			rest.insert(0, 'index_other', rest.index)
+			yield gpd.GeoDataFrame(rest.reset_index(drop=True), crs=crs_ or other_df.crs)
 
 
 
@@ -38,7 +602,9 @@ def main(main_df:gpd.GeoDataFrame, other_df:gpd.GeoDataFrame, how='inner', op='i
 	main_df_preprocessor=None, main_row_preprocessor=None,
 	other_df_preprocessor=None, other_row_preprocessor=None,
 	df_postprocessor=None, row_postprocessor=None,
-	agg=None, remove_index_columns=True):
+	agg=None, remove_index_columns=True, workers=None, executor='thread', k=1, max_distance=None, distance_column='distance', max_vertices=None,
+	main_batch_preprocessor=None, other_batch_preprocessor=None, batch_postprocessor=None, batch_size=10_000,
+	agg_chunk_size=1_000_000, cross_filter=None, cross_tile_size=1024):
 	"""
 	Matches two dataframes and outputs main_df with fields from matching `other_df` records. If one record of `main_df` matches two or more rows in `other_df`, the row is duplicated as in relational databases.
 
@@ -47,7 +613,12 @@ def main(main_df:gpd.GeoDataFrame, other_df:gpd.GeoDataFrame, how='inner', op='i
 
 	* `main_df` the dataframe whose objects will be kept in the result
 	* `other_df` the dataframe from which the other attributes will be added to `main_df`
-	* `how`: database-like join, either `'inner'` or `'left'` or `'right'`
+	* `how`: database-like join, either `'inner'` or `'left'` or `'right'`, or `'nearest'`: each main row
+	    is matched with its `k` nearest other rows within `max_distance` (`op` is ignored), and the distance
+	    in CRS units goes to `distance_column` (see `nearest_pairs`). Or `'cross'`: all the pairs of rows
+	    for which `cross_filter` (a shapely predicate name or a vectorized function, see `cross_pairs`) is true,
+	    and that are within `max_distance`, if it's given (then the distance goes to `distance_column`).
+	    The pairs are evaluated in tiles of `cross_tile_size` rows of each side.
 	* `op` geometry operation (`'intersects'`, `'within'`)
 	* `main_df_preprocessor`: function that will take `main_df` before spatial join and return
 		another dataframe that will be used in the join. But output dataframe will contain rows
@@ -56,10 +627,20 @@ def main(main_df:gpd.GeoDataFrame, other_df:gpd.GeoDataFrame, how='inner', op='i
 	    Must return Shapely geometry object. This geometries will be used for spatial join,
 	    but the original ones will be in the output dataframe.
 	* `other_df_preprocessor`, `other_row_preprocessor` work the same way.
+	* `main_batch_preprocessor`, `other_batch_preprocessor`, `batch_postprocessor`: vectorized versions of the row
+	    processors. Get chunks of `batch_size` rows (dataframes) and return arrays of geometries of the same length.
+	    Run in parallel in `workers` threads or processes (see `apply_batches`), and raise `BatchError`
+	    with the row that failed.
 	* `df_postprocessor` and `row_postprocessor`: work the same way with the result dataframe before aggregation, and get a DF with `geometry` coming from `main_df`, and `geometry_other` coming from `other_df`. `df_postprocessor` should return the new (Geo)DataFrame, whereas `row_postprocessor` should return a shapely.geometry object. After applying postprocessor, `geometry_other` is discarded.
 	* `agg`: (default `None`) is Pandas aggregation object. If it's provided, the result dataframe
 	    will be grouped by `main_df` index, and the other columns will be aggregated according
-	    to this parameter. Otherwise, rows may be repeated.
+	    to this parameter. Otherwise, rows may be repeated. The matches are aggregated by chunks of `agg_chunk_size`,
+	    so that all of them are never in memory at once.
+	* `workers`: if more than 1, the spatial join runs in parallel in this number of threads,
+	    or processes with `executor='process'` (see `parallel_pairs`). Only with `how='inner'` or `'left'`.
+	* `max_vertices`: if given, `other_df` geometries are prepared and cut into pieces of up to this number
+	    of vertices (see `SubdividedIndex`), which makes joins of points with huge polygons much faster.
+	    Only with `how='inner'` or `'left'`.
 
 	"""
 
@@ -76,100 +657,214 @@ def main(main_df:gpd.GeoDataFrame, other_df:gpd.GeoDataFrame, how='inner', op='i
 		raise ValueError('DataFrames should not have `index_main` or `index_other` columns, because this function creates them again. Please rename them to avoid collisions and confusion.')
 
 
-	if how == 'cross':
-		main_df_origin = gpd.GeoDataFrame(main_df.copy().reset_index(), crs=main_df.crs)
-		main_df_origin['__join__'] = 1
-		
-		other_df_origin = gpd.GeoDataFrame(other_df.copy().reset_index(), crs=other_df.crs)
-		other_df_origin['__join__'] = 1
+	main_df_origin = main_df
+	other_df_origin = other_df
+	# making geometry series to join, from the preprocessed dataframes
+	main_df_geom = gpd.GeoDataFrame({'geometry': _preprocess(main_df, main_df_preprocessor, main_row_preprocessor, 'Preprocessing main rows',
+		main_batch_preprocessor, workers, executor, batch_size)}, crs=main_df.crs)
+	other_df_geom = gpd.GeoDataFrame({'geometry': _preprocess(other_df, other_df_preprocessor, other_row_preprocessor, 'Preprocessing other rows',
+		other_batch_preprocessor, workers, executor, batch_size)}, crs=other_df.crs)
 
-		joined_dfs = main_df_origin.merge(other_df_origin, on='__join__', suffixes=('_main', '_other'))[['index_main', 'index_other']]
-
-		main_df_origin.drop(['__join__', 'index'], axis=1, inplace=True)
-		other_df_origin.drop(['__join__', 'index'], axis=1, inplace=True)
-
-	else:
-		main_df_origin = main_df.copy()
-		other_df_origin = other_df.copy()
-		# df preprocessor has priority over row preprocessor if both are provided
-		if main_df_preprocessor:
-			main_df = df_crash_wrapper(main_df_preprocessor)(main_df.copy())
-		elif main_row_preprocessor:
-			tqdm.pandas(desc='Preprocessing main rows')
-			main_df = main_df.copy()
-			main_df['geometry'] = main_df.apply(row_crash_wrapper(main_row_preprocessor), axis=1)
-
-		if other_df_preprocessor:
-			other_df = df_crash_wrapper(other_df_preprocessor)(other_df.copy())
-		elif other_row_preprocessor:
-			tqdm.pandas(desc='Preprocessing other rows')
-			other_df = other_df.copy()
-			other_df['geometry'] = other_df.apply(row_crash_wrapper(other_row_preprocessor), axis=1)
-
-		# making dataframes with geometries only, for `sjoin`
-		main_df_geom = gpd.GeoDataFrame(main_df.copy()[['geometry']], crs=main_df.crs)
-		other_df_geom = gpd.GeoDataFrame(other_df.copy()[['geometry']], crs=other_df.crs)
-
-		# deciding which way to `sjoin`. Left df should be smaller than the right one.
-		if len(main_df_geom) <= len(other_df_geom):
-			joined_dfs = gpd.sjoin(main_df_geom, other_df_geom, how=how, op=op, lsuffix='main', rsuffix='other')
-			joined_dfs = joined_dfs[['index_other']].reset_index().rename(columns={'index': 'index_main'})
+	if how == 'cross':
+		# cross_filter (predicate) and max_distance are evaluated on tiles, the product is never built whole
+		parts = list(cross_pairs(main_df_geom['geometry'].values, other_df_geom['geometry'].values, cross_filter,
+			max_distance=max_distance, tile_size=cross_tile_size))
+		main_pos = np.concatenate([p.main for p in parts]) if parts else np.array([], dtype=np.int64)
+		other_pos = np.concatenate([p.other for p in parts]) if parts else np.array([], dtype=np.int64)
+		joined_dfs = pd.DataFrame({'index_main': main_df_geom.index.values[main_pos], 'index_other': other_df_geom.index.values[other_pos]})
+		if max_distance is not None:
+			joined_dfs[distance_column] = np.concatenate([p.distance for p in parts]) if parts else np.array([])
+		joined_dfs = joined_dfs.iloc[np.lexsort((other_pos, main_pos))]
+
+	elif how == 'nearest':
+		pairs = nearest_pairs(main_df_geom, other_df_geom, k, max_distance)
+		joined_dfs = pd.DataFrame({'index_main': main_df_geom.index.values[pairs.main], 'index_other': other_df_geom.index.values[pairs.other],
+			distance_column: pairs.distance})
+
+	elif max_vertices or (workers is not None and workers > 1):
+		if how not in ('inner', 'left'):
+			raise ValueError(f'how={how!r} is not supported with max_vertices or workers > 1, only inner and left')
+
+		if max_vertices:
+			main_pos, other_pos = SubdividedIndex(other_df_geom, max_vertices=max_vertices).query(main_df_geom['geometry'].values, op)
 		else:
-			if how == 'left':
-				how = 'right'
+			main_pos, other_pos = parallel_pairs(main_df_geom['geometry'].values, other_df_geom['geometry'].values, op, workers, executor)
+		# positions are in the preprocessed frames, which may have dropped or reordered rows
+		joined_dfs = pd.DataFrame({'index_main': main_df_geom.index.values[main_pos], 'index_other': other_df_geom.index.values[other_pos]})
+		if how == 'left':
+			unmatched = np.setdiff1d(np.arange(len(main_df_geom)), main_pos)
+			joined_dfs = pd.concat([joined_dfs, pd.DataFrame({'index_main': main_df_geom.index.values[unmatched], 'index_other': np.nan})])
+
+	# deciding which way to `sjoin`. Left df should be smaller than the right one.
+	elif len(main_df_geom) <= len(other_df_geom):
+		joined_dfs = gpd.sjoin(main_df_geom, other_df_geom, how=how, predicate=op, lsuffix='main', rsuffix='other')
+		joined_dfs = joined_dfs[['index_other']].reset_index().rename(columns={'index': 'index_main'})
+	else:
+		if how == 'left':
+			how = 'right'
 
-			elif how == 'right':
-				how = 'left'
+		elif how == 'right':
+			how = 'left'
 
-			joined_dfs = gpd.sjoin(other_df_geom, main_df_geom, how=how, op=op, lsuffix='other', rsuffix='main')
-			joined_dfs = joined_dfs[['index_main']].reset_index().rename(columns={'index': 'index_other'})
+		joined_dfs = gpd.sjoin(other_df_geom, main_df_geom, how=how, predicate=op, lsuffix='other', rsuffix='main')
+		joined_dfs = joined_dfs[['index_main']].reset_index().rename(columns={'index': 'index_other'})
 
 
 	# if other_columns is not specified, we need at least to remove 'geometry' of the other df
 	if other_columns is None:
 		other_columns = ';'.join(set(other_df_origin) - {'geometry'})
 
+	return _join_result(main_df_origin, other_df_origin, joined_dfs, other_columns, final_columns, df_postprocessor, row_postprocessor, agg,
+		batch_postprocessor, workers, executor, batch_size, agg_chunk_size)
+
+
+def _join_result(main_df_origin, other_df_origin, joined_dfs, other_columns, final_columns, df_postprocessor, row_postprocessor, agg,
+		batch_postprocessor=None, workers=None, executor='thread', batch_size=10_000, agg_chunk_size=1_000_000):
+	"""
+	Makes the result of a join from the pairs of indices `joined_dfs` (index_main, index_other columns).
+	With `agg`, the matched rows are made and aggregated by chunks of `agg_chunk_size` pairs (see `_aggregate`).
+	"""
+	from gistalt import subset
+
+	if agg:
+		if isinstance(agg, str):
+			agg = json.loads(agg)
+
+		agg_dict = {k: 'first' for k in list(main_df_origin)}
+		agg_dict.update(agg)
+
+	def matched_rows(pairs):
+		return _matched_rows(main_df_origin, other_df_origin, pairs, other_columns, df_postprocessor, row_postprocessor,
+			batch_postprocessor, workers, executor, batch_size)
+
+	if agg and len(joined_dfs) > agg_chunk_size:
+		result_df = _aggregate(joined_dfs, matched_rows, agg_dict, agg_chunk_size)
+	else:
+		result_df = matched_rows(joined_dfs)
+		if len(result_df) == 0:
+			return gpd.GeoDataFrame(result_df, crs=main_df_origin.crs)
+
+		if agg:
+			result_df = result_df.groupby(by=['index_main']).agg(agg_dict)
+
+	if 'geometry' not in other_columns:
+		result_df.drop('geometry_other', errors='ignore', inplace=True, axis=1)
+	return gpd.GeoDataFrame(subset(result_df, final_columns), crs=main_df_origin.crs)
+
+
+def _matched_rows(main_df_origin, other_df_origin, joined_dfs, other_columns, df_postprocessor, row_postprocessor,
+		batch_postprocessor=None, workers=None, executor='thread', batch_size=10_000):
+	"""Rows of the matching pairs, with the other columns merged in, after the postprocessors."""
+	from gistalt import subset
+
 	result_df = main_df_origin.merge(joined_dfs, right_on='index_main', left_index=True)
 
 	if other_columns not in (None, ''):
 		other_df_origin_subset = subset(other_df_origin, other_columns)
-		result_df = result_df.merge(other_df_origin_subset, left_on='index_other', right_index=True, suffixes=('', '_other'))
+		result_df = result_df.merge(other_df_origin_subset, how='left', left_on='index_other', right_index=True, suffixes=('', '_other'))
 
-	if len(result_df) == 0:
-		return gpd.GeoDataFrame(result_df, crs=main_df_origin.crs)
-	
-	if (df_postprocessor or row_postprocessor) and len(result_df) > 0:
-		result_df = result_df.merge(gpd.GeoDataFrame(other_df_origin[['geometry']].rename(columns={'geometry': 'geometry_other'}), crs=other_df_origin.crs), left_on='index_other', right_index=True)  # here only the geometry_other column is merged, no need for suffixes
+	if (df_postprocessor or batch_postprocessor or row_postprocessor) and len(result_df) > 0:
+		result_df = result_df.merge(gpd.GeoDataFrame(other_df_origin[['geometry']].rename(columns={'geometry': 'geometry_other'}), crs=other_df_origin.crs), how='left', left_on='index_other', right_index=True)  # here only the geometry_other column is merged, no need for suffixes
 
 		if df_postprocessor:
 			result_df = df_crash_wrapper(df_postprocessor)(result_df)
+		elif batch_postprocessor:
+			result_df['geometry'] = apply_batches(batch_postprocessor, result_df, batch_size, workers, executor, 'Applying postprocessor')
 		else:
 			tqdm.pandas(desc='Applying postprocessor')
 			result_df['geometry'] = result_df.progress_apply(row_crash_wrapper(row_postprocessor), axis=1)
 
-	if agg:
-		if isinstance(agg, str):
-			agg = json.loads(agg)
+	return result_df
 
-		agg_dict = {k: 'first' for k in list(main_df_origin)}
-		agg_dict.update(agg)
-		# print(list(result_df))
-		# print(agg_dict)
-		result_df = result_df.groupby(by=['index_main']).agg(agg_dict)
 
-	if 'geometry' not in other_columns:
-		result_df.drop('geometry_other', errors='ignore', inplace=True, axis=1)
-	return gpd.GeoDataFrame(subset(result_df, final_columns), crs=main_df_origin.crs)
+# aggregation => (partial aggregation of a chunk, aggregation that combines the partials)
+COMBINABLE = {
+	'sum': ('sum', 'sum'), 'count': ('count', 'sum'), 'size': ('size', 'sum'),
+	'min': ('min', 'min'), 'max': ('max', 'max'), 'first': ('first', 'first'), 'last': ('last', 'last'),
+	'any': ('any', 'any'), 'all': ('all', 'all'),
+}
+
+
+def _aggregate(joined_dfs, matched_rows, agg_dict, chunk_size):
+	"""
+	Aggregates the matched rows chunk by chunk, so that only `chunk_size` of them are in memory at once,
+	instead of all the matches. If all the aggregations are combinable (`COMBINABLE`, or `mean`, made of
+	sum and count), chunks are aggregated partially, and the partials are combined at the end.
+	Otherwise, the pairs are sorted by main index and cut only between main rows, so that
+	each main row is aggregated whole in one chunk.
+	"""
+	combinable = all(isinstance(f, str) and (f in COMBINABLE or f == 'mean') for f in agg_dict.values())
+	if combinable:
+		partial_agg, combine_agg = {}, {}
+		for column, func in agg_dict.items():
+			for f in (('sum', 'count') if func == 'mean' else (func,)):
+				name = f'p{len(partial_agg)}'
+				partial_agg[name] = (column, COMBINABLE[f][0])
+				combine_agg[name] = (name, COMBINABLE[f][1])
+		bounds = range(0, len(joined_dfs) + chunk_size, chunk_size)
+	else:
+		joined_dfs = joined_dfs.sort_values('index_main', kind='stable')
+		keys = joined_dfs['index_main'].values
+		breaks = np.r_[np.flatnonzero(keys[1:] != keys[:-1]) + 1, len(keys)]
+		bounds = [0]
+		while bounds[-1] < len(keys):
+			bounds.append(breaks[np.searchsorted(breaks, bounds[-1] + chunk_size)] if bounds[-1] + chunk_size < len(keys) else len(keys))
+
+	parts = []
+	for start, end in zip(bounds[:-1], bounds[1:]):
+		chunk_df = matched_rows(joined_dfs.iloc[start:end])
+		if len(chunk_df):
+			grouped = chunk_df.groupby(by=['index_main'])
+			parts.append(grouped.agg(**partial_agg) if combinable else grouped.agg(agg_dict))
+		del chunk_df
+
+	if not parts:
+		return matched_rows(joined_dfs.iloc[:0]).groupby(by=['index_main']).agg(agg_dict)
+	if not combinable:
+		return pd.concat(parts)
+
+	combined = pd.concat(parts).groupby(level=0).agg(**combine_agg)
+	result = {}
+	names = iter(combined)
+	for column, func in agg_dict.items():
+		if func == 'mean':
+			total, count = combined[next(names)], combined[next(names)]
+			result[column] = total / count
+		else:
+			result[column] = combined[next(names)]
+	return pd.DataFrame(result, index=combined.index)
 
 
-def distance_to_other(df, column_name='distance', processing_crs=crs.SIB):
+def distance_to_other(df, column_name='distance', processing_crs=crs.SIB, geodesic=False):
+	"""
+	Adds `column_name` with distances between `geometry` and `geometry_other` of each row.
+	Both columns are reprojected to `processing_crs` at once (if `df` has a CRS) and distances
+	are computed as array operations, in its units.
+
+	With `geodesic=True`, distances are in meters on the ellipsoid of `df` CRS (WGS 84 if it has none),
+	for pairs of points.
+	"""
+	geoms = np.asarray(df['geometry'].values, dtype=object)
+	others = np.asarray(df['geometry_other'].values, dtype=object)
 	orig_crs = df.crs
+
+	if geodesic:
+		kinds = shapely.get_type_id(np.concatenate([geoms, others]))
+		if ((kinds != 0) & (kinds != -1)).any():
+			raise ValueError('geodesic distances are computed only between points')
+
+		geographic = pyproj.CRS(crs.WGS['init']) if orig_crs is None else pyproj.CRS(orig_crs).geodetic_crs
+		if orig_crs is not None and not pyproj.CRS(orig_crs).is_geographic:
+			geoms = crs.transform_geometries(geoms, orig_crs, geographic)
+			others = crs.transform_geometries(others, orig_crs, geographic)
+		with np.errstate(invalid='ignore'):
+			lon1, lat1, lon2, lat2 = shapely.get_x(geoms), shapely.get_y(geoms), shapely.get_x(others), shapely.get_y(others)
+		df[column_name] = geographic.get_geod().inv(lon1, lat1, lon2, lat2)[2]
+		return df
+
 	if orig_crs is not None:
-		func = (lambda r:
-			crs.transform_crs(r['geometry'], orig_crs, processing_crs).distance(
-				crs.transform_crs(r['geometry_other'], orig_crs, processing_crs)))
-	else:
-		func = lambda r: r['geometry'].distance(r['geometry_other'])
+		geoms = crs.transform_geometries(geoms, orig_crs, processing_crs)
+		others = crs.transform_geometries(others, orig_crs, processing_crs)
 
-	df[column_name] = df.apply(func, axis=1)
+	df[column_name] = shapely.distance(geoms, others)
 	return df
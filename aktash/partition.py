@@ -0,0 +1,171 @@
+import numpy as np
+import pandas as pd
+import re
+import zlib
+
+
+def route(key, buckets):
+	"""
+	Stable (same in all processes, unlike `hash`) bucket number for a partition key.
+	Pass `partition_name(key)`, so that keys with the same file name go to the same writer.
+	"""
+	return zlib.crc32(str(key).encode()) % buckets
+
+
+def partition_name(key):
+	"""Makes partition key safe to use in a file or layer name."""
+	return re.sub(r'[^A-Za-z0-9_.-]+', '_', str(key)) or '_'
+
+
+def quadkey(x, y, zoom):
+	"""Bing Maps quadkey of a web mercator tile."""
+	digits = []
+	for z in range(zoom, 0, -1):
+		mask = 1 << (z - 1)
+		digits.append(str((1 if x & mask else 0) + (2 if y & mask else 0)))
+	return ''.join(digits)
+
+
+class TileGrid:
+	"""
+	Grid of tiles: either square cells of `size` in CRS units (keys are `'<column>_<row>'`),
+	or web mercator tiles of `zoom` level for lon/lat coordinates (keys are quadkeys).
+	"""
+	def __init__(self, size=None, zoom=None, origin=(0, 0)):
+		if (size is None) == (zoom is None):
+			raise ValueError('TileGrid needs either size or zoom')
+		self.size = size
+		self.zoom = zoom
+		self.origin = origin
+
+	def index(self, x, y):
+		"""Tile column and row numbers of coordinate arrays."""
+		x = np.asarray(x, dtype=float)
+		y = np.asarray(y, dtype=float)
+		if self.size is not None:
+			return (np.floor((x - self.origin[0]) / self.size).astype(np.int64),
+				np.floor((y - self.origin[1]) / self.size).astype(np.int64))
+
+		n = 2 ** self.zoom
+		lat = np.radians(np.clip(y, -85.0511, 85.0511))
+		cols = np.floor((x + 180) / 360 * n)
+		rows = np.floor((1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2 * n)
+		return np.clip(cols, 0, n - 1).astype(np.int64), np.clip(rows, 0, n - 1).astype(np.int64)
+
+	def key(self, col, row):
+		if self.size is not None:
+			return f'{col}_{row}'
+		return quadkey(int(col), int(row), self.zoom)
+
+	def _valid(self, geoseries):
+		return (geoseries.notna() & ~geoseries.is_empty).values
+
+	def keys(self, geoseries):
+		"""
+		Keys of the tiles that contain representative points of the geometries.
+		Empty and missing geometries get key `'empty'`.
+		"""
+		keys = np.full(len(geoseries), 'empty', dtype=object)
+		valid = self._valid(geoseries)
+		if valid.any():
+			points = geoseries[valid].representative_point()
+			cols, rows = self.index(points.x.values, points.y.values)
+			keys[valid] = [self.key(c, r) for c, r in zip(cols, rows)]
+		return keys
+
+	def assign(self, df, halo=0, key_column='__tile__', halo_column='__halo__'):
+		"""
+		Adds `key_column` with the tile of each row. If `halo` (in CRS units, degrees for `zoom` grid)
+		is more than 0, the rows whose bounds, expanded by `halo`, touch other tiles are copied
+		into those tiles too, with `halo_column` True.
+		"""
+		df = df.copy()
+		df[key_column] = self.keys(df['geometry'])
+		df[halo_column] = False
+		if not halo:
+			return df
+
+		valid = self._valid(df['geometry'])
+		bounds = df['geometry'][valid].bounds.values
+		min_cols, max_rows = self.index(bounds[:, 0] - halo, bounds[:, 1] - halo)
+		max_cols, min_rows = self.index(bounds[:, 2] + halo, bounds[:, 3] + halo)
+		if self.size is not None:  # in mercator tiles rows go from north to south, in grid from south to north
+			min_rows, max_rows = max_rows, min_rows
+
+		positions = np.flatnonzero(valid)
+		spans = (max_cols > min_cols) | (max_rows > min_rows)
+		copies = []
+		for i in np.flatnonzero(spans):
+			own = df[key_column].iat[positions[i]]
+			keys = [self.key(c, r) for c in range(min_cols[i], max_cols[i] + 1) for r in range(min_rows[i], max_rows[i] + 1)]
+			keys = [k for k in keys if k != own]
+			if keys:
+				copy = df.iloc[[positions[i]] * len(keys)].copy()
+				copy[key_column] = keys
+				copy[halo_column] = True
+				copies.append(copy)
+
+		if copies:
+			df = pd.concat([df] + copies)
+		return df
+
+
+def tile_keys(geoseries, size, origin=(0, 0)):
+	"""
+	Returns a numpy array of grid cell keys (`'<column>_<row>'`) of representative points of the geometries.
+	`size` is the cell size in units of the CRS. Empty and missing geometries get key `'empty'`.
+	"""
+	return TileGrid(size, origin=origin).keys(geoseries)
+
+
+class ColumnPartition:
+	"""Partitions rows by values of a column."""
+	def __init__(self, column):
+		self.column = column
+
+	def split(self, df, chunk):
+		if self.column not in df:
+			raise KeyError(f'partition column {self.column} is not in the dataframe')
+
+		for key, part in df.groupby(self.column, sort=False, dropna=False):
+			yield key, part
+
+
+class TilePartition:
+	"""
+	Partitions rows by grid cells of `size` (in CRS units), or by web mercator tiles of `zoom` level
+	(quadkeys), that contain their representative points.
+	"""
+	def __init__(self, size=None, origin=(0, 0), zoom=None):
+		self.grid = TileGrid(size, zoom, origin)
+
+	def split(self, df, chunk):
+		keys = self.grid.keys(df['geometry'])
+		for key, part in df.groupby(keys, sort=False):
+			yield key, part
+
+
+class ShardPartition:
+	"""
+	Partitions the stream into shards of about `rows` input rows. The shard is calculated from
+	the input chunk number, so the granularity is one chunk, and the source's `chunk_size` is needed.
+	"""
+	def __init__(self, rows, chunk_size=None):
+		self.rows = rows
+		self.chunk_size = chunk_size
+
+	def split(self, df, chunk):
+		if self.chunk_size is None:
+			raise ValueError('ShardPartition needs chunk_size of the source')
+		yield chunk * self.chunk_size // self.rows, df
+
+
+def make_partition(spec):
+	"""Column name makes a ColumnPartition, partition objects are returned as is."""
+	if isinstance(spec, str):
+		return ColumnPartition(spec)
+
+	if not hasattr(spec, 'split'):
+		raise ValueError('partition should be a column name or an object with `split(df, chunk)` method, like TilePartition')
+
+	return spec
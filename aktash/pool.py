@@ -0,0 +1,163 @@
+from multiprocessing.reduction import ForkingPickler
+from queue import Empty
+import multiprocessing
+import pickle
+
+
+DEFAULT_PRELOAD = ('geopandas', 'shapely', 'pyproj', 'fiona', 'aktash.mr')
+
+
+def _pool_routine(control_q, ack_q, queues, initializer):
+	"""Loop of a pool process: gets (stream, role, args) jobs and runs `stream.<role>(*args)`."""
+	if initializer is not None:
+		initializer()
+
+	while True:
+		job = control_q.get()
+		if job is None:
+			break
+
+		stream, role, args = pickle.loads(job)
+		stream._attach(*queues)
+		try:
+			getattr(stream, role)(*args)
+		except Exception as e:
+			ack_q.put((role, e))
+		else:
+			ack_q.put((role, None))
+
+
+class WorkerPool:
+	"""
+	Persistent processes for DfStream: a reader, `workers` workers and a writer, that are started once
+	and run several streams in a row, to avoid paying for process start and imports on every stream:
+
+		with WorkerPool(8) as pool:
+			DfStream('a.gpkg', pool=pool).map(func).write('b.gpkg')
+			DfStream('c.gpkg', pool=pool).map(func2).write('d.gpkg')
+
+	* `start_method`: multiprocessing start method, default is 'forkserver' (or 'spawn' where it's
+		not available). The forkserver imports `preload` modules once, and the pool processes are forked
+		from it with the modules already imported. With 'fork' the pool processes copy the main process.
+	* `initializer`: function called once in each process, e.g. to build lookup tables
+		and keep them in module globals.
+
+	Except with 'fork', map functions and readers are pickled to be sent to the pool, so the functions
+	should be defined at module level, and the script needs the `if __name__ == '__main__':` guard.
+	Only one stream can run in a pool at a time.
+	"""
+	def __init__(self, workers=None, qlength=None, start_method=None, preload=DEFAULT_PRELOAD, initializer=None):
+		if start_method is None:
+			start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+		self.ctx = multiprocessing.get_context(start_method)
+		if start_method == 'forkserver' and preload:
+			self.ctx.set_forkserver_preload(list(preload))
+
+		self.workers = workers or max(multiprocessing.cpu_count() - 2, 1)
+		self.qlength = qlength or self.workers
+		self.initializer = initializer
+		self.processes = []
+		self._started_roles = 0
+		self._leftover = 0
+		self._start()
+
+	def _start(self):
+		ctx = self.ctx
+		self.input_q = ctx.Queue(maxsize=self.qlength)
+		self.output_q = ctx.Queue(maxsize=self.qlength)
+		self.err_q = ctx.Queue(maxsize=self.qlength)
+		self.metrics_q = ctx.Queue()
+		self.ack_q = ctx.Queue()
+		queues = (self.input_q, self.output_q, self.err_q, self.metrics_q)
+
+		# process 0 is the reader, 1 is the writer, the rest are the workers
+		self.control_qs = [ctx.Queue() for i in range(self.workers + 2)]
+		self.processes = [ctx.Process(target=_pool_routine, args=(q, self.ack_q, queues, self.initializer), daemon=True)
+			for q in self.control_qs]
+		for pr in self.processes:
+			pr.start()
+
+	def restart(self):
+		"""Kills the processes and starts new ones. Used after an error, when the queues may have garbage."""
+		for pr in self.processes:
+			pr.terminate()
+		for pr in self.processes:
+			pr.join()
+		self._started_roles = 0
+		self._start()
+
+	def _send(self, process_number, stream, role, *args):
+		# pickled here and not in the queue's thread, to raise errors (like an unpicklable function) right away
+		job = bytes(ForkingPickler.dumps((stream, role, args)))
+		self.control_qs[process_number].put(job)
+		self._started_roles += 1
+
+	def start(self, stream):
+		"""Starts the reader and workers of the stream."""
+		if self._started_roles:
+			raise RuntimeError('another stream is running in this pool')
+
+		if any(not pr.is_alive() for pr in self.processes):
+			self.restart()
+
+		job = stream._job_copy()
+		self._send(0, job, '_read_routine')
+		self._leftover = 0
+		if len(stream.worker_functions) > 0:
+			for i in range(self.workers):
+				self._send(i + 2, job, '_work_routine')
+			self._leftover = 1  # the last worker passes the stop signal on to input_q, where nobody takes it
+
+	def start_writer(self, stream, *args):
+		self._send(1, stream._job_copy(), '_write_routine', *args)
+
+	def wait(self, on_tick=None, tick=0.1):
+		"""
+		Waits until all the started roles are done. Calls `on_tick` every `tick` seconds meanwhile.
+		If any of them failed, restarts the pool and raises the error.
+		"""
+		errors = []
+		while self._started_roles:
+			try:
+				role, error = self.ack_q.get(timeout=tick)
+			except Empty:
+				if on_tick:
+					on_tick()
+				if any(not pr.is_alive() for pr in self.processes):
+					errors.append(RuntimeError('a pool process died'))
+					break
+				continue
+
+			self._started_roles -= 1
+			if error is not None:
+				errors.append(error)
+				break
+
+		if errors:
+			self.restart()
+			raise errors[0]
+
+		self._drain()
+
+	def _drain(self):
+		for i in range(self._leftover):
+			self.input_q.get(timeout=10)
+		self._leftover = 0
+
+	def close(self):
+		for q in self.control_qs:
+			q.put(None)
+		for pr in self.processes:
+			pr.join()
+		self.processes = []
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		if exc[0] is None:
+			self.close()
+		else:
+			for pr in self.processes:
+				pr.terminate()
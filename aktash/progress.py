@@ -0,0 +1,78 @@
+import sys
+import time
+
+
+class Progress:
+	"""
+	Progress of a DfStream, in the main process. Made from the stage metrics that all the processes
+	send (see `aktash.metrics`), so it shows finished work, not just the rows read:
+
+	* `total`: rows in the source, if the reader knows it (`DfReader.total`), else None.
+	* `done`: input rows that went through all the map functions (rows done by `stage`: 'worker',
+		or 'reader' if there are no map functions).
+	* `stages`: rows emitted by each stage, `written`: rows the writer(s) have written
+		(not just received).
+	* `rate`: rows done per second, over the last `window` seconds. `eta`: seconds left, or None.
+
+	With `bar=True`, shows a tqdm progress bar on stderr.
+	"""
+	def __init__(self, total=None, stage='worker', window=30.0, bar=False, desc=None):
+		self.total = total
+		self.stage = stage
+		self.window = window
+		self.started = time.monotonic()
+		self.done = 0
+		self.written = 0
+		self.stages = {}
+		self._samples = [(self.started, 0)]  # (time, done)
+		self._bar = None
+		if bar:
+			from tqdm import tqdm
+			self._bar = tqdm(total=total, desc=desc, unit='rows', file=sys.stderr)
+
+	def update(self, report):
+		"""Updates the counts from `StreamMetrics.report()`."""
+		stages = report['stages']
+		self.stages = {name: s['rows_out'] for name, s in stages.items()}
+		self.written = stages['writer']['rows_done'] if 'writer' in stages else 0  # after the write returned
+		if self.stage in stages:
+			self.done = stages[self.stage]['rows_done']
+
+		now = time.monotonic()
+		self._samples.append((now, self.done))
+		while len(self._samples) > 2 and self._samples[1][0] < now - self.window:
+			self._samples.pop(0)
+
+		if self._bar is not None:
+			self._bar.update(self.done - self._bar.n)
+			self._bar.set_postfix(written=self.written, refresh=False)
+
+	@property
+	def rate(self):
+		"""Rows done per second, over the last `window` seconds."""
+		(t0, d0), (t1, d1) = self._samples[0], self._samples[-1]
+		return (d1 - d0) / (t1 - t0) if t1 > t0 else 0.0
+
+	@property
+	def fraction(self):
+		if not self.total:
+			return None
+		return min(self.done / self.total, 1.0)
+
+	@property
+	def eta(self):
+		"""Seconds left, or None if the total is unknown or nothing is done yet."""
+		rate = self.rate
+		if not self.total or rate <= 0:
+			return None
+		return max(self.total - self.done, 0) / rate
+
+	def summary(self):
+		total = f'/{self.total:,d}' if self.total else ''
+		eta = f', ETA {self.eta:.0f}s' if self.eta is not None else ''
+		return f'{self.done:,d}{total} rows done, {self.written:,d} written, {self.rate:,.0f} rows/s{eta}'
+
+	def close(self):
+		if self._bar is not None:
+			self._bar.close()
+			self._bar = None
@@ -0,0 +1,115 @@
+from collections import defaultdict
+import geopandas as gpd
+import os
+import pandas as pd
+import pickle
+import shutil
+import tempfile
+
+
+def key_hashes(df, key):
+	"""Stable uint64 hashes of the key column(s), same in all processes (unlike `hash`)."""
+	return pd.util.hash_pandas_object(df[key], index=False).values
+
+
+class SpillBuffer:
+	"""
+	Accumulates the rows of one reducer. When more than `spill_rows` rows are in memory, they are split
+	by key hash into `buckets` and appended to files in a temporary directory. `groups()` then loads
+	one bucket at a time, so the memory needed is about the size of one bucket, not of the whole partition.
+	Rows of the same key always end up in the same bucket.
+	"""
+	def __init__(self, key, spill_rows=1_000_000, buckets=16, spill_dir=None, reducers=1):
+		self.key = key
+		self.spill_rows = spill_rows
+		self.buckets = buckets
+		self.spill_dir = spill_dir
+		self.reducers = reducers  # the lower part of the hash was used to choose the reducer
+		self.frames = defaultdict(list)
+		self.rows = 0
+		self.spilled = set()
+		self._dir = None
+
+	def _bucket(self, df):
+		return (key_hashes(df, self.key) // self.reducers) % self.buckets
+
+	def add(self, df):
+		for bucket, part in df.groupby(self._bucket(df), sort=False):
+			self.frames[bucket].append(part)
+		self.rows += len(df)
+		if self.rows > self.spill_rows:
+			self.spill()
+
+	def _path(self, bucket):
+		return os.path.join(self._dir, f'bucket_{bucket}.pkl')
+
+	def spill(self):
+		if self._dir is None:
+			self._dir = tempfile.mkdtemp(prefix='aktash-shuffle-', dir=self.spill_dir)
+
+		for bucket, frames in self.frames.items():
+			with open(self._path(bucket), 'ab') as f:
+				for df in frames:
+					pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+			self.spilled.add(bucket)
+
+		self.frames = defaultdict(list)
+		self.rows = 0
+
+	def _load(self, bucket):
+		frames = []
+		if bucket in self.spilled:
+			with open(self._path(bucket), 'rb') as f:
+				while True:
+					try:
+						frames.append(pickle.load(f))
+					except EOFError:
+						break
+			os.unlink(self._path(bucket))
+		return frames + self.frames.pop(bucket, [])
+
+	def groups(self):
+		"""Yields a dataframe of all the rows of each bucket, one by one."""
+		for bucket in sorted(set(self.frames) | self.spilled):
+			frames = self._load(bucket)
+			if frames:
+				yield pd.concat(frames) if len(frames) > 1 else frames[0]
+
+	def cleanup(self):
+		if self._dir is not None:
+			shutil.rmtree(self._dir, True)
+			self._dir = None
+
+
+def apply_groups(df, key, funcs):
+	"""
+	Calls the chain of `funcs` for each group of rows with the same key. A function gets a dataframe
+	and returns a dataframe, a Series or a dict (one row), or None to drop the group.
+	Returns a (Geo)DataFrame of all the results, or None if there are none.
+	"""
+	frames = []
+	rows = []
+	for k, group in df.groupby(key, sort=False, dropna=False):  # rows without a key are a group too
+		out = group
+		for func in funcs:
+			out = func(out)
+			if out is None:
+				break
+
+		if out is None:
+			continue
+		elif isinstance(out, pd.DataFrame):
+			frames.append(out)
+		else:
+			rows.append(dict(out))
+
+	if rows:
+		frames.append(pd.DataFrame(rows))
+
+	if not frames:
+		return None
+
+	result = pd.concat(frames, ignore_index=len(rows) > 0) if len(frames) > 1 else frames[0]
+	if 'geometry' in result and not isinstance(result, gpd.GeoDataFrame):
+		result = gpd.GeoDataFrame(result, crs=getattr(df, 'crs', None))
+	return result
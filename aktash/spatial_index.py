@@ -0,0 +1,234 @@
+from .cache import function_id
+import hashlib
+import json
+import numpy as np
+import os
+import shapely
+
+
+NODE_SIZE = 16
+FORMAT_VERSION = 2
+
+
+def content_hash(source, preprocessor=None):
+	"""
+	SHA-256 of the source file contents (the part before `:layer`, plus the layer name),
+	or of the WKB of a dataframe's geometries, and of the preprocessor function, if any.
+	"""
+	h = hashlib.sha256(f'v{FORMAT_VERSION}'.encode())
+	if isinstance(source, str):
+		path, _, layer = source.partition(':')
+		h.update(layer.encode())
+		with open(path, 'rb') as f:
+			for block in iter(lambda: f.read(1 << 20), b''):
+				h.update(block)
+	else:
+		for wkb in shapely.to_wkb(np.asarray(source['geometry'].values, dtype=object)):
+			h.update(wkb or b'')
+	if preprocessor is not None:
+		h.update(function_id(preprocessor).encode())
+	return h.hexdigest()
+
+
+def _str_order(bounds):
+	"""Sort-Tile-Recursive order of the boxes: slices by x of centers, then by y inside the slices."""
+	n = len(bounds)
+	cx = (bounds[:, 0] + bounds[:, 2]) / 2
+	cy = (bounds[:, 1] + bounds[:, 3]) / 2
+	leaves = max(int(np.ceil(n / NODE_SIZE)), 1)
+	slice_size = int(np.ceil(np.sqrt(leaves))) * NODE_SIZE
+	order = np.argsort(cx, kind='stable')
+	slices = np.arange(n) // slice_size
+	return order[np.lexsort((cy[order], slices))]
+
+
+def _parent_bounds(bounds):
+	pad = (-len(bounds)) % NODE_SIZE
+	if pad:
+		bounds = np.vstack([bounds, np.tile([np.inf, np.inf, -np.inf, -np.inf], (pad, 1))])
+	groups = bounds.reshape(-1, NODE_SIZE, 4)
+	return np.column_stack([groups[:, :, 0].min(1), groups[:, :, 1].min(1), groups[:, :, 2].max(1), groups[:, :, 3].max(1)])
+
+
+class DiskIndex:
+	"""
+	Packed R-tree (Sort-Tile-Recursive) over geometries, saved as numpy arrays in a directory,
+	so that it's built once and then loaded with memory mapping by every process that joins
+	against the same layer, instead of being rebuilt. Geometries are stored as WKB,
+	and only those that are candidates of a query are decoded. Up to `max_decoded` decoded geometries
+	are kept, the least recently used ones are dropped.
+
+	Use `DiskIndex.open(source)`: it finds the index of the same content in `<file>.aktidx/<hash>`
+	(or in `index_dir`), or builds and saves it. Has the same `query(geometries, op)` as
+	`aktash.op.sjoin.JoinIndex`, so it can be passed as `index` to `stream_join`.
+	"""
+	def __init__(self, path, other_df=None, max_decoded=1_000_000):
+		self.path = path
+		self.max_decoded = max_decoded
+		with open(os.path.join(path, 'meta.json')) as f:
+			self.meta = json.load(f)
+		# plain ndarray views of the memory maps: indexing np.memmap objects is much slower
+		load = lambda name: np.asarray(np.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+		self.levels = [load(f'level{i}') for i in range(self.meta['levels'])]  # 0 is items, the last is the root
+		self.order = load('order')  # item => row position in the source (before the preprocessor)
+		self.wkb = load('wkb')
+		self.offsets = load('offsets')
+		self.source = self.meta.get('source')
+		self._other_df = other_df
+		# geometries by item, decoded on demand, up to max_decoded of them, the least recently used are dropped
+		self._decoded = np.full(self.meta['rows'], None, dtype=object)
+		self._is_decoded = np.zeros(self.meta['rows'], dtype=bool)
+		self._used = np.zeros(self.meta['rows'], dtype=np.int64)  # query number when the item was last used
+		self._queries = 0
+		self._decoded_count = 0
+
+	def __len__(self):
+		return self.meta['rows']
+
+	def __getstate__(self):
+		# sent to other processes as the path only, they map the same files
+		return {'path': self.path, 'other_df': self._other_df, 'max_decoded': self.max_decoded}
+
+	def __setstate__(self, state):
+		self.__init__(state['path'], state['other_df'], state['max_decoded'])
+
+	@classmethod
+	def build(cls, df, path, source=None, preprocessor=None):
+		"""Builds the index of `df` geometries (after `preprocessor(df)`, if given) and saves it to `path`."""
+		geometries = df['geometry'] if preprocessor is None else preprocessor(df.copy())['geometry']
+		if preprocessor is None:
+			rows = np.arange(len(df))
+		elif df.index.is_unique:
+			rows = df.index.get_indexer(geometries.index)  # the preprocessor may drop or reorder rows
+		else:
+			raise ValueError('the dataframe index should be unique to map the preprocessed rows back to it')
+		geometries = np.asarray(geometries.values, dtype=object)
+		bounds = shapely.bounds(geometries)
+		bounds[np.isnan(bounds).any(axis=1)] = [np.inf, np.inf, -np.inf, -np.inf]  # empty and missing match nothing
+		order = _str_order(bounds)
+
+		tmp = f'{path}.tmp{os.getpid()}'
+		os.makedirs(tmp, exist_ok=True)
+		levels = [bounds[order]]
+		while len(levels[-1]) > 1:
+			levels.append(_parent_bounds(levels[-1]))
+		for i, level in enumerate(levels):
+			np.save(os.path.join(tmp, f'level{i}.npy'), level)
+
+		wkbs = shapely.to_wkb(geometries[order])
+		lengths = np.array([len(w) if w is not None else 0 for w in wkbs], dtype=np.int64)
+		np.save(os.path.join(tmp, 'order.npy'), rows[order].astype(np.int64))
+		np.save(os.path.join(tmp, 'offsets.npy'), np.concatenate([[0], np.cumsum(lengths)]))
+		np.save(os.path.join(tmp, 'wkb.npy'), np.frombuffer(b''.join(w or b'' for w in wkbs), dtype=np.uint8))
+		with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+			json.dump({'rows': len(geometries), 'levels': len(levels), 'node_size': NODE_SIZE,
+				'source': source, 'version': FORMAT_VERSION}, f)
+		os.replace(tmp, path)  # another process may build the same index at the same time
+		return cls(path, df)
+
+	@classmethod
+	def open(cls, source, index_dir=None, preprocessor=None, other_df=None):
+		"""
+		Loads the index of `source` (file name, optionally with `:layer`, or a GeoDataFrame),
+		or builds it if there's none for the current content.
+		"""
+		if isinstance(source, str):
+			# absolute, so that the index can be used from another working directory
+			path, sep, layer = source.partition(':')
+			source = os.path.abspath(path) + sep + layer
+		key = content_hash(source, preprocessor)
+		if index_dir is None:
+			if not isinstance(source, str):
+				raise ValueError('index_dir is needed to save the index of a dataframe')
+			index_dir = source.partition(':')[0] + '.aktidx'
+		path = os.path.join(index_dir, key)
+
+		if os.path.exists(os.path.join(path, 'meta.json')):
+			return cls(path, other_df if other_df is not None else None if isinstance(source, str) else source)
+
+		df = other_df if other_df is not None else _read(source) if isinstance(source, str) else source
+		os.makedirs(index_dir, exist_ok=True)
+		try:
+			return cls.build(df, path, source if isinstance(source, str) else None, preprocessor)
+		except OSError:
+			if os.path.exists(os.path.join(path, 'meta.json')):  # built by another process meanwhile
+				return cls(path, df)
+			raise
+
+	@property
+	def other_df(self):
+		"""The indexed dataframe. If the index was loaded from disk, it's read from the source on first use."""
+		if self._other_df is None:
+			if self.source is None:
+				raise ValueError('the index was built from a dataframe, pass it as other_df')
+			self._other_df = _read(self.source)
+		return self._other_df
+
+	@property
+	def labels(self):
+		"""Index labels of the rows of `other_df`, by the positions that `query` returns."""
+		return self.other_df.index.values
+
+	def geometries(self, items):
+		"""Decodes geometries of the items (positions in the index order)."""
+		self._queries += 1
+		missing = np.unique(items[~self._is_decoded[items]])
+		if len(missing):
+			wkb, offsets = self.wkb, self.offsets
+			blobs = [wkb[offsets[i]:offsets[i + 1]].tobytes() or None for i in missing]
+			self._decoded[missing] = shapely.from_wkb(blobs)
+			self._is_decoded[missing] = True
+			self._decoded_count += len(missing)
+		self._used[items] = self._queries
+		result = self._decoded[items]
+
+		if self._decoded_count > self.max_decoded:
+			# drop the least recently used, down to 90%, to not evict on every query
+			decoded = np.flatnonzero(self._is_decoded)
+			excess = len(decoded) - int(self.max_decoded * 0.9)
+			oldest = decoded[np.argpartition(self._used[decoded], excess - 1)[:excess]]
+			self._decoded[oldest] = None
+			self._is_decoded[oldest] = False
+			self._decoded_count -= len(oldest)
+		return result
+
+	def candidates(self, bounds):
+		"""Pairs (query position, item) whose boxes intersect, for an array of query boxes."""
+		root = len(self.levels) - 1
+		queries = np.arange(len(bounds))
+		nodes = np.zeros(len(bounds), dtype=np.int64)
+		for level in range(root, -1, -1):
+			boxes = self.levels[level]
+			if level < root:  # expand the nodes to their children
+				queries = np.repeat(queries, NODE_SIZE)
+				nodes = np.repeat(nodes, NODE_SIZE) * NODE_SIZE + np.tile(np.arange(NODE_SIZE), len(nodes))
+				keep = nodes < len(boxes)
+				queries, nodes = queries[keep], nodes[keep]
+
+			b, q = boxes[nodes], bounds[queries]
+			hit = (b[:, 0] <= q[:, 2]) & (b[:, 2] >= q[:, 0]) & (b[:, 1] <= q[:, 3]) & (b[:, 3] >= q[:, 1])
+			queries, nodes = queries[hit], nodes[hit]
+		return queries, nodes
+
+	def query(self, geometries, op='intersects'):
+		"""Returns arrays of positions of the matching pairs: (in `geometries`, in the indexed dataframe), for `op(geometry, other)`."""
+		geometries = np.asarray(geometries, dtype=object)
+		bounds = shapely.bounds(geometries)
+		bounds[np.isnan(bounds).any(axis=1)] = [np.inf, np.inf, -np.inf, -np.inf]
+		queries, items = self.candidates(bounds)
+		if len(queries) == 0:
+			return np.array([[], []], dtype=np.int64)
+
+		predicate = getattr(shapely, op)
+		match = predicate(geometries[queries], self.geometries(items))
+		pairs = np.vstack([queries[match], np.asarray(self.order)[items[match]]])
+		return pairs[:, np.lexsort((pairs[1], pairs[0]))]
+
+
+def _read(source):
+	if source.partition(':')[0].endswith('.parquet'):
+		import geopandas as gpd
+		return gpd.read_parquet(source)
+
+	from aktash import read
+	return read(source)
@@ -1,60 +1,253 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from aktash import AKDBG
-from threading import Thread
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from aktash import AKDEBUG as AKDBG
+from .cache import make_cache
+from queue import Queue
+from threading import Condition, Thread
 from tqdm import tqdm
 import bdb
+import heapq
 import inspect
+import itertools
 import sys
 import traceback
 
-def threader(worker_function, input_array, threads_number=10):
-	_inq = []
-	_outq = []
 
-	def _worker():
-		while len(_inq) > 0:
-			input_item = _inq.pop(0)
-			try:
-				if inspect.isgeneratorfunction(worker_function):
-				# добавить inspect и проверять, что функция - генератор
-					for output_item in worker_function(input_item, _inq):
-						_outq.append(output_item)
-				else:
-					_outq.append(worker_function(input_item, _inq))
-			except Exception as e:
-				if isinstance(e, (KeyboardInterrupt, bdb.BdbQuit)) or AKDBG:
-					raise e
-				exc_info = sys.exc_info()
-				print('exception in thread, input item:', input_item)
-				print('traceback: ')
-				traceback.print_exception(*exc_info)
-				print('continuing the loop')
-				continue
+_END = object()  # end of input marker, since None may be an item
+
+
+class WorkQueue:
+	"""
+	Queue of work items for `threader` workers, that they can add items to while working (crawl-style).
+	Items with lower `priority` go first, items of the same priority in the order they were added.
+	With `dedup`, an item (or its key, if `dedup` is a function) is queued only once, even after it's done.
+
+	The queue counts unfinished items (queued or being processed), and `get` waits while any
+	worker may still add work, so the workers end only when there's nothing left at all.
+	"""
+	def __init__(self, priority=None, dedup=False):
+		self.priority = priority  # function item => priority, for items added without one
+		self.dedup = dedup
+		self._heap = []
+		self._counter = itertools.count()
+		self._unfinished = 0
+		self._seen = set()
+		self._cond = Condition()
+
+	def put(self, item, priority=None):
+		"""Adds the item, returns False if it was skipped as a duplicate."""
+		if priority is None:
+			priority = self.priority(item) if self.priority is not None else 0
+
+		with self._cond:
+			if self.dedup:
+				key = self.dedup(item) if callable(self.dedup) else item
+				if key in self._seen:
+					return False
+				self._seen.add(key)
+
+			heapq.heappush(self._heap, (priority, next(self._counter), item))
+			self._unfinished += 1
+			self._cond.notify()
+		return True
+
+	append = put  # worker functions used to get a list and call `append`
+
+	def get(self):
+		"""Returns the next item, or `_END` when all the work is done."""
+		with self._cond:
+			while not self._heap:
+				if self._unfinished == 0:
+					return _END
+				self._cond.wait()
+			return heapq.heappop(self._heap)[2]
+
+	def task_done(self):
+		with self._cond:
+			self._unfinished -= 1
+			if self._unfinished == 0:
+				self._cond.notify_all()  # wake up the workers waiting for more, to end
+
+	def __len__(self):
+		with self._cond:
+			return len(self._heap)
+
+
+class _RecordingQueue:
+	"""Passes `put` calls to the work queue and records them, to replay them on a cache hit."""
+	def __init__(self, work):
+		self.work = work
+		self.puts = []
 
+	def put(self, item, priority=None):
+		self.puts.append((item, priority))
+		return self.work.put(item, priority)
+
+	append = put
+
+	def __len__(self):
+		return len(self.work)
+
+
+def iter_threader(worker_function, input_array, threads_number=10, priority=None, dedup=False, cache=None):
+	"""
+	Runs `worker_function(item, queue)` for the items of `input_array` in `threads_number` threads,
+	and yields the results as they come (all the items yielded, if the function is a generator).
+	The function may add more items with `queue.put(item, priority=None)` (or `queue.append(item)`),
+	see `WorkQueue` for `priority` and `dedup`. Errors are printed, and the work goes on.
+
+	`cache`: `aktash.cache.ResultCache` or a path to its file. Results and the items added to the queue
+	are cached for each input item, and replayed without calling the function when it's cached.
+	"""
+	work = WorkQueue(priority, dedup)
 	for item in input_array:
-		_inq.append(item)
+		work.put(item)
+
+	own_cache = isinstance(cache, str)  # opened here, so closed here
+	cache = make_cache(cache)
+
+	def _call(input_item, emit):
+		if cache is None:
+			queue = work
+		else:
+			key = cache.key(worker_function, input_item)
+			hit, value = cache.get(key)
+			if hit:
+				outputs, puts = value
+				for item, prio in puts:
+					work.put(item, prio)
+				for output_item in outputs:
+					emit(output_item)
+				return
+			queue = _RecordingQueue(work)
+
+		outputs = []
+		if inspect.isgeneratorfunction(worker_function):
+			for output_item in worker_function(input_item, queue):
+				outputs.append(output_item)
+				emit(output_item)
+		else:
+			outputs.append(worker_function(input_item, queue))
+			emit(outputs[0])
+
+		if cache is not None:
+			cache.set(key, (outputs, queue.puts))
+
+	def _process(input_item, emit):
+		try:
+			_call(input_item, emit)
+		except Exception as e:
+			if isinstance(e, (KeyboardInterrupt, bdb.BdbQuit)) or AKDBG:
+				raise e
+			exc_info = sys.exc_info()
+			print('exception in thread, input item:', input_item)
+			print('traceback: ')
+			traceback.print_exception(*exc_info)
+			print('continuing the loop')
+		finally:
+			work.task_done()
+
+	try:
+		yield from _run(work, _process, threads_number)
+	finally:
+		if own_cache:
+			cache.close()
+
 
+def _run(work, process, threads_number):
 	if threads_number == 1:
 		# single thread - just run syncronously (eg. for inline debugger)
-		_worker()
+		results = []
+		while True:
+			input_item = work.get()
+			if input_item is _END:
+				return
+			process(input_item, results.append)
+			yield from results
+			results.clear()
 
-	else:
-		threads = []
-		for i in range(threads_number):
-			thread = Thread(target=_worker)
-			thread.start()
-			threads.append(thread)
+	outq = Queue()
 
-		[i.join() for i in threads]
+	def _worker():
+		try:
+			while True:
+				input_item = work.get()
+				if input_item is _END:
+					break
+				process(input_item, outq.put)
+		finally:
+			outq.put(_END)
+
+	threads = [Thread(target=_worker, daemon=True) for i in range(threads_number)]
+	for thread in threads:
+		thread.start()
+
+	ended = 0
+	while ended < threads_number:
+		output_item = outq.get()
+		if output_item is _END:
+			ended += 1
+		else:
+			yield output_item
+
+
+def threader(worker_function, input_array, threads_number=10, priority=None, dedup=False, cache=None):
+	"""Same as `iter_threader`, but returns the list of all the results."""
+	return list(iter_threader(worker_function, input_array, threads_number, priority, dedup, cache))
+
+
+def _done_future(result):
+	future = Future()
+	future.set_result(result)
+	return future
+
+
+class _SerialExecutor:
+	"""Executor that runs the calls at once in the calling thread, for `pooler` with 1 thread."""
+	def __init__(self, max_workers=None):
+		pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+	def submit(self, fn, *args):
+		return _done_future(fn(*args))
 
-	return _outq[:]
 
+def _call_batch(worker_function, batch):
+	"""Calls the function for a batch of items (in a pool thread or process), returns `(result, error)` for each item."""
+	results = []
+	for data in batch:
+		try:
+			results.append((worker_function(data), None))
+		except Exception as e:
+			results.append((None, e))
+	return results
+
+
+def pooler(worker_function, input_array, threads=10, tqdm_=None, errors=None, window=None, ordered=False, cache=None,
+		executor='thread', batch_size=None):
+	"""
+	Calls `worker_function(data)` for the items of `input_array` in `threads` threads, and yields
+	`(result, data)` tuples. Items are taken from `input_array` lazily (it may be a generator),
+	and no more than `window` (default is `threads * 2`) batches are submitted at a time, so memory use doesn't
+	grow with the input. Results are yielded as they are ready, or in the input order if `ordered`.
+	With `errors='ignore'`, a failed item yields `(None, data)`, otherwise the exception is raised.
+
+	`executor='process'` runs the function in `threads` processes instead, for CPU-bound functions.
+	Items are sent to them in batches of `batch_size` (default is 64 for processes, 1 for threads)
+	to pay less for pickling and IPC. The function and the items must be picklable then.
 
-def pooler(worker_function, input_array, threads=10, tqdm_=None, errors=None):
-	if threads < 2:
-		for data in input_array:
-			yield worker_function(*data)
-		return
+	`cache`: `aktash.cache.ResultCache` or a path to its file. Cached results are yielded without calling
+	the function, only the other items are sent to the threads. Errors are not cached.
+
+	With `threads < 2`, the function is called in the calling thread, with the same results.
+	"""
+	if executor not in ('thread', 'process'):
+		raise ValueError('executor should be thread or process')
 
 	if tqdm_:
 		try:
@@ -63,15 +256,87 @@ def pooler(worker_function, input_array, threads=10, tqdm_=None, errors=None):
 			l = None
 		t = tqdm(total=l, desc=f'routing (with geometries) {threads} threads')
 
-	with ThreadPoolExecutor(max_workers=threads) as e:
-		future_map = {e.submit(worker_function, data): data for data in input_array}
-		for future in as_completed(future_map):
-			if future.exception() is None:
-				yield future.result(), future_map[future]
-			elif errors == 'ignore':
-				yield None, future_map[future]
-			else:
-				raise future.exception()
-			if tqdm_:
-				t.update()
+	own_cache = isinstance(cache, str)  # opened here, so closed here
+	cache = make_cache(cache)
+	batch_size = batch_size or (64 if executor == 'process' else 1)
+	window = window or max(threads, 1) * 2
+	items = iter(input_array)
+	pending = deque()  # (future, entries) in submission order, entry is [data, cache key, cached (hit, value)]
+	ready = deque()  # unordered: cache hits, yielded at once, not after the calls submitted with them
+	ready_limit = window * batch_size
+	exhausted = False
+	pool_class = _SerialExecutor if threads < 2 else ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+	with pool_class(max_workers=threads) as e:
+		def take_batch():
+			nonlocal exhausted
+			entries = []
+			misses = 0
+			while misses < batch_size and len(ready) < ready_limit:
+				data = next(items, _END)
+				if data is _END:
+					exhausted = True
+					break
+
+				key, cached = None, None
+				if cache is not None:
+					key = cache.key(worker_function, data)
+					hit, result = cache.get(key)
+					if hit and not ordered:
+						ready.append((result, data))
+						continue
+					if hit:
+						cached = (True, result)
+				entries.append([data, key, cached])
+				misses += cached is None
+			return entries
+
+		try:
+			while True:
+				while not exhausted and len(pending) < window and len(ready) < ready_limit:
+					entries = take_batch()
+					if entries:
+						batch = [data for data, key, cached in entries if cached is None]
+						future = e.submit(_call_batch, worker_function, batch) if batch else _done_future([])
+						pending.append((future, entries))
+
+				while ready:
+					yield ready.popleft()
+					if tqdm_:
+						t.update()
+
+				if not pending:
+					if exhausted:
+						break
+					continue
+
+				if ordered:
+					future, entries = pending.popleft()
+					wait([future])
+				else:
+					done, _ = wait([f for f, b in pending], return_when=FIRST_COMPLETED)
+					i = next(i for i, (f, b) in enumerate(pending) if f in done)
+					future, entries = pending[i]
+					del pending[i]
+
+				results = iter(future.result())
+				for data, key, cached in entries:
+					if cached is not None:
+						result, error = cached[1], None
+					else:
+						result, error = next(results)
+						if error is None and key is not None:
+							cache.set(key, result)
 
+					if error is None:
+						yield result, data
+					elif errors == 'ignore':
+						yield None, data
+					else:
+						raise error
+					if tqdm_:
+						t.update()
+		finally:
+			for future, entries in pending:  # after an error or if the consumer stopped early
+				future.cancel()
+			if own_cache:
+				cache.close()
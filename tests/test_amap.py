@@ -0,0 +1,58 @@
+from aktash import mr
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+import asyncio
+import pandas as pd
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+
+
+class ElevationStub(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'  # keep-alive
+
+	def do_GET(self):
+		self.server.clients.add(self.client_address)
+		body = str(int(self.path.split('=')[1]) * 10).encode()
+		self.send_response(200)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+
+@pytest.fixture
+def stub_server():
+	server = ThreadingHTTPServer(('127.0.0.1', 0), ElevationStub)
+	server.clients = set()
+	thread = Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	yield server
+	server.shutdown()
+
+
+def test_async_stage(stub_server):
+	url = f'http://127.0.0.1:{stub_server.server_address[1]}/elevation'
+
+	async def elevation(df, session):
+		async def fetch(value):
+			async with session.get(url, params={'h': value}) as resp:
+				return int(await resp.text())
+
+		df['elevation'] = await asyncio.gather(*(fetch(v) for v in df['h']))
+		return df
+
+	stage = mr._AsyncStage(elevation, concurrency=2)
+	for i in range(3):
+		df, = stage(pd.DataFrame({'h': range(i * 10, i * 10 + 10)}))
+		assert (df['elevation'] == df['h'] * 10).all()
+
+	stage.close()
+	assert len(stub_server.clients) <= 2  # connections were reused
+
+
+def test_async_stage_needs_coroutine():
+	with pytest.raises(TypeError):
+		mr._AsyncStage(lambda df, session: df)
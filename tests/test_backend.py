@@ -0,0 +1,58 @@
+from aktash.backend import StageThread, calibrate
+import pandas as pd
+
+
+def test_calibrate():
+	df = pd.DataFrame({'value': range(1000)})
+
+	def run(df):
+		df['double'] = df['value'] * 2
+		return [df]
+
+	backend, details = calibrate(df, run)
+	assert backend in ('thread', 'process')
+	assert set(details) == {'serial', 'parallel', 'speedup', 'pickling'}
+	assert 'double' not in df  # the sample is copied
+
+
+def test_stage_thread_exitcode():
+	def fail():
+		raise ValueError('fail')
+
+	good = StageThread(None, lambda: None)
+	bad = StageThread(None, fail)
+	for t in (good, bad):
+		t.start()
+		t.join()
+
+	assert good.exitcode == 0
+	assert bad.exitcode == 1
+
+
+def fail_on_e(df):
+	if (df['name'] == 'E').any():
+		raise ValueError('bad row')
+	return df
+
+
+def test_thread_backend_error_in_iteration():
+	from aktash.drivers.csv import CsvReader
+	from aktash.mr import DfStream
+	import pytest
+
+	for backend in ('thread', 'process'):
+		stream = DfStream(CsvReader('tests/data/match-points.csv', chunk_size=2), workers=2, backend=backend).map(fail_on_e)
+		with pytest.raises(ValueError, match='bad row'):
+			for df in stream:
+				pass
+
+
+def test_write_raises_worker_error(tmp_path):
+	from aktash.drivers.csv import CsvReader
+	from aktash.mr import DfStream
+	import pytest
+
+	for backend in ('thread', 'process'):
+		stream = DfStream(CsvReader('tests/data/match-points.csv', chunk_size=2), workers=2, backend=backend).map(fail_on_e)
+		with pytest.raises(ValueError, match='bad row'):
+			stream.write(str(tmp_path / f'{backend}.csv'))
@@ -0,0 +1,47 @@
+from aktash import read
+from aktash.op.sjoin import BatchError, apply_batches, main as sjoin
+import numpy as np
+import pytest
+import shapely
+
+
+def buffer_batch(df):
+	return shapely.buffer(np.asarray(df.geometry.values), 0.1)
+
+
+def centroid_batch(df):
+	return shapely.centroid(np.asarray(df['geometry_other'].values))
+
+
+def failing_batch(df):
+	if (df['name'] == 'F').any():
+		raise ValueError('bad row')
+	return df.geometry.values
+
+
+def test_apply_batches():
+	points = read('tests/data/match-points.csv')
+	expected = shapely.buffer(np.asarray(points.geometry.values), 0.1)
+	for workers in (None, 3):
+		result = apply_batches(buffer_batch, points, batch_size=2, workers=workers)
+		assert len(result) == 9 and shapely.equals(result, expected).all()
+
+	with pytest.raises(BatchError) as e:
+		apply_batches(failing_batch, points, batch_size=4, workers=2)
+	assert e.value.index == 5 and e.value.row['name'] == 'F'
+	assert isinstance(e.value.__cause__, ValueError)
+
+	with pytest.raises(ValueError):
+		apply_batches(lambda df: df.geometry.values[:1], points, batch_size=4)
+
+
+def test_sjoin_batch_processors():
+	points = read('tests/data/match-points.csv')
+	polys = read('tests/data/match-simple-polys.csv')
+	plain = sjoin(points, polys, other_columns='name')
+	buffered = sjoin(points, polys, other_columns='name', main_batch_preprocessor=buffer_batch, batch_size=4, workers=2)
+	assert len(plain) == 6 and set(buffered['index_main']) == set(range(9))
+	assert shapely.equals(np.asarray(buffered.geometry.values), np.asarray(points.loc[buffered['index_main']].geometry.values)).all()
+
+	result = sjoin(points, polys, other_columns='name', batch_postprocessor=centroid_batch)
+	assert shapely.equals(np.asarray(result.geometry.values), shapely.centroid(np.asarray(polys.loc[result['index_other']].geometry.values))).all()
@@ -0,0 +1,56 @@
+from aktash.cache import ResultCache
+import time
+
+
+def lookup(x):
+	return x
+
+
+def test_cache_lru_eviction(tmp_path):
+	cache = ResultCache(str(tmp_path / 'cache.sqlite'), max_size=2000)
+	keys = [cache.key(lookup, i) for i in range(10)]
+	for i, key in enumerate(keys):
+		cache.set(key, b'x' * 300)
+		cache.get(keys[0])  # keep the first one recently used
+
+	assert cache.size <= 2000
+	assert cache.get(keys[0])[0]
+	assert not cache.get(keys[1])[0]
+
+
+def test_cache_ttl(tmp_path):
+	cache = ResultCache(str(tmp_path / 'cache.sqlite'), ttl=0.05)
+	key = cache.key(lookup, 'a')
+	cache.set(key, 1)
+	assert cache.get(key) == (True, 1)
+	time.sleep(0.1)
+	assert cache.get(key) == (False, None)
+
+
+def test_cache_key_depends_on_function(tmp_path):
+	cache = ResultCache(str(tmp_path / 'cache.sqlite'))
+	assert cache.key(lookup, 1) == cache.key(lookup, 1)
+	assert cache.key(lookup, 1) != cache.key(lookup, 2)
+	assert cache.key(lookup, 1) != cache.key(time.sleep, 1)
+
+
+def test_cache_key_depends_on_function_body(tmp_path):
+	from aktash.cache import function_id
+
+	def make(source, **env):
+		namespace = dict(env)
+		exec(source, namespace)
+		return namespace['f']
+
+	base = function_id(make('def f(x):\n\treturn abs(x * 2)'))
+	assert function_id(make('def f(x):\n\treturn abs(x * 2)')) == base
+	assert function_id(make('def f(x):\n\treturn abs(x * 3)')) != base  # constant
+	assert function_id(make('def f(x):\n\treturn len(x * 2)')) != base  # called global
+	assert function_id(make('def f(x):\n\treturn x.real * 2')) != function_id(make('def f(x):\n\treturn x.imag * 2'))  # attribute
+	assert function_id(make('def f(x, k=2):\n\treturn x * k')) != function_id(make('def f(x, k=3):\n\treturn x * k'))
+	assert function_id(make('def f(x):\n\treturn [y * 2 for y in x]')) != function_id(make('def f(x):\n\treturn [y * 3 for y in x]'))
+
+	def closure(k):
+		return lambda x: x * k
+	assert function_id(closure(2)) != function_id(closure(3))
+	assert function_id(closure(2)) == function_id(closure(2))
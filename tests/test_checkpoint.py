@@ -0,0 +1,22 @@
+from aktash.checkpoint import Checkpoint
+import pytest
+
+
+def test_checkpoint_resume(tmp_path):
+	path = str(tmp_path / 'ck')
+	ck = Checkpoint(path, source='a.csv', chunk_size=3)
+	assert not ck.resuming
+	for chunk in (0, 1, 2, 5):
+		ck.commit(chunk, 3)
+
+	ck2 = Checkpoint(path, source='a.csv', chunk_size=3)
+	assert ck2.resuming
+	assert ck2.done == {0, 1, 2, 5}
+	assert ck2.ranges() == [(0, 2), (5, 5)]
+
+
+def test_checkpoint_other_job(tmp_path):
+	path = str(tmp_path / 'ck')
+	Checkpoint(path, source='a.csv', chunk_size=3).commit(0)
+	with pytest.raises(ValueError):
+		Checkpoint(path, source='a.csv', chunk_size=5)
@@ -0,0 +1,47 @@
+from aktash import read
+from aktash.op.sjoin import cross_pairs, main as sjoin
+import numpy as np
+import shapely
+
+
+def brute_force(a, b, func):
+	return np.nonzero(func(a[:, None], b[None, :]))
+
+
+def test_cross_pairs():
+	rng = np.random.default_rng(3)
+	points = shapely.points(rng.random((700, 2)) * 100)
+	boxes = shapely.box(*(rng.random((500, 2)) * 100).T, *(rng.random((500, 2)) * 100 + 3).T)
+
+	for predicate in ('intersects', lambda a, b: shapely.get_x(a) < shapely.get_x(shapely.centroid(b)) - 90):
+		tiles = list(cross_pairs(points, boxes, predicate, tile_size=128))
+		got = np.concatenate([t.main for t in tiles]), np.concatenate([t.other for t in tiles])
+		expected = brute_force(points, boxes, predicate if callable(predicate) else shapely.intersects)
+		order = np.lexsort((got[1], got[0]))
+		assert (got[0][order] == expected[0]).all() and (got[1][order] == expected[1]).all()
+
+	tiles = list(cross_pairs(points, points, max_distance=5, tile_size=100))
+	assert len(tiles) < 49  # far tiles are skipped
+	dist = np.concatenate([t.distance for t in tiles])
+	expected = brute_force(points, points, lambda a, b: shapely.distance(a, b) <= 5)
+	assert len(dist) == len(expected[0]) and dist.max() <= 5
+
+	assert sum(len(t) for t in cross_pairs(points[:30], boxes[:20], tile_size=7)) == 600
+
+
+def test_sjoin_cross():
+	points = read('tests/data/match-points.csv')
+	polys = read('tests/data/match-simple-polys.csv')
+	assert len(sjoin(points, polys, how='cross', other_columns='name')) == 18
+
+	result = sjoin(points, points.set_index('name'), how='cross', other_columns='number', max_distance=0.11, distance_column='d')
+	assert len(result) == 9 + 24  # themselves and 4-neighbours on the grid
+	assert result['d'].max() <= 0.11
+
+
+def test_sjoin_cross_filtering_preprocessor():
+	points = read('tests/data/match-points.csv')
+	polys = read('tests/data/match-simple-polys.csv')
+	result = sjoin(points, polys, how='cross', cross_filter='intersects', other_columns='name',
+		main_df_preprocessor=lambda df: df[df.name >= 'E'])
+	assert sorted(zip(result['name'], result['name_other'])) == [('F', 'X'), ('G', 'Y'), ('I', 'X')]
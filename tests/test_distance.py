@@ -0,0 +1,39 @@
+from aktash import crs
+from aktash.op.sjoin import distance_to_other
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+
+
+def pairs_df(crs_):
+	return gpd.GeoDataFrame({
+		'geometry': shapely.points([[82.9, 55.0], [82.9, 55.0], [0, 0]]),
+		'geometry_other': shapely.points([[83.0, 55.0], [82.9, 55.1], [0, 1]]),
+	}, crs=crs_)
+
+
+def test_projected():
+	df = distance_to_other(pairs_df('EPSG:4326'))
+	source = pairs_df('EPSG:4326')
+	expected = gpd.GeoSeries(source['geometry']).to_crs(crs.SIB).distance(
+		gpd.GeoSeries(source['geometry_other'], crs='EPSG:4326').to_crs(crs.SIB))
+	assert np.allclose(df['distance'], expected)
+	assert 6000 < df['distance'][0] < 7000
+
+
+def test_geodesic():
+	df = distance_to_other(pairs_df('EPSG:4326'), 'd', geodesic=True)
+	assert np.allclose(df['d'], [6399.41, 11132.45, 110574.39])
+
+	projected = pairs_df('EPSG:4326').to_crs('EPSG:3857')
+	projected['geometry_other'] = gpd.GeoSeries(projected['geometry_other'], crs='EPSG:4326').to_crs('EPSG:3857').values
+	assert np.allclose(distance_to_other(projected, geodesic=True)['distance'], df['d'])
+
+	with pytest.raises(ValueError):
+		distance_to_other(gpd.GeoDataFrame({'geometry': [shapely.box(0, 0, 1, 1)], 'geometry_other': shapely.points([[2, 2]])}), geodesic=True)
+
+
+def test_no_crs():
+	df = distance_to_other(gpd.GeoDataFrame({'geometry': shapely.points([[0, 0]]), 'geometry_other': shapely.points([[3, 4]])}))
+	assert list(df['distance']) == [5]
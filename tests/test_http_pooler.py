@@ -0,0 +1,110 @@
+from aktash.http_pooler import AdaptiveLimit, HttpError, HttpSession, TokenBucket, http_pooler
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+import json
+import pytest
+import socket
+import time
+
+
+class RoutingStub(BaseHTTPRequestHandler):
+	"""Routing backend: POST /route with a list of [from, to] pairs returns their distances."""
+	protocol_version = 'HTTP/1.1'  # keep-alive
+
+	def do_POST(self):
+		server = self.server
+		server.clients.add(self.client_address)
+		server.requests += 1
+		pairs = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+		if server.throttle > 0:
+			server.throttle -= 1
+			status, body = 429, b'slow down'
+		else:
+			status, body = 200, json.dumps([abs(b - a) for a, b in pairs]).encode()
+
+		self.send_response(status)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+
+@pytest.fixture
+def stub_server():
+	server = ThreadingHTTPServer(('127.0.0.1', 0), RoutingStub)
+	server.clients = set()
+	server.requests = 0
+	server.throttle = 0
+	thread = Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	server.url = f'http://127.0.0.1:{server.server_address[1]}/route'
+	yield server
+	server.shutdown()
+
+
+def test_batched_keep_alive(stub_server):
+	def route(batch, session):
+		return session.post(stub_server.url, json=batch).raise_for_status().json()
+
+	pairs = [(i, i * 3) for i in range(50)]
+	result = list(http_pooler(route, pairs, threads=4, batch_size=10, ordered=True))
+	assert result == [(b - a, (a, b)) for a, b in pairs]
+	assert stub_server.requests == 5
+	assert len(stub_server.clients) <= 4  # connections are reused
+
+
+def test_throttling_retried(stub_server):
+	stub_server.throttle = 2
+
+	def route(pair, session):
+		return session.post(stub_server.url, json=[pair]).raise_for_status().json()[0]
+
+	result = dict((d, r) for r, d in http_pooler(route, [(0, 5), (1, 2)], threads=2, backoff=0.01))
+	assert result == {(0, 5): 5, (1, 2): 1}
+
+
+def test_errors_ignore(stub_server):
+	stub_server.throttle = 100
+
+	def route(pair, session):
+		return session.post(stub_server.url, json=[pair]).raise_for_status().json()[0]
+
+	result = list(http_pooler(route, [(0, 5)], threads=2, retries=0, errors='ignore'))
+	assert result == [(None, (0, 5))]
+	with pytest.raises(HttpError):
+		list(http_pooler(route, [(0, 5)], threads=2, retries=0))
+
+
+def test_token_bucket():
+	bucket = TokenBucket(rate=50, burst=1)
+	start = time.monotonic()
+	for i in range(6):
+		bucket.acquire()
+	assert time.monotonic() - start >= 0.09
+
+
+def test_adaptive_limit():
+	limit = AdaptiveLimit(8)
+	limit.throttle()
+	limit.throttle()
+	assert limit.limit == 2
+	for i in range(2):
+		limit.success()
+	assert limit.limit == 3
+
+
+def test_timeout_closes_connection():
+	server = socket.create_server(('127.0.0.1', 0))  # accepts connections, never answers
+	session = HttpSession(timeout=0.2)
+	opened = []
+	connect = session._connect
+	session._connect = lambda *args: opened.append(connect(*args)) or opened[-1]
+	try:
+		with pytest.raises(OSError):
+			session.get(f'http://127.0.0.1:{server.getsockname()[1]}/')
+	finally:
+		server.close()
+	assert len(opened) == 1 and opened[0].sock is None
+	assert all(pool.empty() for pool in session._pools.values())
@@ -0,0 +1,54 @@
+from aktash.metrics import StageMeter, StreamMetrics
+from queue import Queue
+
+
+def test_stage_meters_aggregate():
+	q = Queue()
+	watched = Queue()
+	watched.put(1)
+	metrics = StreamMetrics(q, {'input_q': watched})
+
+	for i in range(2):
+		meter = StageMeter('worker', q)
+		meter.count_in([1, 2, 3])
+		with meter.busy():
+			pass
+		meter.count_out([1, 2])
+		meter.close()
+
+	metrics.collect()
+	report = metrics.report()
+	worker = report['stages']['worker']
+	assert worker['rows_in'] == 6
+	assert worker['chunks_in'] == 2
+	assert worker['rows_out'] == 4
+	assert worker['finished'] == 2
+	assert report['queues']['input_q']['last'] == 1
+
+	prom = metrics.prometheus()
+	assert 'aktash_stream_rows_in_total{stage="worker"} 6' in prom
+	assert 'aktash_stream_queue_depth{queue="input_q"} 1' in prom
+	assert 'worker x1' in metrics.summary()  # both meters ran in this process
+
+
+def test_disabled_meter():
+	meter = StageMeter('reader')
+	meter.count_out([1])
+	meter.close()
+	assert meter.counters == {}
+
+
+def slow_copy(df):
+	import time
+	time.sleep(0.3)
+	return df
+
+
+def test_queue_depths_sampled_during_iteration():
+	from aktash.drivers.csv import CsvReader
+	from aktash.mr import DfStream
+
+	stream = DfStream(CsvReader('tests/data/match-points.csv', chunk_size=1), workers=2, metrics=True).map(slow_copy)
+	assert sum(len(df) for df in stream) == 9
+	for name in ('input_q', 'output_q'):
+		assert len({t for t, depth in stream.metrics.depths[name]}) > 1
@@ -0,0 +1,54 @@
+from aktash import read
+from aktash.op.sjoin import main as sjoin, nearest_pairs
+import geopandas as gpd
+import numpy as np
+import shapely
+
+
+def brute_force(main_df, other_df, k):
+	d = shapely.distance(np.asarray(main_df.geometry.values)[:, None], np.asarray(other_df.geometry.values)[None, :])
+	return np.sort(d, axis=1)[:, :k]
+
+
+def test_nearest_pairs_k():
+	rng = np.random.default_rng(1)
+	points = gpd.GeoDataFrame(geometry=shapely.points(rng.random((300, 2)) * 100))
+	others = gpd.GeoDataFrame(geometry=shapely.points(rng.random((500, 2)) * 100))
+
+	pairs = nearest_pairs(points, others)
+	assert list(pairs.counts()) == [1] * 300
+	assert np.allclose(pairs.distance, brute_force(points, others, 1)[:, 0])
+
+	pairs = nearest_pairs(points, others, k=5)
+	assert list(pairs.counts()) == [5] * 300
+	assert np.allclose(pairs.distance.reshape(-1, 5), brute_force(points, others, 5))
+	assert (np.diff(pairs.main) >= 0).all()
+
+
+def test_nearest_pairs_max_distance():
+	points = read('tests/data/match-points.csv')
+	polys = read('tests/data/match-simple-polys.csv')
+	pairs = nearest_pairs(points, polys, k=2, max_distance=0.02)
+	# points inside the polygons, B, E and H are 0.08 degrees away
+	assert list(pairs.counts()) == [1, 0, 1, 1, 0, 1, 1, 0, 1]
+	assert (pairs.distance == 0).all()
+
+	pairs = nearest_pairs(points, polys, k=2)
+	assert list(pairs.counts()) == [2] * 9
+
+
+def test_sjoin_nearest():
+	points = read('tests/data/match-points.csv')
+	polys = read('tests/data/match-simple-polys.csv')
+	result = sjoin(points, polys, how='nearest', other_columns='name', distance_column='dist')
+	assert len(result) == 9
+	assert list(result['name_other']) == ['Y', 'Y', 'X', 'Y', 'Y', 'X', 'Y', 'Y', 'X']
+	assert result['dist'].max() < 0.09
+
+
+def test_sjoin_nearest_filtering_preprocessor():
+	points = read('tests/data/match-points.csv')
+	polys = read('tests/data/match-simple-polys.csv')
+	result = sjoin(points, polys, how='nearest', other_columns='name', main_df_preprocessor=lambda df: df[df.name >= 'E'])
+	assert list(result['name']) == ['E', 'F', 'G', 'H', 'I']
+	assert list(result['name_other']) == ['Y', 'X', 'Y', 'Y', 'X']
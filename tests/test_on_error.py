@@ -0,0 +1,23 @@
+from aktash.drivers.csv import CsvReader
+from aktash.mr import DfStream
+import pandas as pd
+
+
+def fail_on_e(df):
+	if (df['name'] == 'E').any():
+		raise ValueError('bad row')
+	return df
+
+
+def test_bisect_to_dead_letter(tmp_path):
+	dead = str(tmp_path / 'dead.csv')
+	stream = DfStream(CsvReader('tests/data/match-points.csv', chunk_size=4), workers=2, metrics=True)
+	stream.map(fail_on_e).on_error(retries=1, dead_letter=dead)
+	names = sorted(n for df in stream for n in df['name'])
+	assert names == ['A', 'B', 'C', 'D', 'F', 'G', 'H', 'I']
+
+	failed = pd.read_csv(dead)
+	assert list(failed['name']) == ['E']
+	assert list(failed['__chunk__']) == [1]
+	assert 'bad row' in failed['__traceback__'][0]
+	assert stream.metrics.report()['stages']['worker']['rows_failed'] == 1
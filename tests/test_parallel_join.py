@@ -0,0 +1,45 @@
+from aktash import read
+from aktash.op.sjoin import main, parallel_pairs
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+
+
+def test_parallel_pairs_both_ways():
+	rng = np.random.default_rng(0)
+	polys = shapely.buffer(shapely.points(rng.uniform(0, 10, 50), rng.uniform(0, 10, 50)), 1)
+	points = shapely.points(rng.uniform(0, 10, 500), rng.uniform(0, 10, 500))
+	for op, left, right in (('within', points, polys), ('contains', polys, points)):
+		expected = shapely.STRtree(right).query(left, predicate=op)
+		expected = expected[:, np.lexsort((expected[1], expected[0]))]
+		assert np.array_equal(parallel_pairs(left, right, op, workers=2, chunk_size=64), expected)
+
+
+def test_parallel_main():
+	points = read('tests/data/match-points.csv')
+	polys = read('tests/data/match-simple-polys.csv')
+	result = main(points, polys, workers=2)
+	assert set(result[result['name_other'] == 'X']['name']) == {'C', 'F', 'I'}
+	assert len(result) == 6
+
+	with pytest.raises(ValueError):
+		main(points, polys, how='right', workers=2)
+
+
+def filtered_points():
+	# a, b, e, f are in polygon Y, c, d are outside both polygons
+	return gpd.GeoDataFrame({'name': list('abcdef')},
+		geometry=shapely.points([[82.9, 54.9], [83.0, 54.9], [82.9, 55.0], [83.0, 55.0], [83.1, 54.9], [82.95, 54.9]]))
+
+
+def drop_ab(df):
+	return df[df.name >= 'c']
+
+
+def test_parallel_main_filtering_preprocessor():
+	polys = read('tests/data/match-simple-polys.csv')
+	expected = main(filtered_points(), polys, other_columns='name', main_df_preprocessor=drop_ab)
+	result = main(filtered_points(), polys, other_columns='name', main_df_preprocessor=drop_ab, workers=2)
+	assert sorted(expected['name']) == sorted(result['name']) == ['e', 'f']
+	assert set(result['name_other']) == {'Y'}
@@ -0,0 +1,58 @@
+from aktash import read
+from aktash.partition import ColumnPartition, ShardPartition, TileGrid, TilePartition, make_partition, partition_name, quadkey, route, tile_keys
+
+
+def test_column_partition():
+	points = read('tests/data/match-points.csv')
+	partition = make_partition('number')
+	assert isinstance(partition, ColumnPartition)
+	parts = dict(partition.split(points, 0))
+	assert set(parts) == {1, 2, 3}
+	assert set(parts[1]['name']) == {'A', 'D', 'G'}
+
+
+def test_tile_partition():
+	points = read('tests/data/match-points.csv')
+	keys = tile_keys(points['geometry'], 1)
+	assert set(keys) == {'82_54', '82_55', '83_54', '83_55'}
+
+	parts = dict(TilePartition(1).split(points, 0))
+	assert sum(len(p) for p in parts.values()) == len(points)
+
+
+def test_shard_partition():
+	shard = ShardPartition(25, chunk_size=10)
+	assert [next(shard.split(None, chunk))[0] for chunk in range(6)] == [0, 0, 0, 1, 1, 2]
+
+
+def test_route_and_name():
+	assert route('region 1', 4) == route('region 1', 4) < 4
+	assert partition_name('a/b c') == 'a_b_c'
+
+
+def test_tile_grid_halo():
+	points = read('tests/data/match-points.csv')
+	grid = TileGrid(1)
+	assert len(grid.assign(points)) == len(points)
+
+	tiled = grid.assign(points, halo=0.15)
+	own = tiled[~tiled['__halo__']]
+	assert len(own) == len(points)
+	# C (82.9, 55.1) is 0.1 from the x=83 edge and from the y=55 edge, so it's copied to 3 neighbour tiles
+	assert sorted(tiled[tiled['name'] == 'C']['__tile__']) == ['82_54', '82_55', '83_54', '83_55']
+
+
+def test_quadkey():
+	assert quadkey(1, 1, 1) == '3'
+	cols, rows = TileGrid(zoom=1).index([0.5], [0.5])
+	assert (cols[0], rows[0]) == (1, 0)
+
+
+def test_write_keys_with_same_name(tmp_path):
+	from aktash.mr import DfStream
+	import pandas as pd
+
+	df = pd.DataFrame({'key': ['a b', 'a/b', 'a:b', 'a?b'] * 3, 'value': range(12)})
+	files = DfStream(df, workers=2).write(str(tmp_path / '{partition}.csv'), partition='key', writers=4)
+	assert [(f['partition'], f['rows']) for f in files] == [('a_b', 12)]
+	assert sorted(pd.read_csv(str(tmp_path / 'a_b.csv'))['value']) == list(range(12))
@@ -0,0 +1,47 @@
+from aktash import mr
+from aktash.drivers.csv import CsvReader
+from aktash.pool import WorkerPool
+import os
+import pandas as pd
+import pytest
+
+LOOKUP = {}
+
+
+def build_lookup():
+	LOOKUP['pid'] = os.getpid()
+
+
+def add_pid(df):
+	df['pid'] = LOOKUP['pid']
+	return df
+
+
+def fail(df):
+	raise ValueError('broken chunk')
+
+
+def chunks():
+	# generators can't be pickled to be sent to the pool, readers can
+	return CsvReader('tests/data/match-points.csv', chunk_size=2)
+
+
+def test_pool_runs_streams_in_a_row():
+	with WorkerPool(2, initializer=build_lookup) as pool:
+		pids = set()
+		for i in range(3):
+			result = pd.concat(list(mr.DfStream(chunks(), pool=pool).map(add_pid)))
+			assert sorted(result['name']) == list('ABCDEFGHI')
+			pids.add(frozenset(result['pid']))
+
+		assert len(pids) == 1  # same processes every time
+		assert set(pool.processes[i].pid for i in range(2, 4)) >= set(next(iter(pids)))
+
+
+def test_pool_recovers_after_error(tmp_path):
+	with WorkerPool(2, initializer=build_lookup) as pool:
+		with pytest.raises(ValueError):
+			mr.DfStream(chunks(), pool=pool).map(fail).write(str(tmp_path / 'fail.csv'))
+
+		result = pd.concat(list(mr.DfStream(chunks(), pool=pool).map(add_pid)))
+		assert len(result) == 9
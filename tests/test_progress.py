@@ -0,0 +1,54 @@
+from aktash.progress import Progress
+
+
+def _report(done, written):
+	return {'stages': {
+		'reader': {'rows_out': 100, 'rows_done': 100, 'rows_in': 0},
+		'worker': {'rows_out': done, 'rows_done': done, 'rows_in': done},
+		'writer': {'rows_out': 0, 'rows_done': written, 'rows_in': written + 5},  # 5 rows not written yet
+	}}
+
+
+def test_progress_rate_and_eta():
+	progress = Progress(total=100)
+	progress._samples = [(0.0, 0)]
+	progress.update(_report(40, 30))
+	progress._samples[-1] = (2.0, 40)  # 40 rows in 2 seconds
+
+	assert progress.done == 40
+	assert progress.written == 30
+	assert progress.stages['reader'] == 100
+	assert progress.fraction == 0.4
+	assert progress.rate == 20
+	assert progress.eta == 3
+	assert '40/100 rows done' in progress.summary()
+
+
+def test_progress_without_total():
+	progress = Progress()
+	progress.update(_report(10, 10))
+	assert progress.fraction is None
+	assert progress.eta is None
+
+
+def test_auto_backend_keeps_reader_total():
+	from aktash.drivers.csv import CsvReader
+	from aktash.mr import DfStream
+
+	stream = DfStream(CsvReader('tests/data/match-points.csv', chunk_size=4), workers=2, metrics=True, backend='auto')
+	stream.map(lambda df: df)
+	assert sum(len(df) for df in stream) == 9
+	assert stream.backend in ('thread', 'process')
+	assert stream.progress.total == 9
+	assert stream.gen.chunk_size == 4
+	assert '9/9 rows done' in stream.progress.summary()
+
+
+def test_written_counts_rows_on_disk(tmp_path):
+	from aktash.drivers.csv import CsvReader
+	from aktash.mr import DfStream
+
+	stream = DfStream(CsvReader('tests/data/match-points.csv', chunk_size=2), workers=2, metrics=True)
+	stream.map(lambda df: df).write(str(tmp_path / 'out.csv'))
+	assert stream.progress.written == 9
+	assert stream.metrics.report()['stages']['writer']['rows_done'] == 9
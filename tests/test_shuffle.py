@@ -0,0 +1,42 @@
+from aktash.shuffle import SpillBuffer, apply_groups
+import os
+import pandas as pd
+
+
+def test_spill_buffer_keeps_keys_together(tmp_path):
+	buffer = SpillBuffer('key', spill_rows=5, buckets=4, spill_dir=str(tmp_path))
+	for i in range(10):
+		buffer.add(pd.DataFrame({'key': [i % 3, (i + 1) % 3, 7], 'value': [1, 1, 1]}))
+
+	assert buffer.spilled  # more than 5 rows were added
+	seen = set()
+	total = 0
+	for df in buffer.groups():
+		keys = set(df['key'])
+		assert not keys & seen  # each key is in one bucket only
+		seen |= keys
+		total += len(df)
+
+	assert total == 30
+	buffer.cleanup()
+	assert os.listdir(str(tmp_path)) == []
+
+
+def test_apply_groups():
+	df = pd.DataFrame({'key': [1, 1, 2, 3], 'value': [1, 2, 3, 4]})
+
+	def total(group):
+		if group['key'].iloc[0] == 3:
+			return None
+		return {'key': group['key'].iloc[0], 'value': group['value'].sum()}
+
+	result = apply_groups(df, 'key', [total]).set_index('key')['value'].to_dict()
+	assert result == {1: 3, 2: 3}
+	assert apply_groups(df, 'key', [lambda g: None]) is None
+
+
+def test_apply_groups_missing_keys():
+	df = pd.DataFrame({'key': [1, None, 1, None], 'value': [1, 2, 3, 4]})
+	result = apply_groups(df, 'key', [lambda g: {'key': g['key'].iloc[0], 'value': g['value'].sum()}])
+	assert sorted(result['value']) == [4, 6]
+	assert result['key'].isna().sum() == 1
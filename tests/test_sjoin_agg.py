@@ -0,0 +1,33 @@
+from aktash.op.sjoin import main as sjoin
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+
+def frames():
+	rng = np.random.default_rng(2)
+	points = gpd.GeoDataFrame({'value': rng.integers(0, 100, 500), 'weight': rng.random(500)},
+		geometry=shapely.points(rng.random((500, 2)) * 10))
+	cells = gpd.GeoDataFrame({'name': [f'c{i}' for i in range(30)]},
+		geometry=shapely.buffer(shapely.points(rng.random((30, 2)) * 10), 2))
+	return cells, points
+
+
+def test_combinable_agg():
+	cells, points = frames()
+	agg = {'value': 'sum', 'weight': 'mean', 'index_other': 'max'}
+	expected = sjoin(cells, points, agg=agg)
+	result = sjoin(cells, points, agg=agg, agg_chunk_size=97)
+	assert len(expected) == len(result) > 20
+	assert list(result) == list(expected)
+	pd.testing.assert_frame_equal(pd.DataFrame(result.drop(columns='geometry')), pd.DataFrame(expected.drop(columns='geometry')))
+	assert shapely.equals(np.asarray(result.geometry.values), np.asarray(expected.geometry.values)).all()
+
+
+def test_other_agg():
+	cells, points = frames()
+	agg = '{"value": "median", "weight": "nunique"}'
+	expected = sjoin(cells, points, agg=agg)
+	result = sjoin(cells, points, agg=agg, agg_chunk_size=50)
+	pd.testing.assert_frame_equal(pd.DataFrame(result.drop(columns='geometry')), pd.DataFrame(expected.drop(columns='geometry')))
@@ -0,0 +1,27 @@
+from aktash import read
+from aktash.op.sjoin import _sj, sjoin_pairs
+import numpy as np
+
+
+def test_sjoin_pairs():
+	points = read('tests/data/match-points.csv')
+	polys = read('tests/data/match-simple-polys.csv')
+	pairs = sjoin_pairs(points, polys, distance=True)
+
+	assert len(pairs) == 6
+	assert list(pairs.counts()) == [1, 0, 1, 1, 0, 1, 1, 0, 1]
+	assert list(pairs.unmatched_main()) == [1, 4, 7]
+	assert (pairs.distance == 0).all()
+	assert list(pairs.values(polys, 'name', agg='first')) == ['Y', 'X', 'Y', 'X', 'Y', 'X']
+
+	frame = pairs.frame(points, polys, ['name'], ['name'])
+	assert list(frame) == ['name', 'index_main', 'index_other', 'name_other', 'distance']
+	assert set(frame[frame['name_other'] == 'X']['name']) == {'C', 'F', 'I'}
+
+
+def test_sj_left():
+	points = read('tests/data/match-points.csv')
+	polys = read('tests/data/match-simple-polys.csv')
+	joined = _sj(points, polys, how='left')
+	assert len(joined) == 9
+	assert np.isnan(joined['index_right']).sum() == 3
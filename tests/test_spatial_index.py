@@ -0,0 +1,80 @@
+from aktash import read
+from aktash.op.sjoin import stream_join
+from aktash.spatial_index import DiskIndex
+import numpy as np
+import os
+import pandas as pd
+import pickle
+import pytest
+import shapely
+import shutil
+
+
+def test_disk_index_matches_strtree(tmp_path):
+	rng = np.random.default_rng(0)
+	polys = shapely.buffer(shapely.points(rng.uniform(0, 10, 500), rng.uniform(0, 10, 500)), 0.3)
+	points = shapely.points(rng.uniform(0, 10, 1000), rng.uniform(0, 10, 1000))
+	df = pd.DataFrame({'geometry': polys})
+
+	index = DiskIndex.open(df, index_dir=str(tmp_path))
+	result = index.query(points)
+	expected = shapely.STRtree(polys).query(points, predicate='intersects')
+	assert np.array_equal(result, expected[:, np.lexsort((expected[1], expected[0]))])
+
+	# opened again, the same content is loaded, not built
+	assert DiskIndex.open(df, index_dir=str(tmp_path)).path == index.path
+	assert len(os.listdir(str(tmp_path))) == 1
+	assert np.array_equal(pickle.loads(pickle.dumps(index)).query(points), result)
+
+
+def test_disk_index_of_file(tmp_path):
+	source = str(tmp_path / 'polys.csv')
+	shutil.copy('tests/data/match-simple-polys.csv', source)
+	points = read('tests/data/match-points.csv')
+
+	result = pd.concat(list(stream_join([points], None, index=source)))
+	assert os.path.isdir(source + '.aktidx')
+	assert set(result[result['name_other'] == 'X']['name']) == {'C', 'F', 'I'}
+
+
+def only_x(df):
+	return df[df.name == 'X']
+
+
+def test_disk_index_filtering_preprocessor(tmp_path):
+	source = str(tmp_path / 'polys.csv')
+	shutil.copy('tests/data/match-simple-polys.csv', source)
+	points = read('tests/data/match-points.csv')
+
+	result = pd.concat(list(stream_join([points], None, index=source, other_df_preprocessor=only_x)))
+	assert sorted(zip(result['name'], result['name_other'])) == [('C', 'X'), ('F', 'X'), ('I', 'X')]
+
+
+def test_disk_index_rebuilt_for_changed_preprocessor(tmp_path):
+	df = pd.DataFrame({'geometry': shapely.points(np.arange(10), np.arange(10)), 'name': list('abcdefghij')})
+	namespace = {}
+	exec('def pre(df):\n\treturn df[df.name >= "c"]', namespace)
+	first = DiskIndex.open(df, index_dir=str(tmp_path), preprocessor=namespace['pre'])
+	exec('def pre(df):\n\treturn df[df.name >= "e"]', namespace)
+	second = DiskIndex.open(df, index_dir=str(tmp_path), preprocessor=namespace['pre'])
+	assert first.path != second.path
+	assert len(first) == 8 and len(second) == 6
+
+
+def test_disk_index_source_path_and_decoded_limit(tmp_path, monkeypatch):
+	source = str(tmp_path / 'polys.csv')
+	shutil.copy('tests/data/match-simple-polys.csv', source)
+	points = read('tests/data/match-points.csv')
+	monkeypatch.chdir(tmp_path)
+	index = DiskIndex.open('polys.csv')
+	assert index.source == source
+
+	monkeypatch.chdir('/')
+	index = DiskIndex(index.path, max_decoded=1)
+	assert len(index.other_df) == 2
+	for box in (shapely.box(82.8, 55.05, 83.2, 55.2), shapely.box(82.8, 54.8, 83.2, 54.95)):
+		assert len(index.query([box])[0]) == 1
+		assert index._is_decoded.sum() <= 1
+
+	with pytest.raises(ValueError):
+		next(stream_join([points], None, index=source, other_row_preprocessor=lambda row: row.geometry))
@@ -0,0 +1,60 @@
+from aktash import read
+from aktash.op.sjoin import JoinIndex, stream_join
+import pandas as pd
+
+
+def test_stream_join_chunks():
+	points = read('tests/data/match-points.csv')
+	polys = read('tests/data/match-simple-polys.csv')
+	index = JoinIndex(polys)
+	chunks = [points.iloc[i:i + 4] for i in range(0, len(points), 4)]
+
+	result = pd.concat(list(stream_join(chunks, None, index=index)))
+	assert set(result[result['name_other'] == 'X']['name']) == {'C', 'F', 'I'}
+	assert set(result[result['name_other'] == 'Y']['name']) == {'A', 'D', 'G'}
+
+	left = pd.concat(list(stream_join(chunks, None, how='left', index=index)))
+	assert len(left) == 9
+	assert set(left[left['name_other'].isna()]['name']) == {'B', 'E', 'H'}
+
+
+def test_stream_join_right_and_agg():
+	points = read('tests/data/match-points.csv')
+	polys = read('tests/data/match-simple-polys.csv')
+
+	right = pd.concat(list(stream_join([points.iloc[:1]], polys, how='right')))
+	assert list(right['name_other']) == ['Y', 'X']  # X matched nothing, added at the end
+
+	result = pd.concat(list(stream_join([polys], points, agg={'number': 'mean', 'name_other': 'count'})))
+	assert result[result['name'] == 'X'].number.values[0] == 3
+	assert result[result['name'] == 'Y'].number.values[0] == 1
+
+
+def test_stream_join_filtering_preprocessors():
+	from aktash.op.sjoin import SubdividedIndex
+	points = read('tests/data/match-points.csv')
+	polys = read('tests/data/match-simple-polys.csv')
+
+	result = pd.concat(list(stream_join([points], polys, main_df_preprocessor=lambda df: df[df.name >= 'E'])))
+	assert sorted(zip(result['name'], result['name_other'])) == [('F', 'X'), ('G', 'Y'), ('I', 'X')]
+
+	only_x = lambda df: df[df.name == 'X']
+	for index in (JoinIndex(polys, only_x), SubdividedIndex(polys, only_x, max_vertices=8)):
+		result = pd.concat(list(stream_join([points], None, index=index)))
+		assert sorted(zip(result['name'], result['name_other'])) == [('C', 'X'), ('F', 'X'), ('I', 'X')]
+
+	right = pd.concat(list(stream_join([points.iloc[:3]], polys, how='right', other_df_preprocessor=only_x)))
+	assert list(right['name_other']) == ['X', 'Y']  # Y is dropped by the preprocessor, added as unmatched
+
+
+def test_stream_join_dataframe_chunks():
+	import pytest
+	points = read('tests/data/match-points.csv')
+	polys = read('tests/data/match-simple-polys.csv')
+
+	chunks = list(stream_join(points, polys, how='left', chunk_size=4))
+	assert [len(c) for c in chunks] == [4, 4, 1]
+	assert list(pd.concat(chunks)['name']) == list(points['name'])
+
+	with pytest.raises(ValueError):
+		next(stream_join(points, polys, how='cross'))
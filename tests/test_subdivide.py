@@ -0,0 +1,49 @@
+from aktash import read
+from aktash.op.sjoin import SubdividedIndex, main as sjoin, sjoin_pairs, subdivide
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+
+
+def flower(n=2000):
+	angles = np.linspace(0, 2 * np.pi, n, endpoint=False)
+	radius = 0.8 + 0.2 * np.sin(12 * angles)
+	return shapely.Polygon(np.column_stack([radius * np.cos(angles), radius * np.sin(angles)]))
+
+
+def test_subdivide():
+	polygon = flower()
+	pieces, rows = subdivide([polygon, shapely.box(5, 5, 6, 6)], max_vertices=64)
+	assert (shapely.get_num_coordinates(pieces) <= 64).all()
+	assert set(rows) == {0, 1} and (rows == 1).sum() == 1
+	assert np.isclose(shapely.area(pieces[rows == 0]).sum(), polygon.area)
+
+
+def test_subdivided_index():
+	rng = np.random.default_rng(0)
+	others = gpd.GeoDataFrame({'geometry': [flower(), shapely.box(0.5, 0.5, 2, 2)]})
+	points = gpd.GeoDataFrame(geometry=shapely.points(rng.random((2000, 2)) * 3 - 1.5))
+	# points on the cuts, on the boundaries and lines crossing pieces
+	points = pd_concat(points, [shapely.Point(0, 0), shapely.Point(0.5, 1), shapely.Point(0.5, 0), shapely.LineString([(-0.5, -0.1), (0.5, 0.1)])])
+	index = SubdividedIndex(others, max_vertices=32)
+	assert len(index.pieces) > 50
+
+	for op in ('intersects', 'within', 'covered_by', 'touches'):
+		expected = sjoin_pairs(points, others, op)
+		got = sjoin_pairs(points, others, op, index=index)
+		assert (got.main == expected.main).all() and (got.other == expected.other).all(), op
+
+
+def pd_concat(df, geometries):
+	return gpd.GeoDataFrame(geometry=np.concatenate([np.asarray(df.geometry.values), geometries]))
+
+
+def test_sjoin_max_vertices():
+	points = read('tests/data/match-points.csv')
+	polys = read('tests/data/match-simple-polys.csv')
+	result = sjoin(points, polys, other_columns='name', max_vertices=8)
+	assert sorted(result['name']) == ['A', 'C', 'D', 'F', 'G', 'I']
+
+	with pytest.raises(ValueError):
+		sjoin(points, polys, how='right', max_vertices=8)
@@ -0,0 +1,132 @@
+from aktash.cache import ResultCache
+from aktash.threader import iter_threader, pooler, threader
+import itertools
+import time
+
+
+def test_pooler_ordered():
+	def slow(x):
+		time.sleep(0.01 * (5 - x % 5))
+		return x * 2
+
+	result = list(pooler(slow, range(20), threads=4, ordered=True))
+	assert result == [(x * 2, x) for x in range(20)]
+
+
+def test_pooler_lazy_window():
+	taken = []
+
+	def items():
+		for i in itertools.count():
+			taken.append(i)
+			yield i
+
+	results = pooler(lambda x: x, items(), threads=2, window=3)
+	first = [next(results) for i in range(5)]
+	results.close()
+	assert sorted(d for r, d in first) == list(range(5))
+	assert len(taken) <= 5 + 3
+
+
+def test_pooler_errors_ignore():
+	def fail_odd(x):
+		if x % 2:
+			raise ValueError(x)
+		return x
+
+	result = sorted(pooler(fail_odd, range(6), threads=3, errors='ignore'), key=lambda r: r[1])
+	assert result == [(0, 0), (None, 1), (2, 2), (None, 3), (4, 4), (None, 5)]
+
+
+def test_threader_crawl():
+	# each number adds its children, some of them are added twice
+	def crawl(n, queue):
+		time.sleep(0.001)
+		if n < 20:
+			queue.put(n * 2)
+			queue.put(n * 2 + 1)
+			queue.put(n + 1)
+		return n
+
+	result = threader(crawl, [1], threads_number=4, dedup=True)
+	assert sorted(result) == list(range(1, 40))
+
+
+def test_iter_threader_priority():
+	def worker(n, queue):
+		if n == 0:
+			for i in (5, 3, 4):
+				queue.put(i, priority=i)
+		return n
+
+	assert list(iter_threader(worker, [0], threads_number=1)) == [0, 3, 4, 5]
+
+
+def test_pooler_cache(tmp_path):
+	calls = []
+
+	def double(x):
+		calls.append(x)
+		return x * 2
+
+	path = str(tmp_path / 'cache.sqlite')
+	assert sorted(pooler(double, range(5), threads=2, cache=path)) == [(x * 2, x) for x in range(5)]
+	assert sorted(pooler(double, range(7), threads=2, cache=path)) == [(x * 2, x) for x in range(7)]
+	assert sorted(calls) == [0, 1, 2, 3, 4, 5, 6]  # only new items were computed
+
+
+def test_threader_cache_replays_queue(tmp_path):
+	cache = ResultCache(str(tmp_path / 'cache.sqlite'))
+	calls = []
+
+	def crawl(n, queue):
+		calls.append(n)
+		if n < 3:
+			queue.put(n + 1)
+		return n
+
+	assert sorted(threader(crawl, [0], threads_number=2, cache=cache)) == [0, 1, 2, 3]
+	calls.clear()
+	assert sorted(threader(crawl, [0], threads_number=2, cache=cache)) == [0, 1, 2, 3]
+	assert calls == []
+	assert cache.hits == 4
+
+
+def square(x):
+	if x == 13:
+		raise ValueError(x)
+	return x * x
+
+
+def test_pooler_processes():
+	result = list(pooler(square, range(30), threads=2, executor='process', batch_size=4, ordered=True, errors='ignore'))
+	assert result == [(None if x == 13 else x * x, x) for x in range(30)]
+
+
+def test_pooler_cache_hits_not_delayed(tmp_path):
+	import time
+
+	def slow(x):
+		if x == 10:
+			time.sleep(0.5)
+		return x
+
+	path = str(tmp_path / 'cache.sqlite')
+	list(pooler(slow, [0, 1], threads=2, cache=path))
+	start = time.monotonic()
+	results = pooler(slow, [0, 10, 1], threads=2, cache=path)
+	assert [next(results)[1], next(results)[1]] == [0, 1]  # hits come before the slow miss is done
+	assert time.monotonic() - start < 0.4
+	assert next(results) == (10, 10)
+
+
+def test_pooler_one_thread(tmp_path):
+	def fail_odd(x):
+		if x % 2:
+			raise ValueError(x)
+		return x
+
+	path = str(tmp_path / 'cache.sqlite')
+	for threads in (1, 4):
+		result = list(pooler(fail_odd, range(6), threads=threads, errors='ignore', ordered=True, cache=path))
+		assert result == [(0, 0), (None, 1), (2, 2), (None, 3), (4, 4), (None, 5)]